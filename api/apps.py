@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save
+from django.test.signals import setting_changed
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import cache, db, graph_index, hashers, metrics
+
+        post_save.connect(cache.reset_new_user, sender=self.get_model('User'), dispatch_uid='friend_cache_reset_new_user')
+        # Индекс графа строится лениво при первом обращении; при смене настроек (override_settings в тестах) он сбрасывается
+        setting_changed.connect(graph_index.reset, dispatch_uid='friend_graph_index_reset')
+        setting_changed.connect(hashers.reset, dispatch_uid='password_hash_pool_reset')
+        connection_created.connect(db.apply_sqlite_pragmas, dispatch_uid='sqlite_pragmas')
+        connection_created.connect(metrics.install_on_connect, dispatch_uid='request_metrics_db_wrapper')
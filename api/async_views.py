@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .models import User, Friendship
+from . import counters
+from . import events as friend_events
+from . import renderers
+from . import tokens
+from .views import _events_params, _events_response, _friends_data, _page_params, _requests_data, _split_page
+
+
+# Асинхронные версии представлений чтения для запуска под ASGI: запросы к базе идут через
+# асинхронный ORM (aget, afirst, async for) и не занимают поток на все время обработки запроса.
+# Ответы совпадают с ответами синхронных представлений из api.views, но всегда читаются из базы:
+# кэш и индекс графа в памяти процесса заполняются синхронно
+#
+# Декораторы login_required и csrf_exempt в Django 4.2 не поддерживают async-представления,
+# поэтому проверка входа и признак csrf_exempt задаются здесь
+
+
+def _response(data, status):
+    return HttpResponse(renderers.dumps(data), status=status, content_type='application/json')
+
+
+def _async_view(view=None, method='POST'):
+    if view is None:
+        return lambda view: _async_view(view, method)
+
+    @wraps(view)
+    async def wrapper(request):
+        if request.method != method:
+            return _response({'error': 'Неверный метод запроса'}, 405)
+        # Сессии в Django 4.2 не имеют асинхронного API: пользователь загружается одним переходом в поток.
+        # Пользователь из токена (api.middleware.TokenAuthenticationMiddleware) уже готов и базы не требует,
+        # а с отклоненным токеном запрос, как и в middleware, остается анонимным без чтения сессии
+        if getattr(request, 'auth_token', None):
+            pass
+        elif tokens.enabled() and tokens.bearer_token(request) is not None:
+            request.user = AnonymousUser()
+        else:
+            request.user = await sync_to_async(get_user)(request)
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request)
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+async def _keyset_page(queryset, cursor, limit):
+    return _split_page([row async for row in queryset.filter(id__gt=cursor).order_by('id')[:limit + 1]], limit)
+
+
+# Получение списка друзей
+@_async_view
+async def get_friends(request):
+    page_params = _page_params(request)
+    if page_params is None:
+        return _response({'error': 'Некорректные параметры пагинации'}, 400)
+    rows, next_cursor = await _keyset_page(Friendship.objects.friends_of(request.user), *page_params)
+    return _response(_friends_data(rows, next_cursor), 200)
+
+
+# Получение списка входящих и исходящих заявок
+@_async_view
+async def get_friend_requests(request):
+    page_params = _page_params(request)
+    if page_params is None:
+        return _response({'error': 'Некорректные параметры пагинации'}, 400)
+    user = request.user
+    rows, next_cursor = await _keyset_page(Friendship.objects.requests_of(user), *page_params)
+    return _response(_requests_data(user, rows, next_cursor), 200)
+
+
+# Получение числа друзей, входящих и исходящих заявок
+@_async_view
+async def get_friend_counts(request):
+    counts = await User.objects.filter(id=request.user.id).values(*counters.FIELDS).aget()
+    return _response(counts, 200)
+
+
+# Получение статуса дружбы с юзером
+@_async_view
+async def view_friend_status(request):
+    friend_id = request.POST.get('friend_id')
+    if not str(friend_id).isdigit() or not await User.objects.filter(id=friend_id).aexists():
+        return _response({'error': 'Такого пользователя не существует'}, 400)
+    friend_id = int(friend_id)
+    friendship_status = await Friendship.objects.between(request.user.id, friend_id).values_list('status', flat=True).afirst()
+    if not friendship_status:
+        return _response({'error': 'У вас нет заявок с этим пользователем'}, 401)
+    return _response({'friend': friend_id, 'status': friendship_status}, 200)
+
+
+async def _events_page(user_id, since, limit):
+    return [row async for row in friend_events.since(user_id, since)[:limit + 1]]
+
+
+# Получение изменений дружбы после события since с ожиданием (long-poll): если новых событий нет,
+# ответ откладывается до их появления, но не дольше wait секунд (не больше FRIEND_EVENTS_MAX_WAIT)
+@_async_view
+async def get_friend_events(request):
+    params = _events_params(request)
+    try:
+        wait = min(float(request.POST.get('wait') or 0), settings.FRIEND_EVENTS_MAX_WAIT)
+    except ValueError:
+        params = None
+    if params is None:
+        return _response({'error': 'Некорректные параметры ленты событий'}, 400)
+    since, limit = params
+    if since is None:
+        last_event_id = await sync_to_async(friend_events.last_event_id)(request.user.id)
+        return _response({'events': [], 'last_event_id': last_event_id, 'has_more': False}, 200)
+    deadline = time.monotonic() + wait
+    rows = await _events_page(request.user.id, since, limit)
+    while not rows and time.monotonic() < deadline:
+        await asyncio.sleep(min(settings.FRIEND_EVENTS_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+        rows = await _events_page(request.user.id, since, limit)
+    return _response(_events_response(rows, since, limit), 200)
+
+
+def _sse_message(event):
+    return f'id: {event["id"]}\nevent: {event["type"]}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+
+
+async def _event_stream(user_id, since):
+    deadline = time.monotonic() + settings.FRIEND_EVENTS_STREAM_TIMEOUT
+    last_sent = time.monotonic()
+    yield f'retry: {int(settings.FRIEND_EVENTS_POLL_INTERVAL * 1000)}\n\n'
+    while time.monotonic() < deadline:
+        rows = await _events_page(user_id, since, settings.FRIEND_EVENTS_MAX_PAGE_SIZE)
+        for event in friend_events.serialize(rows):
+            since = event['id']
+            yield _sse_message(event)
+        if rows:
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= settings.FRIEND_EVENTS_HEARTBEAT:
+            last_sent = time.monotonic()
+            yield ': ping\n\n'
+        if len(rows) <= settings.FRIEND_EVENTS_MAX_PAGE_SIZE:
+            await asyncio.sleep(settings.FRIEND_EVENTS_POLL_INTERVAL)
+
+
+# Поток событий дружбы (server-sent events) для EventSource: события после since или заголовка Last-Event-ID,
+# который браузер передает при переподключении. Через FRIEND_EVENTS_STREAM_TIMEOUT секунд поток закрывается,
+# и клиент переподключается с id последнего полученного события.
+# Только под ASGI: под WSGI Django дочитывает асинхронный поток целиком до отправки, и клиент не получил бы
+# ничего до закрытия потока, а поток сервера был бы занят все это время. Там вместо потока - get_friend_events
+@_async_view(method='GET')
+async def friend_events_stream(request):
+    if not isinstance(request, ASGIRequest):
+        return _response({'error': 'Поток событий доступен только под ASGI, используйте get_friend_events'}, 501)
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    if since is None:
+        since = await sync_to_async(friend_events.last_event_id)(request.user.id)
+    elif not str(since).isdigit():
+        return _response({'error': 'Некорректные параметры ленты событий'}, 400)
+    response = StreamingHttpResponse(_event_stream(request.user.id, int(since)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,131 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import Friendship
+from . import routers
+from . import tokens
+
+
+# Кэш графа дружбы: для каждого пользователя хранятся отсортированные по id связи списки
+#   friends  - (id связи, id друга, имя друга)
+#   requests - (id связи, id собеседника, имя собеседника, статус, id отправителя)
+# При каждом изменении дружбы записи заменяются меткой сброса на FRIEND_CACHE_INVALIDATION_TIMEOUT секунд.
+# Списки кладутся в кэш через add, который не перезаписывает метку: чтение, загрузившее данные до фиксации
+# записи, не вернет их в кэш после сброса
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+_INVALIDATED = 'invalidated'
+
+
+def enabled():
+    return settings.FRIEND_CACHE_ENABLED
+
+
+def _cache():
+    return caches[settings.FRIEND_CACHE_ALIAS]
+
+
+def _key(kind, user_id):
+    return f'friend_graph:{kind}:{user_id}'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# Закэшированный список или None, если его нет или он сброшен
+def _get(key):
+    rows = _cache().get(key)
+    _count('misses' if rows is None or rows == _INVALIDATED else 'hits')
+    return None if rows == _INVALIDATED else rows
+
+
+def _get_or_load(kind, user_id, loader):
+    if not enabled():
+        return loader()
+    key = _key(kind, user_id)
+    rows = _get(key)
+    if rows is None:
+        # Кэш заполняется с основной базы: данные отстающей реплики остались бы в нем до истечения срока
+        with routers.primary():
+            rows = loader()
+        _cache().add(key, rows, settings.FRIEND_CACHE_TIMEOUT)
+    return rows
+
+
+def friends(user_id):
+    return _get_or_load('friends', user_id, lambda: list(Friendship.objects.friends_of(user_id).order_by('id')))
+
+
+def requests(user_id):
+    return _get_or_load('requests', user_id, lambda: list(Friendship.objects.requests_of(user_id).order_by('id')))
+
+
+# Список друзей только если кэш включен и список уже в нем, без загрузки из базы
+def cached_friends(user_id):
+    if not enabled():
+        return None
+    return _get(_key('friends', user_id))
+
+
+# Список заявок только если он уже есть в кэше, без загрузки из базы
+def cached_requests(user_id):
+    return _get(_key('requests', user_id))
+
+
+def friend_ids(user_id):
+    return {friend_id for _, friend_id, _ in friends(user_id)}
+
+
+# Статус связи с пользователем other_id или None, если связи нет
+def status(user_id, other_id):
+    for _, request_other_id, _, friendship_status, _ in requests(user_id):
+        if request_other_id == other_id:
+            return friendship_status
+    return None
+
+
+def invalidate(*user_ids):
+    markers = {_key(kind, user_id): _INVALIDATED for user_id in user_ids for kind in ('friends', 'requests')}
+    _cache().set_many(markers, settings.FRIEND_CACHE_INVALIDATION_TIMEOUT)
+    # Метка ставится заново после фиксации, чтобы ее срок отсчитывался от момента, когда запись стала видна
+    transaction.on_commit(lambda: _cache().set_many(markers, settings.FRIEND_CACHE_INVALIDATION_TIMEOUT))
+
+
+# Новый пользователь начинает с пустым графом: данные, оставшиеся в кэше под тем же id, не должны ему достаться
+def reset_new_user(sender, instance, created, **kwargs):
+    if created:
+        _cache().delete_many([_key(kind, instance.id) for kind in ('friends', 'requests')])
+
+
+def stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+
+# Включенные настройки, которым нужен общий для процессов кэш, при кэше в памяти процесса (locmem).
+# У каждого процесса gunicorn свой locmem: сброс списков, отзыв токенов, привязка чтений к основной базе
+# после записи и сессии в кэше видны только процессу, который их записал
+def process_local_settings():
+    def local(alias):
+        return isinstance(caches[alias], LocMemCache)
+
+    names = []
+    if enabled() and local(settings.FRIEND_CACHE_ALIAS):
+        names.append('FRIEND_CACHE_ENABLED')
+    if tokens.enabled() and local(settings.AUTH_TOKEN_CACHE_ALIAS):
+        names.append('AUTH_TOKENS_ENABLED')
+    if routers.enabled() and local('default'):
+        names.append('DB_REPLICA_HOST')
+    if settings.SESSION_ENGINE.endswith(('.cache', '.cached_db')) and local(settings.SESSION_CACHE_ALIAS):
+        names.append('SESSION_BACKEND')
+    return names
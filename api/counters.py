@@ -0,0 +1,70 @@
+from django.db import connection
+from django.db.models import Case, Count, F, Q, Value, When
+
+# Счетчики пользователя: друзья, входящие и исходящие ожидающие заявки.
+# Изменения копятся в словаре {id пользователя: [друзья, входящие, исходящие]}: состояние связи
+# вычитается до изменения и прибавляется после, затем разницы записываются выражениями F().
+# В словарь попадают оба пользователя каждой измененной связи, даже если их счетчики не изменились:
+# тем же запросом у них увеличивается graph_version, по которой представления списков строят ETag
+
+FIELDS = ('friend_count', 'incoming_pending_count', 'outgoing_pending_count')
+
+SAVE_BATCH_SIZE = 300
+
+
+def add(deltas, friendship, sign):
+    for user_id in (friendship.low_user_id, friendship.high_user_id):
+        deltas.setdefault(user_id, [0, 0, 0])
+    if friendship.status == 'accepted':
+        for user_id in (friendship.low_user_id, friendship.high_user_id):
+            deltas.setdefault(user_id, [0, 0, 0])[0] += sign
+    elif friendship.status == 'pending':
+        deltas.setdefault(friendship.other_user_id(friendship.initiator_id), [0, 0, 0])[1] += sign
+        deltas.setdefault(friendship.initiator_id, [0, 0, 0])[2] += sign
+
+
+# Все разницы записываются одним запросом UPDATE ... WHERE id IN (...) с CASE по id пользователя
+def save(deltas):
+    from .models import User
+
+    user_ids = list(deltas)
+    for start in range(0, len(user_ids), SAVE_BATCH_SIZE):
+        batch = user_ids[start:start + SAVE_BATCH_SIZE]
+        updates = {'graph_version': F('graph_version') + 1}
+        for number, field in enumerate(FIELDS):
+            whens = [When(id=user_id, then=Value(deltas[user_id][number])) for user_id in batch if deltas[user_id][number]]
+            if whens:
+                updates[field] = F(field) + Case(*whens, default=Value(0))
+        User.objects.filter(id__in=batch).update(**updates)
+
+
+# Пересчет счетчиков по таблице дружбы двумя запросами с группировкой;
+# записываются только расходящиеся значения, возвращается число исправленных пользователей.
+# Модели передаются параметрами, чтобы функцию можно было вызвать из миграции
+def recount(user_model, friendship_model, batch_size=1000):
+    counts = {}
+    for side in ('low_user', 'high_user'):
+        rows = friendship_model.objects.values_list(side, 'status').annotate(
+            total=Count('id'), outgoing=Count('id', filter=Q(initiator=F(side)))
+        ).order_by()
+        for user_id, friendship_status, total, outgoing in rows:
+            user_counts = counts.setdefault(user_id, [0, 0, 0])
+            if friendship_status == 'accepted':
+                user_counts[0] += total
+            elif friendship_status == 'pending':
+                user_counts[1] += total - outgoing
+                user_counts[2] += outgoing
+
+    changed = []
+    for user_id, *stored in user_model.objects.values_list('id', *FIELDS).iterator(chunk_size=batch_size):
+        actual = counts.get(user_id, [0, 0, 0])
+        if stored != actual:
+            changed.append((*actual, user_id))
+    # Построчный UPDATE по первичному ключу через executemany: bulk_update строит CASE на всю пачку,
+    # и после импорта, когда расходятся счетчики почти всех пользователей, это в десятки раз медленнее
+    table = connection.ops.quote_name(user_model._meta.db_table)
+    assignments = ', '.join(f'{field} = %s' for field in FIELDS)
+    with connection.cursor() as cursor:
+        for start in range(0, len(changed), batch_size):
+            cursor.executemany(f'UPDATE {table} SET {assignments} WHERE id = %s', changed[start:start + batch_size])
+    return len(changed)
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+
+# Настройка каждого нового соединения с SQLite прагмами из профиля settings.SQLITE_PRAGMAS
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
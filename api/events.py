@@ -0,0 +1,59 @@
+from django.db.models import Max
+
+from .models import FriendshipEvent
+
+
+# Журнал событий дружбы: api.friendships пишет события в той же транзакции, что и изменения связей,
+# а клиенты забирают новые события по id последнего полученного (since) вместо повторного чтения списков.
+# События пишутся в конце транзакции изменения, после обновления счетчиков и graph_version обоих пользователей
+# (api.counters): строки пользователей остаются заблокированными до фиксации, поэтому id событий одной ленты
+# растут в порядке фиксации и клиент с курсором since не пропустит событие
+
+SENT = 'sent'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+REMOVED = 'removed'
+
+# Вид события по новому статусу связи
+KINDS = {
+    'pending': SENT,
+    'accepted': ACCEPTED,
+    'rejected': REJECTED,
+}
+
+SAVE_BATCH_SIZE = 500
+
+
+def add(records, user_id, other_id, event_kind):
+    records.append(FriendshipEvent(user_id=user_id, other_user_id=other_id, by_user=True, kind=event_kind))
+    records.append(FriendshipEvent(user_id=other_id, other_user_id=user_id, by_user=False, kind=event_kind))
+
+
+def save(records):
+    FriendshipEvent.objects.bulk_create(records, batch_size=SAVE_BATCH_SIZE)
+
+
+# События ленты после since: (id, вид, id собеседника, имя собеседника, by_user, время)
+def since(user_id, event_id):
+    return FriendshipEvent.objects.filter(user=user_id, id__gt=event_id).order_by('id').values_list(
+        'id', 'kind', 'other_user_id', 'other_user__username', 'by_user', 'created_at'
+    )
+
+
+# id последнего события ленты: с него клиент начинает синхронизацию перед загрузкой полных списков
+def last_event_id(user_id):
+    return FriendshipEvent.objects.filter(user=user_id).aggregate(last=Max('id'))['last'] or 0
+
+
+def serialize(rows):
+    return [
+        {
+            'id': event_id,
+            'type': event_kind,
+            'user_id': other_id,
+            'username': username,
+            'by_user': by_user,
+            'created_at': created_at.isoformat(),
+        }
+        for event_id, event_kind, other_id, username, by_user, created_at in rows
+    ]
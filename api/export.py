@@ -0,0 +1,98 @@
+import csv
+import io
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from .models import Friendship
+from . import renderers
+
+
+# Потоковая выгрузка графа дружбы: связи пользователя или, для персонала, вся таблица Friendship.
+# Строки читаются через values_list().iterator(chunk_size=FRIEND_EXPORT_CHUNK_SIZE) без кэша QuerySet
+# и кодируются в NDJSON или CSV кусками по FRIEND_EXPORT_BUFFER_SIZE байт, поэтому память не зависит
+# от размера графа. Тот же поток пишет в файл команда export_graph
+
+# Связи пользователя: id связи, id и имя собеседника, статус, id отправителя заявки
+USER_FIELDS = ('id', 'user_id', 'username', 'status', 'initiator_id')
+
+TABLE_FIELDS = ('id', 'low_user_id', 'high_user_id', 'initiator_id', 'status')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def user_rows(user_id, chunk_size=None):
+    rows = Friendship.objects.requests_of(user_id).order_by('id')
+    return USER_FIELDS, rows.iterator(chunk_size=chunk_size or settings.FRIEND_EXPORT_CHUNK_SIZE)
+
+
+def table_rows(chunk_size=None):
+    rows = Friendship.objects.order_by('id').values_list(*TABLE_FIELDS)
+    return TABLE_FIELDS, rows.iterator(chunk_size=chunk_size or settings.FRIEND_EXPORT_CHUNK_SIZE)
+
+
+def _ndjson(fields, rows, buffer_size):
+    lines = []
+    size = 0
+    for row in rows:
+        line = renderers.dumps(dict(zip(fields, row)))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= buffer_size:
+            lines.append(b'')
+            yield b'\n'.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        lines.append(b'')
+        yield b'\n'.join(lines)
+
+
+def _csv(fields, rows, buffer_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= buffer_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# Куски выгрузки в формате export_format (ndjson или csv)
+def stream(fields, rows, export_format, buffer_size=None):
+    encode = _csv if export_format == 'csv' else _ndjson
+    return encode(fields, rows, buffer_size or settings.FRIEND_EXPORT_BUFFER_SIZE)
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+# Выгрузка связей пользователя (scope=all - всей таблицы дружбы, только для персонала) в формате
+# type=ndjson (по умолчанию) или type=csv. Обычное представление Django, а не DRF: согласование
+# формата DRF отклонило бы запрос с Accept: text/csv или application/x-ndjson
+@login_required
+def export_view(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    export_format = request.GET.get('type') or 'ndjson'
+    if export_format not in CONTENT_TYPES:
+        return _error('Неизвестный формат выгрузки', 400)
+    if request.GET.get('scope') == 'all':
+        if not request.user.is_staff:
+            return _error('Недостаточно прав', 403)
+        fields, rows = table_rows()
+    else:
+        fields, rows = user_rows(request.user.id)
+    response = StreamingHttpResponse(stream(fields, rows, export_format), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="friendships.{export_format}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
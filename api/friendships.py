@@ -0,0 +1,239 @@
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, F, When
+
+from .models import User, Friendship
+from . import cache as friend_cache
+from . import counters
+from . import events as friend_events
+from . import graph_index
+
+
+# Переходы состояний дружбы для списка собеседников: пользователи проверяются одним запросом,
+# связи читаются одним запросом IN и меняются пакетно в одной транзакции.
+# Каждая функция возвращает словарь {id собеседника: код результата}.
+# Счетчики пользователей (api.counters) и журнал событий (api.events) меняются в той же транзакции, что и связи
+#
+# Связи читаются до начала транзакции, а записи выполняются с условием на прочитанное состояние
+# (INSERT ... ON CONFLICT DO NOTHING, UPDATE/DELETE ... WHERE status и initiator как при чтении).
+# Если запись затронула не все строки, пару параллельно изменил другой запрос: такие пары
+# перечитываются уже с блокировкой и решение принимается заново. Транзакция начинается с записи,
+# поэтому в SQLite она сразу берет блокировку на запись и параллельные запросы ждут ее, а не падают
+
+SUCCESS = 'success'
+USER_NOT_FOUND = 'user_not_found'
+SELF_REQUEST = 'self_request'
+ALREADY_EXISTS = 'already_exists'
+NO_REQUEST = 'no_request'
+
+# Новое состояние "связь удалена" в решениях переходов
+DELETED = 'deleted'
+
+# Первая попытка без блокировок, следующие - с перечитыванием под блокировкой
+WRITE_ATTEMPTS = 3
+
+INSERT_BATCH_SIZE = 200
+
+
+class _Raced(Exception):
+    pass
+
+
+def _existing_user_ids(user_ids):
+    return set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+
+
+def _friendships_by_other(user_id, other_ids, lock=False):
+    friendships = Friendship.objects.between_many(user_id, other_ids).only(
+        'id', 'low_user_id', 'high_user_id', 'initiator_id', 'status'
+    )
+    if lock:
+        friendships = friendships.select_for_update()
+    return {friendship.other_user_id(user_id): friendship for friendship in friendships}
+
+
+def _validate(user, other_ids, results):
+    existing_ids = _existing_user_ids(other_ids)
+    valid_ids = []
+    for other_id in other_ids:
+        if other_id not in existing_ids:
+            results[other_id] = USER_NOT_FOUND
+        elif other_id == user.id:
+            results[other_id] = SELF_REQUEST
+        else:
+            valid_ids.append(other_id)
+    return valid_ids
+
+
+def _finish(user, results):
+    changed_ids = [other_id for other_id, result in results.items() if result == SUCCESS]
+    if changed_ids:
+        friend_cache.invalidate(user.id, *changed_ids)
+        transaction.on_commit(lambda: graph_index.refresh(user.id, changed_ids))
+    return results
+
+
+# Вставка новых заявок без ошибки на уже существующих парах, возвращает число вставленных строк
+def _insert_pending(user_id, other_ids):
+    table = connection.ops.quote_name(Friendship._meta.db_table)
+    inserted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(other_ids), INSERT_BATCH_SIZE):
+            rows = [
+                (*Friendship.pair(user_id, other_id), user_id, 'pending')
+                for other_id in other_ids[start:start + INSERT_BATCH_SIZE]
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} (low_user_id, high_user_id, initiator_id, status) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(rows))} '
+                f'ON CONFLICT (low_user_id, high_user_id) DO NOTHING',
+                [value for row in rows for value in row]
+            )
+            inserted += cursor.rowcount
+    return inserted
+
+
+def _event_kind(new_state):
+    return friend_events.REMOVED if new_state == DELETED else friend_events.KINDS[new_state[0]]
+
+
+# Условная запись группы пар: для одной пары при невыполненном условии ничего не меняется,
+# для нескольких - при расхождении числа строк откатывается точка сохранения
+def _write_group(size, write):
+    if size == 1:
+        return write() == 1
+    try:
+        with transaction.atomic():
+            if write() != size:
+                raise _Raced
+    except _Raced:
+        return False
+    return True
+
+
+# Выполнение решений decide(user_id, other_id, friendship) -> (код результата, новое состояние),
+# где новое состояние - (статус, id отправителя), DELETED или None, если связь не меняется.
+# Пары с одинаковыми старым и новым состоянием записываются одним запросом; возвращаются id пар,
+# которые изменились параллельно и требуют повторного решения
+def _apply_decisions(user, other_ids, friendships, decide, results, deltas, events):
+    creates = []
+    groups = {}
+    for other_id in other_ids:
+        friendship = friendships.get(other_id)
+        result, new_state = decide(user.id, other_id, friendship)
+        results[other_id] = result
+        if new_state is None or (friendship and new_state == (friendship.status, friendship.initiator_id)):
+            continue
+        if friendship is None:
+            creates.append(other_id)
+            continue
+        old_key = (friendship.status, friendship.initiator_id == user.id)
+        new_key = DELETED if new_state == DELETED else (new_state[0], new_state[1] == user.id)
+        groups.setdefault((old_key, new_key), []).append((friendship, new_state))
+
+    raced = []
+    if creates:
+        if _write_group(len(creates), lambda: _insert_pending(user.id, creates)):
+            for other_id in creates:
+                low_user_id, high_user_id = Friendship.pair(user.id, other_id)
+                counters.add(deltas, Friendship(
+                    low_user_id=low_user_id, high_user_id=high_user_id, initiator_id=user.id, status='pending'
+                ), 1)
+                friend_events.add(events, user.id, other_id, friend_events.SENT)
+        else:
+            raced.extend(creates)
+
+    other_user = Case(When(low_user=user.id, then=F('high_user')), default=F('low_user'))
+    for ((old_status, old_by_user), new_key), changes in groups.items():
+        rows = Friendship.objects.filter(id__in=[friendship.id for friendship, _ in changes], status=old_status)
+        rows = rows.filter(initiator=user.id) if old_by_user else rows.exclude(initiator=user.id)
+        if new_key == DELETED:
+            written = _write_group(len(changes), lambda: rows.delete()[0])
+        else:
+            new_status, new_by_user = new_key
+            written = _write_group(len(changes), lambda: rows.update(
+                status=new_status, initiator=user.id if new_by_user else other_user
+            ))
+        for friendship, new_state in changes:
+            if not written:
+                raced.append(friendship.other_user_id(user.id))
+                continue
+            counters.add(deltas, friendship, -1)
+            friend_events.add(events, user.id, friendship.other_user_id(user.id), _event_kind(new_state))
+            if new_state != DELETED:
+                counters.add(deltas, Friendship(
+                    low_user_id=friendship.low_user_id, high_user_id=friendship.high_user_id,
+                    initiator_id=new_state[1], status=new_state[0]
+                ), 1)
+    return raced
+
+
+def _transition(user, other_ids, decide):
+    results = {}
+    other_ids = _validate(user, other_ids, results)
+    friendships = _friendships_by_other(user.id, other_ids)
+    deltas = {}
+    events = []
+    with transaction.atomic():
+        for attempt in range(WRITE_ATTEMPTS):
+            other_ids = _apply_decisions(user, other_ids, friendships, decide, results, deltas, events)
+            if not other_ids:
+                break
+            friendships = _friendships_by_other(user.id, other_ids, lock=True)
+        else:
+            raise DatabaseError('Friendship rows keep changing concurrently')
+        counters.save(deltas)
+        friend_events.save(events)
+    return _finish(user, results)
+
+
+def _decide_send(user_id, target_id, friendship):
+    if friendship is None:
+        return SUCCESS, ('pending', user_id)
+    if friendship.initiator_id == target_id and friendship.status == 'pending':
+        # Встречная заявка: пользователи автоматически становятся друзьями
+        return SUCCESS, ('accepted', target_id)
+    if friendship.initiator_id == target_id and friendship.status == 'rejected':
+        # Ранее отклоненная заявка собеседника: теперь заявку отправляет сам пользователь
+        return SUCCESS, ('pending', user_id)
+    return ALREADY_EXISTS, None
+
+
+# Принять и отклонить можно заявку собеседника или уже принятую дружбу
+def _decide_answer(new_status):
+    def decide(user_id, requester_id, friendship):
+        if friendship is None or (friendship.initiator_id != requester_id and friendship.status != 'accepted'):
+            return NO_REQUEST, None
+        # Отклоненная дружба хранится как отклоненная заявка собеседника
+        initiator_id = requester_id if new_status == 'rejected' else friendship.initiator_id
+        return SUCCESS, (new_status, initiator_id)
+    return decide
+
+
+def _decide_remove(user_id, friend_id, friendship):
+    if friendship is None:
+        return NO_REQUEST, None
+    return SUCCESS, DELETED
+
+
+def send_requests(user, target_ids):
+    return _transition(user, target_ids, _decide_send)
+
+
+def accept_requests(user, requester_ids):
+    return _transition(user, requester_ids, _decide_answer('accepted'))
+
+
+def reject_requests(user, requester_ids):
+    return _transition(user, requester_ids, _decide_answer('rejected'))
+
+
+def remove_friends(user, friend_ids):
+    return _transition(user, friend_ids, _decide_remove)
+
+
+OPERATIONS = {
+    'send': send_requests,
+    'accept': accept_requests,
+    'reject': reject_requests,
+    'remove': remove_friends,
+}
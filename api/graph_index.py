@@ -0,0 +1,302 @@
+import threading
+import time
+import uuid
+from array import array
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+
+from .models import User, Friendship
+from . import routers
+
+
+# Компактный индекс графа дружбы в памяти процесса (CSR): связи каждого пользователя лежат подряд
+# в общих массивах, начало его участка - offsets[position], где position - место id в users.
+# Каждая связь хранится с обеих сторон:
+#   neighbors   - id собеседника
+#   edge_ids    - id записи Friendship, внутри участка пользователя по возрастанию
+#   flags       - статус связи (младшие два бита) и признак "пользователь - отправитель заявки"
+#   by_neighbor - номера связей внутри участка в порядке возрастания id собеседника, для бинарного поиска
+# Изменения после построения копятся в overlay и учитываются при чтении;
+# при переполнении overlay или по истечении FRIEND_GRAPH_INDEX_MAX_AGE индекс строится заново.
+# Новый индекс строится без блокировки, читатели тем временем получают прежний; пары, измененные
+# во время построения, записываются в _pending и применяются к новому индексу перед заменой.
+# Изменения в обход сервиса (команда import_graph) сбрасывают индексы всех процессов через поколение
+# в общем кэше (GENERATION_KEY), которое каждый индекс сверяет раз в FRIEND_GRAPH_INDEX_CHECK_INTERVAL секунд
+
+STATUSES = ('pending', 'accepted', 'rejected')
+STATUS_CODES = {friendship_status: code for code, friendship_status in enumerate(STATUSES)}
+STATUS_MASK = 0b011
+INITIATOR_FLAG = 0b100
+GENERATION_KEY = 'friend_graph_index:generation'
+
+# _lock защищает изменения индекса и его замену, _build_lock допускает только одно построение
+_lock = threading.RLock()
+_build_lock = threading.Lock()
+_index = None
+_pending = None
+_generation = 0
+
+
+def _id_array(max_id):
+    return array('i' if max_id < 2 ** 31 else 'q')
+
+
+def _flags(friendship_status, is_initiator):
+    return STATUS_CODES[friendship_status] | (INITIATOR_FLAG if is_initiator else 0)
+
+
+class GraphIndex:
+
+    def __init__(self):
+        self.built_at = self.checked_at = time.monotonic()
+        self.generation = _cache().get(GENERATION_KEY)
+        self.overlay = {}
+        self.overlay_size = 0
+        self.usernames = dict(User.objects.values_list('id', 'username').iterator(chunk_size=10000))
+
+        rows = Friendship.objects.order_by('id').values_list('id', 'low_user_id', 'high_user_id', 'initiator_id', 'status')
+        max_id = max(Friendship.objects.aggregate(max_id=Max('id'))['max_id'] or 0, max(self.usernames, default=0))
+        edge_ids, lows, highs, low_flags, high_flags = _id_array(max_id), _id_array(max_id), _id_array(max_id), bytearray(), bytearray()
+        degrees = {}
+        for friendship_id, low_user_id, high_user_id, initiator_id, friendship_status in rows.iterator(chunk_size=10000):
+            edge_ids.append(friendship_id)
+            lows.append(low_user_id)
+            highs.append(high_user_id)
+            low_flags.append(_flags(friendship_status, initiator_id == low_user_id))
+            high_flags.append(_flags(friendship_status, initiator_id == high_user_id))
+            degrees[low_user_id] = degrees.get(low_user_id, 0) + 1
+            degrees[high_user_id] = degrees.get(high_user_id, 0) + 1
+
+        self.users = _id_array(max_id)
+        self.users.extend(sorted(degrees))
+        self.positions = {user_id: position for position, user_id in enumerate(self.users)}
+        self.offsets = array('q', [0])
+        for user_id in self.users:
+            self.offsets.append(self.offsets[-1] + degrees[user_id])
+
+        # Связи перебираются по возрастанию id, поэтому участок каждого пользователя заполняется уже отсортированным
+        size = self.offsets[-1]
+        self.neighbors = _id_array(max_id)
+        self.neighbors.frombytes(bytes(size * self.neighbors.itemsize))
+        self.edge_ids = _id_array(max_id)
+        self.edge_ids.frombytes(bytes(size * self.edge_ids.itemsize))
+        self.flags = bytearray(size)
+        slots = array('q', self.offsets[:-1])
+        for number, friendship_id in enumerate(edge_ids):
+            for user_id, other_id, flags in (
+                (lows[number], highs[number], low_flags[number]),
+                (highs[number], lows[number], high_flags[number]),
+            ):
+                position = self.positions[user_id]
+                slot = slots[position]
+                slots[position] += 1
+                self.neighbors[slot] = other_id
+                self.edge_ids[slot] = friendship_id
+                self.flags[slot] = flags
+        del edge_ids, lows, highs, low_flags, high_flags, slots
+
+        self.by_neighbor = array('i')
+        for position in range(len(self.users)):
+            start, end = self.offsets[position], self.offsets[position + 1]
+            self.by_neighbor.extend(sorted(range(end - start), key=lambda number: self.neighbors[start + number]))
+
+    # Участок связей пользователя: (начало, конец) или (0, 0), если связей нет
+    def _span(self, user_id):
+        position = self.positions.get(user_id)
+        if position is None:
+            return 0, 0
+        return self.offsets[position], self.offsets[position + 1]
+
+    # Связи пользователя по возрастанию id: (id связи, id собеседника, флаги) с учетом overlay
+    def _edges(self, user_id):
+        start, end = self._span(user_id)
+        changes = self.overlay.get(user_id)
+        if not changes:
+            return [(self.edge_ids[slot], self.neighbors[slot], self.flags[slot]) for slot in range(start, end)]
+        edges = [
+            (self.edge_ids[slot], self.neighbors[slot], self.flags[slot])
+            for slot in range(start, end) if self.neighbors[slot] not in changes
+        ]
+        edges.extend((edge_id, other_id, flags) for other_id, (edge_id, flags) in changes.items() if edge_id)
+        edges.sort()
+        return edges
+
+    # Те же строки, что и в api.cache.friends
+    def friends(self, user_id):
+        return [
+            (edge_id, other_id, self.usernames.get(other_id))
+            for edge_id, other_id, flags in self._edges(user_id)
+            if flags & STATUS_MASK == STATUS_CODES['accepted']
+        ]
+
+    # Те же строки, что и в api.cache.requests
+    def requests(self, user_id):
+        return [
+            (
+                edge_id, other_id, self.usernames.get(other_id), STATUSES[flags & STATUS_MASK],
+                user_id if flags & INITIATOR_FLAG else other_id
+            )
+            for edge_id, other_id, flags in self._edges(user_id)
+        ]
+
+    def friend_ids(self, user_id):
+        return {other_id for _, other_id, _ in self.friends(user_id)}
+
+    def degree(self, user_id):
+        return len(self.friends(user_id))
+
+    # Статус связи с other_id или None: бинарный поиск по участку пользователя в порядке by_neighbor
+    def status(self, user_id, other_id):
+        changes = self.overlay.get(user_id)
+        if changes and other_id in changes:
+            edge_id, flags = changes[other_id]
+            return STATUSES[flags & STATUS_MASK] if edge_id else None
+        start, end = self._span(user_id)
+        low, high = start, end
+        while low < high:
+            middle = (low + high) // 2
+            if self.neighbors[start + self.by_neighbor[middle]] < other_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < end:
+            slot = start + self.by_neighbor[low]
+            if self.neighbors[slot] == other_id:
+                return STATUSES[self.flags[slot] & STATUS_MASK]
+        return None
+
+    # Актуальное состояние пар (user_id, other_id) после изменения; отсутствующая в базе пара записывается как удаленная.
+    # База читается под блокировкой: из двух параллельных обновлений одной пары последним применяется более позднее чтение
+    def apply(self, user_id, other_ids):
+        with _lock:
+            rows = {
+                (low_user_id, high_user_id): row
+                for low_user_id, high_user_id, *row in Friendship.objects.between_many(user_id, other_ids).values_list(
+                    'low_user_id', 'high_user_id', 'id', 'initiator_id', 'status', 'low_user__username', 'high_user__username'
+                )
+            }
+            for other_id in other_ids:
+                low_user_id, high_user_id = Friendship.pair(user_id, other_id)
+                row = rows.get((low_user_id, high_user_id))
+                if row is not None:
+                    friendship_id, initiator_id, friendship_status, low_username, high_username = row
+                    self.usernames[low_user_id] = low_username
+                    self.usernames[high_user_id] = high_username
+                for one_id, another_id in ((user_id, other_id), (other_id, user_id)):
+                    # Словарь заменяется целиком, чтобы параллельное чтение не видело его в процессе изменения
+                    changes = dict(self.overlay.get(one_id, {}))
+                    if another_id not in changes:
+                        self.overlay_size += 1
+                    if row is None:
+                        changes[another_id] = (0, 0)
+                    else:
+                        changes[another_id] = (friendship_id, _flags(friendship_status, initiator_id == one_id))
+                    self.overlay[one_id] = changes
+
+    def expired(self):
+        return (
+            time.monotonic() - self.built_at > settings.FRIEND_GRAPH_INDEX_MAX_AGE
+            or self.overlay_size > settings.FRIEND_GRAPH_INDEX_MAX_OVERLAY
+            or self.outdated()
+        )
+
+    # Поколение в общем кэше сменилось после построения; кэш читается не чаще раза в FRIEND_GRAPH_INDEX_CHECK_INTERVAL
+    def outdated(self):
+        now = time.monotonic()
+        if now - self.checked_at < settings.FRIEND_GRAPH_INDEX_CHECK_INTERVAL:
+            return False
+        self.checked_at = now
+        return _cache().get(GENERATION_KEY) != self.generation
+
+    # Размер массивов в байтах, без словарей positions и usernames
+    def memory(self):
+        arrays = (self.users, self.offsets, self.neighbors, self.edge_ids, self.by_neighbor)
+        return sum(len(values) * values.itemsize for values in arrays) + len(self.flags)
+
+    def stats(self):
+        edges = len(self.edge_ids) // 2
+        memory = self.memory()
+        return {
+            'users': len(self.users),
+            'edges': edges,
+            'overlay': self.overlay_size,
+            'memory_bytes': memory,
+            'bytes_per_edge': round(memory / edges, 2) if edges else None,
+        }
+
+
+def enabled():
+    return settings.FRIEND_GRAPH_INDEX
+
+
+def _cache():
+    return caches[settings.FRIEND_CACHE_ALIAS]
+
+
+# Построение нового индекса с применением изменений, пришедших за время построения.
+# Индекс не заменяется, если за это время его сбросили (reset)
+def _build():
+    global _index, _pending
+    with _lock:
+        _pending = []
+        generation = _generation
+    try:
+        with routers.primary():
+            index = GraphIndex()
+            with _lock:
+                for user_id, other_ids in _pending:
+                    index.apply(user_id, other_ids)
+                if generation == _generation:
+                    _index = index
+    finally:
+        with _lock:
+            _pending = None
+    return index
+
+
+# Индекс текущего процесса; строится при первом обращении и перестраивается, когда устарел.
+# Устаревший индекс перестраивает один поток, остальные до замены читают прежний
+def get():
+    index = _index
+    if index is None:
+        with _build_lock:
+            index = _index
+            if index is None:
+                index = _build()
+    elif index.expired() and _build_lock.acquire(blocking=False):
+        try:
+            index = _build() if _index is index else _index
+        finally:
+            _build_lock.release()
+    return index
+
+
+# Вызывается после фиксации изменений пар: если индекс уже построен, он дополняется из базы,
+# а если идет построение, пары запоминаются для нового индекса
+def refresh(user_id, other_ids):
+    if not enabled():
+        return
+    with _lock:
+        if _pending is not None:
+            _pending.append((user_id, list(other_ids)))
+        index = _index
+        if index is not None:
+            with routers.primary():
+                index.apply(user_id, other_ids)
+
+
+def reset(**kwargs):
+    global _index, _generation
+    with _lock:
+        _index = None
+        _generation += 1
+
+
+# Сброс индексов всех процессов после изменений графа в обход сервиса: каждый процесс перестраивает
+# индекс, заметив новое поколение. С кэшем в памяти процесса (locmem) другие процессы его не увидят
+# и перестроят индекс только через FRIEND_GRAPH_INDEX_MAX_AGE
+def invalidate_all():
+    _cache().set(GENERATION_KEY, uuid.uuid4().hex, None)
+    reset()
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, BCryptSHA256PasswordHasher, PBKDF2PasswordHasher
+
+
+# Хешеры паролей с настраиваемой стоимостью (settings.PASSWORD_PBKDF2_ITERATIONS, PASSWORD_ARGON2_*,
+# PASSWORD_BCRYPT_ROUNDS). Имена алгоритмов совпадают со стандартными, поэтому уже сохраненные хеши
+# проверяются как раньше, а при входе Django пересчитывает хеш, если изменились алгоритм или стоимость.
+#
+# Само хеширование выполняется в ограниченном пуле потоков (PASSWORD_HASH_WORKERS): библиотеки хеширования
+# отпускают GIL, а число одновременных вычислений не превышает размер пула, поэтому всплеск входов
+# не отнимает процессор у остальных запросов. Если все места в пуле и очереди (PASSWORD_HASH_QUEUE) заняты
+# дольше PASSWORD_HASH_TIMEOUT секунд, выбрасывается HashingOverloaded
+
+class HashingOverloaded(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_in_pool = threading.local()
+
+
+def _get_pool():
+    global _pool, _slots
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE)
+                _pool = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _pool, _slots
+
+
+def _run_in_pool(func, *args):
+    _in_pool.active = True
+    try:
+        return func(*args)
+    finally:
+        _in_pool.active = False
+
+
+def run(func, *args):
+    # verify некоторых хешеров вызывает encode: вложенный вызов выполняется в том же потоке пула
+    if getattr(_in_pool, 'active', False):
+        return func(*args)
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=settings.PASSWORD_HASH_TIMEOUT):
+        raise HashingOverloaded
+    try:
+        return pool.submit(_run_in_pool, func, *args).result()
+    finally:
+        slots.release()
+
+
+def reset(**kwargs):
+    global _pool, _slots
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = _slots = None
+
+
+class PooledHasherMixin:
+
+    def encode(self, password, salt, *args):
+        return run(super().encode, password, salt, *args)
+
+    def verify(self, password, encoded):
+        return run(super().verify, password, encoded)
+
+
+class PBKDF2PooledPasswordHasher(PooledHasherMixin, PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+class Argon2PooledPasswordHasher(PooledHasherMixin, Argon2PasswordHasher):
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class BCryptSHA256PooledPasswordHasher(PooledHasherMixin, BCryptSHA256PasswordHasher):
+
+    @property
+    def rounds(self):
+        return settings.PASSWORD_BCRYPT_ROUNDS
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db.models import Subquery
+from django.utils import timezone
+
+
+# Удаление истекших сессий пакетами: в отличие от clearsessions, который удаляет все одним запросом,
+# каждая транзакция держит блокировку на запись недолго и не мешает запросам сервиса.
+# С --interval команда работает постоянно и повторяет очистку каждые interval секунд
+class Command(BaseCommand):
+    help = 'Удаляет истекшие сессии из базы пакетами по batch-size строк'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05, help='пауза между пакетами в секундах')
+        parser.add_argument('--interval', type=float, default=0, help='повторять очистку каждые interval секунд')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE not in ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db'):
+            self.stdout.write(f'sessions are not stored in the database ({settings.SESSION_ENGINE}), nothing to clean up')
+            return
+        while True:
+            self.stdout.write(f'deleted: {self.cleanup(options["batch_size"], options["pause"])}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    # Каждый пакет удаляется одним запросом DELETE ... WHERE session_key IN (SELECT ... LIMIT batch_size):
+    # отдельное чтение ключей в той же транзакции перед удалением повышало бы в SQLite блокировку
+    # с чтения на запись и могло завершиться ошибкой "database is locked"
+    def cleanup(self, batch_size, pause):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            expired = Session.objects.filter(expire_date__lt=now).values('session_key')[:batch_size]
+            batch = Session.objects.filter(session_key__in=Subquery(expired)).delete()[0]
+            deleted += batch
+            if batch < batch_size:
+                return deleted
+            time.sleep(pause)
@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import export
+
+
+# Выгрузка связей пользователя (--user) или всей таблицы дружбы в NDJSON или CSV потоком,
+# тем же кодом, что и представление export_friendships; число строк и скорость выводятся в stderr
+class Command(BaseCommand):
+    help = 'Выгружает связи дружбы пользователя или всю таблицу Friendship в NDJSON или CSV без загрузки в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя; без него выгружается вся таблица')
+        parser.add_argument('--format', choices=sorted(export.CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--output', default='-', help='файл для выгрузки, - для stdout')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['user'] is None:
+            fields, rows = export.table_rows(options['chunk_size'])
+        else:
+            fields, rows = export.user_rows(options['user'], options['chunk_size'])
+        counter = Counter(rows)
+        started = time.perf_counter()
+        if options['output'] == '-':
+            self.write(sys.stdout.buffer, export.stream(fields, counter, options['format']))
+        else:
+            try:
+                with open(options['output'], 'wb') as file:
+                    self.write(file, export.stream(fields, counter, options['format']))
+            except OSError as error:
+                raise CommandError(error)
+        elapsed = time.perf_counter() - started
+        rate = round(counter.count / elapsed) if elapsed else 0
+        self.stderr.write(f'rows: {counter.count}, seconds: {elapsed:.2f}, rows_per_second: {rate}')
+
+    def write(self, file, chunks):
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
+
+
+class Counter:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
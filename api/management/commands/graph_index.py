@@ -0,0 +1,28 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from api.graph_index import GraphIndex
+
+
+# Построение индекса графа дружбы из таблицы Friendship с отчетом о времени и расходе памяти:
+# memory_bytes - только массивы CSR, allocated_bytes - все выделения при построении, включая словари id и имен
+class Command(BaseCommand):
+    help = 'Строит индекс графа дружбы в памяти и выводит время построения и расход памяти на связь'
+
+    def handle(self, *args, **options):
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = GraphIndex()
+        elapsed = time.perf_counter() - started
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = index.stats()
+        stats['allocated_bytes'] = allocated
+        stats['peak_bytes'] = peak
+        stats['allocated_bytes_per_edge'] = round(allocated / stats['edges'], 2) if stats['edges'] else None
+        stats['build_seconds'] = round(elapsed, 3)
+        for name, value in stats.items():
+            self.stdout.write(f'{name}: {value}')
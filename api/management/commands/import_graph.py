@@ -0,0 +1,250 @@
+import csv
+import itertools
+import json
+import sys
+import time
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api import cache as friend_cache
+from api import graph_index
+from api.counters import recount
+from api.models import User, Friendship
+
+STATUSES = ('pending', 'accepted', 'rejected')
+
+# Вставка связи с объединением повторов прямо в базе: связь уже есть - остается первая, кроме случаев,
+# когда новая принята или это встречная ожидающая заявка (тогда пара становится друзьями, как при
+# отправке встречной заявки через api.friendships). Работает в SQLite и PostgreSQL (ON CONFLICT)
+INSERT_FRIENDSHIP = (
+    'INSERT INTO {table} (low_user_id, high_user_id, initiator_id, status) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT (low_user_id, high_user_id) DO UPDATE SET status = \'accepted\' '
+    'WHERE {table}.status <> \'accepted\' AND (excluded.status = \'accepted\' OR '
+    '({table}.status = \'pending\' AND excluded.status = \'pending\' AND {table}.initiator_id <> excluded.initiator_id))'
+)
+
+
+def read_rows(path, file_format):
+    file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for number, line in enumerate(file, start=1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    if not isinstance(row, dict):
+                        raise CommandError(f'Строка {number}: ожидается объект JSON')
+                    yield row
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Загрузка графа из CSV или NDJSON без регистрации и заявок через API:
+#   --users  строки username[, password][, id]: password - готовый хеш (без него пароль непригоден для входа),
+#            id сохраняется, если задан; уже существующие имена и id пропускаются
+#   --edges  строки from_user, to_user[, status]: from_user - отправитель заявки, status по умолчанию accepted;
+#            пользователи задаются именем или, с --match id, числовым id
+# Строки пишутся пакетами по batch-size, каждый пакет - в своей транзакции. Пары приводятся к виду
+# (low_user, high_user), повторы и встречные заявки объединяются при вставке. Если таблица дружбы пуста,
+# вторичные индексы удаляются на время загрузки и строятся заново в конце (после прерванной загрузки -
+# при следующем запуске). После загрузки пересчитываются счетчики и увеличивается graph_version
+# всех пользователей, чтобы сбросить ETag списков, из кэша удаляются списки затронутых пользователей,
+# а индексы графа всех процессов перестраиваются (api.graph_index).
+# События дружбы (api.events) для импортированных связей не пишутся
+class Command(BaseCommand):
+    help = 'Загружает пользователей и связи дружбы из CSV или NDJSON пакетами и выводит скорость загрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='файл пользователей, - для stdin')
+        parser.add_argument('--edges', help='файл связей, - для stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='по умолчанию определяется по расширению файла')
+        parser.add_argument('--match', choices=['username', 'id'], default='username', help='как связи ссылаются на пользователей')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keep-indexes', action='store_true', help='не удалять индексы на время загрузки связей')
+
+    def handle(self, *args, **options):
+        if not options['users'] and not options['edges']:
+            raise CommandError('Укажите --users и/или --edges')
+        # Индексы, удаленные прерванной загрузкой (процесс завершен до их построения), строятся заново
+        missing = self.missing_indexes()
+        if missing:
+            names = ', '.join(index.name for index in missing)
+            self.stderr.write(self.style.WARNING(f'Индексы {names} отсутствуют после прерванной загрузки, строятся заново'))
+            self.create_indexes(missing)
+        # Пользователи, чьи связи менялись: их списки удаляются из кэша после загрузки
+        self.touched = set()
+        if options['users']:
+            self.report('users', self.import_users(options['users'], self.file_format(options['users'], options), options['batch_size']))
+        if options['edges']:
+            edges_format = self.file_format(options['edges'], options)
+            drop_indexes = not options['keep_indexes'] and not Friendship.objects.exists()
+            if drop_indexes:
+                self.stderr.write(self.style.WARNING(
+                    'Вторичные индексы таблицы дружбы удалены на время загрузки. Если команда будет прервана, '
+                    'их построит следующий запуск import_graph; --keep-indexes загружает связи без удаления индексов'
+                ))
+                self.drop_indexes()
+            try:
+                stats = self.import_edges(options['edges'], edges_format, options)
+            finally:
+                started = time.perf_counter()
+                if drop_indexes:
+                    self.create_indexes()
+            if drop_indexes:
+                stats['index_seconds'] = round(time.perf_counter() - started, 2)
+            self.report('edges', stats)
+        started = time.perf_counter()
+        repaired = recount(User, Friendship, batch_size=options['batch_size'])
+        User.objects.update(graph_version=F('graph_version') + 1)
+        self.stdout.write(f'counters_repaired: {repaired}')
+        self.stdout.write(f'counters_seconds: {time.perf_counter() - started:.2f}')
+        if friend_cache.enabled():
+            for user_ids in batches(sorted(self.touched), options['batch_size']):
+                friend_cache.invalidate(*user_ids)
+        graph_index.invalidate_all()
+
+    def file_format(self, path, options):
+        if options['format']:
+            return options['format']
+        if path.endswith('.csv'):
+            return 'csv'
+        if path.endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        raise CommandError(f'Не удалось определить формат файла {path}, укажите --format')
+
+    def report(self, name, stats):
+        for key, value in stats.items():
+            self.stdout.write(f'{name}_{key}: {value}')
+
+    def import_users(self, path, file_format, batch_size):
+        before = User.objects.count()
+        started = time.perf_counter()
+        read = 0
+        explicit_ids = False
+        # Остальные поля получают значения по умолчанию, подготовленные для базы один раз на всю загрузку
+        now = timezone.now()
+        defaults = {}
+        for field in User._meta.concrete_fields:
+            if field.primary_key or field.attname in ('username', 'password'):
+                continue
+            value = now if getattr(field, 'auto_now_add', False) else field.get_default()
+            defaults[field.column] = field.get_db_prep_save(value, connection)
+        columns = ['username', 'password', *defaults]
+        default_values = tuple(defaults.values())
+        table = connection.ops.quote_name(User._meta.db_table)
+        for number, batch in enumerate(batches(read_rows(path, file_format), batch_size)):
+            rows = []
+            rows_with_ids = []
+            for line, row in enumerate(batch, start=number * batch_size + 1):
+                password = row.get('password') or UNUSABLE_PASSWORD_PREFIX
+                if not password.startswith(UNUSABLE_PASSWORD_PREFIX):
+                    try:
+                        identify_hasher(password)
+                    except ValueError:
+                        raise CommandError(f'Строка {line}: пароль должен быть готовым хешем Django')
+                username = row.get('username')
+                if not username:
+                    raise CommandError(f'Строка {line}: не задано имя пользователя')
+                if row.get('id'):
+                    try:
+                        user_id = int(row['id'])
+                    except (TypeError, ValueError):
+                        raise CommandError(f'Строка {line}: id пользователя должен быть целым числом')
+                    rows_with_ids.append((user_id, username, password, *default_values))
+                else:
+                    rows.append((username, password, *default_values))
+            read += len(batch)
+            explicit_ids = explicit_ids or bool(rows_with_ids)
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for id_columns, values in ((['id'], rows_with_ids), ([], rows)):
+                        if values:
+                            names = ', '.join(connection.ops.quote_name(column) for column in id_columns + columns)
+                            placeholders = ', '.join(['%s'] * (len(id_columns) + len(columns)))
+                            cursor.executemany(
+                                f'INSERT INTO {table} ({names}) VALUES ({placeholders}) ON CONFLICT DO NOTHING', values
+                            )
+        if explicit_ids:
+            # Для PostgreSQL последовательность id сдвигается за загруженные значения
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User]):
+                    cursor.execute(sql)
+        elapsed = time.perf_counter() - started
+        created = User.objects.count() - before
+        return {'read': read, 'created': created, 'skipped': read - created, **self.rate(read, elapsed)}
+
+    def import_edges(self, path, file_format, options):
+        before = Friendship.objects.count()
+        # Соответствие ключа из файла id пользователя; занимает память по числу пользователей, а не связей
+        if options['match'] == 'id':
+            user_ids = {str(user_id): user_id for user_id in User.objects.values_list('id', flat=True).iterator()}
+        else:
+            user_ids = dict(User.objects.values_list('username', 'id').iterator())
+        sql = INSERT_FRIENDSHIP.format(table=connection.ops.quote_name(Friendship._meta.db_table))
+        started = time.perf_counter()
+        read = invalid = 0
+        for batch in batches(read_rows(path, file_format), options['batch_size']):
+            rows = []
+            for row in batch:
+                from_id = user_ids.get(str(row.get('from_user', '')))
+                to_id = user_ids.get(str(row.get('to_user', '')))
+                friendship_status = row.get('status') or 'accepted'
+                if from_id is None or to_id is None or from_id == to_id or friendship_status not in STATUSES:
+                    invalid += 1
+                    continue
+                rows.append((*Friendship.pair(from_id, to_id), from_id, friendship_status))
+                self.touched.update((from_id, to_id))
+            read += len(batch)
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, rows)
+        elapsed = time.perf_counter() - started
+        created = Friendship.objects.count() - before
+        return {
+            'read': read,
+            'invalid': invalid,
+            'created': created,
+            'merged': read - invalid - created,
+            **self.rate(read, elapsed),
+        }
+
+    def rate(self, count, elapsed):
+        return {'seconds': round(elapsed, 2), 'rows_per_second': round(count / elapsed) if elapsed else 0}
+
+    # SQL индексов выполняется напрямую: schema_editor в SQLite нельзя открыть внутри транзакции
+    def drop_indexes(self):
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Friendship._meta.indexes:
+                cursor.execute(str(index.remove_sql(Friendship, editor)))
+
+    def create_indexes(self, indexes=None):
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Friendship._meta.indexes if indexes is None else indexes:
+                cursor.execute(str(index.create_sql(Friendship, editor)))
+            cursor.execute('ANALYZE')
+
+    def missing_indexes(self):
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, Friendship._meta.db_table)
+        return [index for index in Friendship._meta.indexes if index.name not in existing]
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import recount
+from api.models import User, Friendship
+
+
+# Пересчет денормализованных счетчиков друзей и заявок по таблице Friendship,
+# например после ручных изменений в базе или импорта данных
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики друзей и ожидающих заявок пользователей и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = recount(User, Friendship, batch_size=options['batch_size'])
+        self.stdout.write(f'repaired: {repaired}')
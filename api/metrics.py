@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseNotFound
+
+
+# Метрики запросов для Prometheus (METRICS_ENABLED=1): api.middleware.RequestMetricsMiddleware для каждого
+# представления (url name), метода и кода ответа собирает гистограммы времени ответа, числа и времени запросов
+# к базе и размера ответа, а metrics_view отдает их в текстовом формате Prometheus по пути /metrics.
+# Запросы к базе считаются обработчиком connection.execute_wrapper, который ставится на каждое соединение и
+# пишет в статистику текущего запроса из ContextVar, поэтому учитываются и запросы из sync_to_async.
+#
+# Метрики копятся в памяти процесса. При нескольких процессах gunicorn каждый процесс раз в
+# METRICS_FLUSH_INTERVAL секунд сохраняет свои метрики в файл в каталоге METRICS_DIR, а /metrics
+# складывает файлы всех процессов. Запросы дольше METRICS_SLOW_REQUEST_MS записываются в лог api.metrics
+# вместе с их SQL
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Время обработки запроса',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'http_request_db_queries': (
+        'Число запросов к базе за запрос',
+        (0, 1, 2, 3, 5, 10, 20, 50, 100),
+    ),
+    'http_request_db_duration_seconds': (
+        'Время запросов к базе за запрос',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'http_response_size_bytes': (
+        'Размер тела ответа',
+        (100, 1000, 10000, 100000, 1000000, 10000000),
+    ),
+}
+
+_lock = threading.Lock()
+_series = {}
+_last_flush = 0.0
+_current = ContextVar('request_metrics', default=None)
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_time', 'sql')
+
+    def __init__(self, collect_sql):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.sql = [] if collect_sql else None
+
+
+# Для каждой гистограммы: счетчики по корзинам (последняя - +Inf), сумма и число наблюдений
+def _empty_series():
+    return {name: [[0] * (len(buckets) + 1), 0, 0] for name, (_, buckets) in HISTOGRAMS.items()}
+
+
+def _observe(series, name, value):
+    histogram = series[name]
+    histogram[0][bisect_left(HISTOGRAMS[name][1], value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+
+def _execute(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += duration
+        if stats.sql is not None and len(stats.sql) < settings.METRICS_SLOW_REQUEST_MAX_QUERIES:
+            stats.sql.append((duration, sql))
+
+
+def install(connection):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+# Обработчик сигнала connection_created: соединения потоков, открытые после запуска middleware
+def install_on_connect(sender, connection, **kwargs):
+    if enabled():
+        install(connection)
+
+
+def install_on_connections():
+    for connection in connections.all():
+        install(connection)
+
+
+def start_request():
+    stats = RequestStats(collect_sql=bool(settings.METRICS_SLOW_REQUEST_MS))
+    return stats, _current.set(stats)
+
+
+def finish_request(request, response, state):
+    stats, token = state
+    _current.reset(token)
+    duration = time.perf_counter() - stats.started
+    match = request.resolver_match
+    endpoint = (match.url_name or match.view_name) if match else 'unmatched'
+    key = (endpoint, request.method, str(response.status_code))
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = _empty_series()
+        _observe(series, 'http_request_duration_seconds', duration)
+        _observe(series, 'http_request_db_queries', stats.queries)
+        _observe(series, 'http_request_db_duration_seconds', stats.db_time)
+        if not response.streaming:
+            _observe(series, 'http_response_size_bytes', len(response.content))
+    if settings.METRICS_DIR and time.perf_counter() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+    if settings.METRICS_SLOW_REQUEST_MS and duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+        _log_slow_request(request, response, duration, stats)
+
+
+def _log_slow_request(request, response, duration, stats):
+    queries = '\n'.join(f'  {query_time * 1000:.1f} мс: {sql}' for query_time, sql in stats.sql or [])
+    logger.warning(
+        'Медленный запрос %s %s (%s): %.1f мс, запросов к базе %d за %.1f мс\n%s',
+        request.method, request.path, response.status_code, duration * 1000, stats.queries, stats.db_time * 1000, queries
+    )
+
+
+def _snapshot():
+    with _lock:
+        return [
+            [*key, {name: [list(counts), value_sum, count] for name, (counts, value_sum, count) in series.items()}]
+            for key, series in _series.items()
+        ]
+
+
+# Файл процесса заменяется атомарно, чтобы /metrics в другом процессе не прочитал его наполовину записанным
+def flush():
+    global _last_flush
+    _last_flush = time.perf_counter()
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(_snapshot(), file)
+    os.replace(f'{path}.tmp', path)
+
+
+# Метрики всех процессов из METRICS_DIR; файлы завершившихся процессов тоже учитываются,
+# иначе счетчики уменьшались бы после перезапуска процесса по max_requests
+def _collect():
+    if not settings.METRICS_DIR:
+        return _snapshot()
+    flush()
+    merged = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(settings.METRICS_DIR, name)) as file:
+            for endpoint, method, status, series in json.load(file):
+                total = merged.setdefault((endpoint, method, status), _empty_series())
+                for metric, (counts, value_sum, count) in series.items():
+                    histogram = total[metric]
+                    histogram[0] = [left + right for left, right in zip(histogram[0], counts)]
+                    histogram[1] += value_sum
+                    histogram[2] += count
+    return [[*key, series] for key, series in merged.items()]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    rows = sorted(_collect(), key=lambda row: row[:3])
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, method, status, series in rows:
+            counts, value_sum, count = series[name]
+            if not count:
+                continue
+            labels = f'endpoint="{_label(endpoint)}",method="{_label(method)}",status="{_label(status)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {value_sum}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset(**kwargs):
+    global _last_flush
+    with _lock:
+        _series.clear()
+    _last_flush = 0.0
+
+
+# Страница /metrics для Prometheus; при отключенных метриках ее нет
+def metrics_view(request):
+    if not enabled():
+        return HttpResponseNotFound()
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,137 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+from . import routers
+from . import tokens
+
+
+# id пользователя без загрузки его из базы: из токена или из сессии
+def _user_id(request):
+    if getattr(request, 'auth_token', None):
+        return str(request.user.id)
+    return request.session.get('_auth_user_id')
+
+
+def _sticky_key(user_id):
+    return f'db_primary:{user_id}'
+
+
+# Чтения из представлений DATABASE_REPLICA_VIEWS идут на реплику. После собственной записи пользователь
+# DATABASE_REPLICA_STICKY_SECONDS читает с основной базы, чтобы увидеть свои изменения несмотря на отставание реплики.
+# Middleware работает и под WSGI, и под ASGI, чтобы не переводить асинхронные представления в поток
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not routers.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.reads_from_replica = False
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.read_from_primary()
+        self._remember_write(request)
+        return response
+
+    async def __acall__(self, request):
+        request.reads_from_replica = False
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.read_from_primary()
+        if request.method == 'POST' and not request.reads_from_replica:
+            await sync_to_async(self._remember_write)(request)
+        return response
+
+    def _remember_write(self, request):
+        user_id = _user_id(request)
+        if request.method == 'POST' and not request.reads_from_replica and user_id:
+            cache.set(_sticky_key(user_id), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match.url_name not in settings.DATABASE_REPLICA_VIEWS:
+            return None
+        user_id = _user_id(request)
+        if user_id and cache.get(_sticky_key(user_id)):
+            return None
+        request.reads_from_replica = True
+        routers.read_from_replica()
+        return None
+
+
+# Пользователь из заголовка Authorization: Bearer ставится в request.user вместо ленивой загрузки из сессии,
+# так что ни django_session, ни таблица пользователей не читаются. Запрос с недействительным токеном остается анонимным
+class TokenAuthenticationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not tokens.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._authenticate(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._authenticate(request)
+        return await self.get_response(request)
+
+    def _authenticate(self, request):
+        request.auth_token = None
+        token = tokens.bearer_token(request)
+        if token is None:
+            return
+        try:
+            claims = tokens.decode(token, tokens.ACCESS)
+        except tokens.InvalidToken:
+            request.user = AnonymousUser()
+        else:
+            request.auth_token = token
+            request.user = tokens.user_from_claims(claims)
+
+
+# Метрики запросов для /metrics (api.metrics): время ответа, число и время запросов к базе, размер ответа.
+# Стоит первым в MIDDLEWARE, чтобы учитывать время всех остальных middleware; при METRICS_ENABLED=0 не подключается
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed
+        metrics.install_on_connections()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(request, response, state)
+        return response
+
+    async def __acall__(self, request):
+        state = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(request, response, state)
+        return response
@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import Case, Count, Exists, F, OuterRef, Subquery, Value, When
+from django.db.models.lookups import GreaterThan
+
+
+# Сведение двух направленных строк пары в одну строку с наименьшим id: принятая дружба важнее ожидающей заявки,
+# встречные ожидающие заявки означают взаимную дружбу, иначе остается отклоненная заявка.
+# Все пары сводятся одним UPDATE оставляемых строк и одним DELETE остальных, без запросов на каждую пару
+def forward(apps, schema_editor):
+    Friendship = apps.get_model('api', 'Friendship')
+    friendships = Friendship.objects.using(schema_editor.connection.alias)
+
+    friendships.update(
+        low_user=Case(When(from_user__lt=F('to_user'), then=F('from_user')), default=F('to_user')),
+        high_user=Case(When(from_user__lt=F('to_user'), then=F('to_user')), default=F('from_user')),
+        initiator=F('from_user'),
+    )
+
+    pair_rows = friendships.filter(low_user=OuterRef('low_user'), high_user=OuterRef('high_user')).order_by()
+    pending_rows = pair_rows.filter(status='pending')
+    pending_count = Subquery(pending_rows.values('low_user').annotate(rows=Count('id')).values('rows'))
+    mutual = Exists(pair_rows.filter(status='accepted')) | GreaterThan(pending_count, 1)
+
+    friendships.filter(
+        ~Exists(pair_rows.filter(id__lt=OuterRef('id'))),
+        Exists(pair_rows.filter(id__gt=OuterRef('id'))),
+    ).update(
+        status=Case(
+            When(mutual, then=Value('accepted')),
+            When(Exists(pending_rows), then=Value('pending')),
+            default=Value('rejected'),
+        ),
+        initiator=Case(
+            When(mutual, then=F('from_user')),
+            When(Exists(pending_rows), then=Subquery(pending_rows.order_by('id').values('from_user')[:1])),
+            default=F('from_user'),
+            output_field=Friendship._meta.get_field('initiator'),
+        ),
+    )
+    friendships.filter(id__in=friendships.filter(Exists(pair_rows.filter(id__lt=OuterRef('id')))).values('id')).delete()
+
+
+def backward(apps, schema_editor):
+    Friendship = apps.get_model('api', 'Friendship')
+    Friendship.objects.using(schema_editor.connection.alias).update(
+        from_user=F('initiator'),
+        to_user=Case(When(initiator=F('low_user'), then=F('high_user')), default=F('low_user')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_friendship_pair_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_friendship_pair_data'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='friendship',
+            unique_together=set(),
+        ),
+        migrations.RemoveIndex(
+            model_name='friendship',
+            name='friendship_from_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='friendship',
+            name='friendship_to_status_idx',
+        ),
+        migrations.RemoveField(
+            model_name='friendship',
+            name='from_user',
+        ),
+        migrations.RemoveField(
+            model_name='friendship',
+            name='to_user',
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='high_user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='high_user_friendships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='initiator',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='initiated_friendships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='low_user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='low_user_friendships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['low_user', 'status'], name='friendship_low_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['high_user', 'status'], name='friendship_high_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('low_user', 'high_user'), name='friendship_pair_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('low_user__lt', models.F('high_user'))), name='friendship_pair_order'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+# Копия пересчета счетчиков на момент миграции: api.counters.recount может меняться, а миграция - нет.
+# Каждый счетчик считается по сторонам low_user и high_user отдельно, чтобы работали индексы (сторона, status)
+FILL_COUNTERS = (
+    'UPDATE {user} SET '
+    'friend_count = '
+    '(SELECT COUNT(*) FROM {friendship} WHERE low_user_id = {user}.id AND status = \'accepted\') + '
+    '(SELECT COUNT(*) FROM {friendship} WHERE high_user_id = {user}.id AND status = \'accepted\'), '
+    'incoming_pending_count = '
+    '(SELECT COUNT(*) FROM {friendship} WHERE low_user_id = {user}.id AND status = \'pending\' AND initiator_id <> {user}.id) + '
+    '(SELECT COUNT(*) FROM {friendship} WHERE high_user_id = {user}.id AND status = \'pending\' AND initiator_id <> {user}.id), '
+    'outgoing_pending_count = '
+    '(SELECT COUNT(*) FROM {friendship} WHERE low_user_id = {user}.id AND status = \'pending\' AND initiator_id = low_user_id) + '
+    '(SELECT COUNT(*) FROM {friendship} WHERE high_user_id = {user}.id AND status = \'pending\' AND initiator_id = high_user_id)'
+)
+
+
+def fill_counters(apps, schema_editor):
+    quote_name = schema_editor.connection.ops.quote_name
+    schema_editor.execute(FILL_COUNTERS.format(
+        user=quote_name(apps.get_model('api', 'User')._meta.db_table),
+        friendship=quote_name(apps.get_model('api', 'Friendship')._meta.db_table),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_friendship_pair_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='friend_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='incoming_pending_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='outgoing_pending_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
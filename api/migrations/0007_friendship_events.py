@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_user_friend_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('by_user', models.BooleanField()),
+                ('kind', models.CharField(choices=[('sent', 'Sent'), ('accepted', 'Accepted'), ('rejected', 'Rejected'), ('removed', 'Removed')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='friendship_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='friendship_event_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_friendship_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='graph_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, F, Q, When
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group, Permission
 
 
@@ -43,6 +44,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # Денормализованные счетчики, поддерживаются api.counters при каждом изменении дружбы
+    friend_count = models.IntegerField(default=0)
+    incoming_pending_count = models.IntegerField(default=0)
+    outgoing_pending_count = models.IntegerField(default=0)
+    # Версия связей пользователя, увеличивается api.counters при каждом их изменении; из нее строится ETag списков
+    graph_version = models.IntegerField(default=0)
+
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'username'
@@ -52,6 +60,39 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.username
 
 
+class FriendshipQuerySet(models.QuerySet):
+    # Связь пары пользователей независимо от того, кто отправил заявку
+    def between(self, user1_id, user2_id):
+        low_user_id, high_user_id = Friendship.pair(user1_id, user2_id)
+        return self.filter(low_user_id=low_user_id, high_user_id=high_user_id)
+
+    # Связи пользователя сразу с несколькими собеседниками одним запросом IN в обе стороны
+    def between_many(self, user_id, other_ids):
+        return self.filter(
+            Q(low_user=user_id, high_user__in=other_ids) | Q(high_user=user_id, low_user__in=other_ids)
+        )
+
+    # Друзья пользователя: (id связи, id друга, имя друга) без загрузки моделей User
+    def friends_of(self, user):
+        return self.filter(
+            (Q(low_user=user) | Q(high_user=user)) & Q(status='accepted')
+        ).annotate(
+            friend_id=Case(When(low_user=user, then=F('high_user_id')), default=F('low_user_id')),
+            friend_username=Case(When(low_user=user, then=F('high_user__username')), default=F('low_user__username')),
+        ).values_list('id', 'friend_id', 'friend_username')
+
+    # Все заявки пользователя в обе стороны: (id связи, id собеседника, имя собеседника, статус, id отправителя)
+    def requests_of(self, user):
+        return self.filter(
+            Q(low_user=user) | Q(high_user=user)
+        ).annotate(
+            other_id=Case(When(low_user=user, then=F('high_user_id')), default=F('low_user_id')),
+            other_username=Case(When(low_user=user, then=F('high_user__username')), default=F('low_user__username')),
+        ).values_list('id', 'other_id', 'other_username', 'status', 'initiator_id')
+
+
+# Дружба хранится одной строкой на пару пользователей: low_user.id < high_user.id,
+# initiator - пользователь, отправивший заявку
 class Friendship(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -59,12 +100,58 @@ class Friendship(models.Model):
         ('rejected', 'Rejected')
     )
 
-    from_user = models.ForeignKey(User, related_name='from_user_friendships', on_delete=models.CASCADE)
-    to_user = models.ForeignKey(User, related_name='to_user_friendships', on_delete=models.CASCADE)
+    # Отдельные индексы по внешним ключам не нужны: low_user покрывается уникальным ограничением пары,
+    # high_user - составным индексом (high_user, status)
+    low_user = models.ForeignKey(User, related_name='low_user_friendships', on_delete=models.CASCADE, db_index=False)
+    high_user = models.ForeignKey(User, related_name='high_user_friendships', on_delete=models.CASCADE, db_index=False)
+    initiator = models.ForeignKey(User, related_name='initiated_friendships', on_delete=models.CASCADE, db_index=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
 
+    objects = FriendshipQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['low_user', 'high_user'], name='friendship_pair_uniq'),
+            models.CheckConstraint(check=Q(low_user__lt=F('high_user')), name='friendship_pair_order'),
+        ]
+        indexes = [
+            models.Index(fields=['low_user', 'status'], name='friendship_low_status_idx'),
+            models.Index(fields=['high_user', 'status'], name='friendship_high_status_idx'),
+        ]
+
+    @staticmethod
+    def pair(user1_id, user2_id):
+        return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+    def other_user_id(self, user_id):
+        return self.high_user_id if self.low_user_id == user_id else self.low_user_id
+
+    def __str__(self):
+        return f"{self.low_user} and {self.high_user} are {self.status} friends, requested by {self.initiator}"
+
+
+# Журнал изменений дружбы для инкрементальной синхронизации клиентов (api.events): на каждое изменение
+# пишется по строке для обоих участников, поэтому лента пользователя читается диапазоном индекса (user, id).
+# by_user - изменение выполнил сам владелец ленты
+class FriendshipEvent(models.Model):
+    KIND_CHOICES = (
+        ('sent', 'Sent'),
+        ('accepted', 'Accepted'),
+        ('rejected', 'Rejected'),
+        ('removed', 'Removed')
+    )
+
+    # Индекс по user покрывается составным индексом (user, id)
+    user = models.ForeignKey(User, related_name='friendship_events', on_delete=models.CASCADE, db_index=False)
+    other_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    by_user = models.BooleanField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
     class Meta:
-        unique_together = ('from_user', 'to_user')
+        indexes = [
+            models.Index(fields=['user', 'id'], name='friendship_event_user_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.from_user} is {self.status} friend with {self.to_user}"
\ No newline at end of file
+        return f"{self.user}: {self.kind} with {self.other_user}"
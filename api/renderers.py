@@ -0,0 +1,130 @@
+import json
+from collections.abc import Sequence
+
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Быстрая отдача больших списков друзей и заявок. Представления передают в ответ не списки словарей,
+# а Rows - кортежи значений прямо из values_list (или кэша) и имена полей; словари создаются только
+# если их требует формат ответа. JSON кодируется orjson, а без него - стандартным json без отступов.
+# Формат выбирается заголовком Accept:
+#   application/json                              - обычные списки объектов, как у остальных представлений
+#   application/vnd.friend-service.compact+json   - список как {"fields": [...], "rows": [[...], ...]}
+#   application/msgpack                           - MessagePack (нужен пакет msgpack)
+#   application/vnd.friend-service.compact+msgpack - компактный вид в MessagePack
+
+COMPACT_JSON = 'application/vnd.friend-service.compact+json'
+COMPACT_MSGPACK = 'application/vnd.friend-service.compact+msgpack'
+
+_encoder = JSONEncoder()
+
+
+# Список строк одинаковой структуры. Снаружи выглядит как список словарей: в Python-коде и тестах
+# с ним работают как с обычным списком, JSONEncoder из DRF превращает его в словари через tolist
+class Rows(Sequence):
+    __slots__ = ('fields', 'rows')
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Rows(self.fields, self.rows[index])
+        return dict(zip(self.fields, self.rows[index]))
+
+    def __eq__(self, other):
+        if isinstance(other, (list, Rows)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in self.rows]
+
+    def compact(self):
+        return {'fields': list(self.fields), 'rows': self.rows}
+
+
+def _default(value):
+    return _encoder.default(value)
+
+
+def _compact_default(value):
+    if isinstance(value, Rows):
+        return value.compact()
+    return _encoder.default(value)
+
+
+def dumps(data, compact=False):
+    default = _compact_default if compact else _default
+    if orjson is not None:
+        return orjson.dumps(data, default=default)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def packb(data, compact=False):
+    return msgpack.packb(data, default=_compact_default if compact else _default, use_bin_type=True)
+
+
+class FastJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    compact = False
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data, self.compact)
+
+
+class CompactJSONRenderer(FastJSONRenderer):
+    media_type = COMPACT_JSON
+    format = 'compact-json'
+    compact = True
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    compact = False
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data, self.compact)
+
+
+class CompactMessagePackRenderer(MessagePackRenderer):
+    media_type = COMPACT_MSGPACK
+    format = 'compact-msgpack'
+    compact = True
+
+
+# Рендеры представлений списков; первый подходящий к Accept выбирается DRF, для */* - обычный JSON
+FRIEND_LIST_RENDERERS = [FastJSONRenderer, CompactJSONRenderer]
+if msgpack is not None:
+    FRIEND_LIST_RENDERERS += [MessagePackRenderer, CompactMessagePackRenderer]
+FRIEND_LIST_RENDERERS.append(BrowsableAPIRenderer)
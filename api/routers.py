@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Маршрутизация чтений на реплику: api.middleware.ReplicaRoutingMiddleware включает реплику
+# только для представлений из settings.DATABASE_REPLICA_VIEWS, все остальное читается и пишется в default
+
+PRIMARY_ALIAS = 'default'
+REPLICA_ALIAS = 'replica'
+ROUTER_PATH = 'api.routers.PrimaryReplicaRouter'
+
+_read_alias = ContextVar('friend_service_read_alias', default=None)
+
+
+def enabled():
+    return ROUTER_PATH in settings.DATABASE_ROUTERS
+
+
+# Значение задается на время обработки запроса; каждый запрос выполняется в своем контексте
+def read_from_replica():
+    _read_alias.set(REPLICA_ALIAS)
+
+
+def read_from_primary():
+    _read_alias.set(None)
+
+
+# Принудительное чтение с основной базы, например при заполнении кэша, который должен совпадать с ней
+@contextmanager
+def primary():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        # Сессия только что вошедшего пользователя могла еще не дойти до реплики
+        if model._meta.app_label == 'sessions':
+            return PRIMARY_ALIAS
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_ALIAS
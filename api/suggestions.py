@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.db.models import Case, Count, F, Q, When
+
+from .models import User, Friendship
+from . import cache as friend_cache
+from . import graph_index
+
+
+# Пересечение двух списков друзей в памяти: множество строится по большему списку, перебирается меньший
+def _intersect(friends, other_friends):
+    smaller, larger = sorted((friends, other_friends), key=len)
+    larger_ids = {friend_id for _, friend_id, _ in larger}
+    return sorted((friend_id, username) for _, friend_id, username in smaller if friend_id in larger_ids)
+
+
+# Общие друзья двух пользователей, (id, имя) по возрастанию id: из индекса графа, из кэша, если оба списка
+# уже в нем, иначе одним запросом - друзья пользователя, входящие в подзапросы друзей other_id с обеих сторон пары
+def mutual_friends(user_id, other_id):
+    if graph_index.enabled():
+        graph = graph_index.get()
+        return _intersect(graph.friends(user_id), graph.friends(other_id))
+    friends = friend_cache.cached_friends(user_id)
+    other_friends = friend_cache.cached_friends(other_id) if friends is not None else None
+    if other_friends is not None:
+        return _intersect(friends, other_friends)
+    accepted = Friendship.objects.filter(status='accepted')
+    rows = Friendship.objects.friends_of(user_id).filter(
+        Q(friend_id__in=accepted.filter(low_user=other_id).values('high_user'))
+        | Q(friend_id__in=accepted.filter(high_user=other_id).values('low_user'))
+    ).order_by('friend_id')
+    return [(friend_id, username) for _, friend_id, username in rows]
+
+
+# id последних limit друзей: из кэша, если список уже в нем, иначе по limit строк с каждой стороны пары
+# в порядке убывания id связи - индексы (сторона, status) отдают их без чтения всего списка друзей
+def _recent_friend_ids(user_id, limit):
+    friends = friend_cache.cached_friends(user_id)
+    if friends is not None:
+        return [friend_id for _, friend_id, _ in friends[-limit:]]
+    recent = []
+    for side, other_side in (('low_user', 'high_user_id'), ('high_user', 'low_user_id')):
+        recent.extend(
+            Friendship.objects.filter(**{side: user_id}, status='accepted').order_by('-id').values_list('id', other_side)[:limit]
+        )
+    return [friend_id for _, friend_id in sorted(recent)[-limit:]]
+
+
+# "Возможно, вы знакомы": пользователи с наибольшим числом общих друзей.
+# Источник - последние FRIEND_SUGGESTIONS_SOURCE_FRIENDS друзей пользователя, подсчет идет одним
+# запросом с группировкой по кандидату; все, с кем у пользователя уже есть связь, исключаются подзапросами
+def suggest_friends(user_id, limit):
+    source_ids = _recent_friend_ids(user_id, settings.FRIEND_SUGGESTIONS_SOURCE_FRIENDS)
+    if not source_ids:
+        return []
+    from_source = Q(low_user__in=source_ids)
+    candidates = Friendship.objects.filter(
+        (from_source | Q(high_user__in=source_ids)) & Q(status='accepted')
+    ).annotate(
+        candidate=Case(When(from_source, then=F('high_user_id')), default=F('low_user_id'))
+    ).exclude(
+        candidate=user_id
+    ).exclude(
+        candidate__in=Friendship.objects.filter(low_user=user_id).values('high_user')
+    ).exclude(
+        candidate__in=Friendship.objects.filter(high_user=user_id).values('low_user')
+    ).values('candidate').annotate(
+        common=Count('id')
+    ).order_by('-common', 'candidate').values_list('candidate', 'common')[:limit]
+    candidates = list(candidates)
+    usernames = dict(User.objects.filter(id__in=[candidate for candidate, _ in candidates]).values_list('id', 'username'))
+    return [(candidate, usernames[candidate], common) for candidate, common in candidates]
@@ -1,9 +1,43 @@
-from django.test import TestCase, Client
-from .models import User
+import importlib
+import json
+import os
+import tempfile
+import threading
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.apps import apps as django_apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import User, Friendship, FriendshipEvent
+from . import cache as friend_cache
+from . import friendships
+from . import graph_index
+from . import hashers
+from . import metrics
+from . import renderers
+from . import suggestions
+from . import tokens
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
 
+def make_friendship(from_user, to_user, friendship_status):
+    low_user_id, high_user_id = Friendship.pair(from_user.id, to_user.id)
+    return Friendship(low_user_id=low_user_id, high_user_id=high_user_id, initiator_id=from_user.id, status=friendship_status)
+
+
 class LoginUserViewTestCase(TestCase):
     
 
@@ -129,6 +163,67 @@ class SendFriendRequestTestCase(TestCase):
         self.assertEqual(response.data, {'error':'Вы не можете отправить заявку самому себе'})
 
 
+    def test_mutual_requests_create_single_friendship(self):
+        self.client.post(self.login_url, {'username': 'testuser2', 'password': 'testpassword'}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user1.id}, format='json')
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.send_friend_request_url, {'to_user_id': self.user2.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        friendship = Friendship.objects.get()
+        self.assertEqual((friendship.low_user_id, friendship.high_user_id), (self.user1.id, self.user2.id))
+        self.assertEqual(friendship.initiator_id, self.user2.id)
+        self.assertEqual(friendship.status, 'accepted')
+
+
+class ConcurrentFriendRequestsTestCase(TransactionTestCase):
+
+
+    def send_in_parallel(self, requests):
+        barrier = threading.Barrier(len(requests))
+        errors = []
+
+        def send(user, target):
+            try:
+                barrier.wait()
+                friendships.send_requests(user, [target.id])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send, args=request) for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+
+    def test_reciprocal_requests_become_one_accepted_friendship(self):
+        for number in range(10):
+            user1 = User.objects.create(username=f'left{number}')
+            user2 = User.objects.create(username=f'right{number}')
+            self.assertEqual(self.send_in_parallel([(user1, user2), (user2, user1)]), [])
+            self.assertEqual(list(Friendship.objects.between(user1.id, user2.id).values_list('status', flat=True)), ['accepted'])
+            self.assertEqual(
+                list(User.objects.filter(id__in=[user1.id, user2.id]).values_list(
+                    'friend_count', 'incoming_pending_count', 'outgoing_pending_count'
+                )),
+                [(1, 0, 0), (1, 0, 0)]
+            )
+
+
+    def test_mutual_accept_writes_two_statements(self):
+        user1 = User.objects.create(username='testuser1')
+        user2 = User.objects.create(username='testuser2')
+        friendships.send_requests(user1, [user2.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(friendships.send_requests(user2, [user1.id]), {user1.id: friendships.SUCCESS})
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len([sql for sql in writes if 'api_friendshipevent' not in sql]), 2)
+        self.assertEqual(len([sql for sql in writes if 'api_friendshipevent' in sql]), 1)
+
+
 class AcceptFriendRequestTestCase(TestCase):
 
 
@@ -231,7 +326,7 @@ class GetFriendsTestCase(TestCase):
 
     def test_incorrect_method(self):
         self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
-        response = self.client.get(self.get_friends_url)
+        response = self.client.put(self.get_friends_url)
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
@@ -241,6 +336,60 @@ class GetFriendsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+    def test_get_friends_list(self):
+        friend1 = User.objects.create(username='friend1')
+        friend2 = User.objects.create(username='friend2')
+        make_friendship(self.user1, friend1, 'accepted').save()
+        make_friendship(friend2, self.user1, 'accepted').save()
+        self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friends_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['friends'], key=lambda friend: friend['id']), [
+            {'id': friend1.id, 'username': 'friend1'},
+            {'id': friend2.id, 'username': 'friend2'},
+        ])
+
+
+    @override_settings(FRIEND_CACHE_ENABLED=False)
+    def test_get_friends_constant_query_count(self):
+        self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        query_counts = []
+        for friends_count in (1, 20):
+            friends = User.objects.bulk_create([
+                User(username=f'friend{friends_count}_{i}') for i in range(friends_count)
+            ])
+            Friendship.objects.bulk_create([
+                make_friendship(self.user1, friend, 'accepted') for friend in friends
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.get_friends_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+    def test_get_friends_pagination(self):
+        friends = User.objects.bulk_create([User(username=f'friend{i}') for i in range(3)])
+        Friendship.objects.bulk_create([
+            make_friendship(self.user1, friend, 'accepted') for friend in friends
+        ])
+        self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friends_url, {'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([friend['username'] for friend in response.data['friends']], ['friend0', 'friend1'])
+        self.assertIsNotNone(response.data['next_cursor'])
+        response = self.client.post(self.get_friends_url, {'limit': 2, 'cursor': response.data['next_cursor']})
+        self.assertEqual([friend['username'] for friend in response.data['friends']], ['friend2'])
+        self.assertIsNone(response.data['next_cursor'])
+
+
+    def test_get_friends_invalid_pagination(self):
+        self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friends_url, {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'Некорректные параметры пагинации'})
+
+
 class GetFriendRequestsTestCase(TestCase):
 
 
@@ -253,7 +402,7 @@ class GetFriendRequestsTestCase(TestCase):
 
     def test_incorrect_method(self):
         self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
-        response = self.client.get(self.get_friend_requests_url)
+        response = self.client.put(self.get_friend_requests_url)
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
@@ -263,6 +412,21 @@ class GetFriendRequestsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+    def test_get_friend_requests_pagination(self):
+        user2 = User.objects.create(username='testuser2')
+        user3 = User.objects.create(username='testuser3')
+        make_friendship(user2, self.user1, 'pending').save()
+        make_friendship(self.user1, user3, 'pending').save()
+        self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friend_requests_url, {'limit': 1})
+        self.assertEqual(response.data['incoming_requests'], [{'id': user2.id, 'username': 'testuser2', 'status': 'pending'}])
+        self.assertEqual(response.data['outgoing_requests'], [])
+        response = self.client.post(self.get_friend_requests_url, {'limit': 1, 'cursor': response.data['next_cursor']})
+        self.assertEqual(response.data['incoming_requests'], [])
+        self.assertEqual(response.data['outgoing_requests'], [{'id': user3.id, 'username': 'testuser3', 'status': 'pending'}])
+        self.assertIsNone(response.data['next_cursor'])
+
+
 class ViewFriendStatusTestCase(TestCase):
 
 
@@ -297,6 +461,16 @@ class ViewFriendStatusTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
     
 
+    def test_view_friend_status_mutual_requests(self):
+        self.client.post(self.login_url, {'username': 'testuser2', 'password': 'testpassword'}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user1.id}, format='json')
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user2.id}, format='json')
+        response = self.client.post(self.view_friend_status_url, {'friend_id':self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'friend': self.user2.id, 'status': 'accepted'})
+
+
     def test_view_friend_status_non_existent_user(self):
         self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
         self.client.post(self.send_friend_request_url, {'to_user_id': self.user2.id}, format='json')
@@ -312,6 +486,183 @@ class ViewFriendStatusTestCase(TestCase):
         self.assertEqual(response.data, {'error':'У вас нет заявок с этим пользователем'})
 
 
+class ViewFriendStatusesTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        self.login_url = reverse('login')
+        self.view_friend_statuses_url = reverse('friendship_statuses')
+
+
+    def test_incorrect_method(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.get(self.view_friend_statuses_url, {'friend_ids': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_view_friend_statuses_success(self):
+        make_friendship(self.user1, self.user2, 'pending').save()
+        make_friendship(self.user3, self.user1, 'accepted').save()
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.view_friend_statuses_url, {'friend_ids': f'{self.user2.id},{self.user3.id},0'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'statuses': [
+            {'friend': self.user2.id, 'status': 'pending'},
+            {'friend': self.user3.id, 'status': 'accepted'},
+            {'friend': 0, 'status': None},
+        ]})
+        self.assertEqual(sum('api_friendship' in query['sql'] for query in queries.captured_queries), 1)
+
+
+    def test_view_friend_statuses_invalid_ids(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.view_friend_statuses_url, {'friend_ids': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'Некорректный список пользователей'})
+
+
+    @override_settings(FRIEND_STATUS_BATCH_LIMIT=2)
+    def test_view_friend_statuses_too_many_ids(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.view_friend_statuses_url, {'friend_ids': '1,2,3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class GetMutualFriendsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        self.user4 = User.objects.create_user(username='testuser4', password='testpassword')
+        self.login_url = reverse('login')
+        self.mutual_friends_url = reverse('mutual_friends')
+
+
+    def test_incorrect_method(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.get(self.mutual_friends_url, {'friend_id': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_get_mutual_friends_success(self):
+        Friendship.objects.bulk_create([
+            make_friendship(self.user1, self.user3, 'accepted'),
+            make_friendship(self.user2, self.user3, 'accepted'),
+            make_friendship(self.user1, self.user4, 'accepted'),
+            make_friendship(self.user4, self.user2, 'pending'),
+        ])
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.mutual_friends_url, {'friend_id': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'friend': self.user2.id,
+            'count': 1,
+            'mutual_friends': [{'id': self.user3.id, 'username': 'testuser3'}]
+        })
+
+
+    @override_settings(FRIEND_CACHE_ENABLED=True)
+    def test_mutual_friends_from_warm_cache(self):
+        Friendship.objects.bulk_create([
+            make_friendship(self.user1, self.user3, 'accepted'),
+            make_friendship(self.user2, self.user3, 'accepted'),
+            make_friendship(self.user1, self.user4, 'accepted'),
+        ])
+        cache.clear()
+        friend_cache.friends(self.user1.id)
+        self.assertEqual(suggestions.mutual_friends(self.user1.id, self.user2.id), [(self.user3.id, 'testuser3')])
+        friend_cache.friends(self.user2.id)
+        with CaptureQueriesContext(connection) as queries:
+            mutual = suggestions.mutual_friends(self.user1.id, self.user2.id)
+        self.assertEqual(mutual, [(self.user3.id, 'testuser3')])
+        self.assertEqual(len(queries), 0)
+
+
+    def test_get_mutual_friends_non_existent_user(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.mutual_friends_url, {'friend_id': '0'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error':'Такого пользователя не существует'})
+
+
+class GetFriendSuggestionsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.users = [
+            User.objects.create_user(username=f'testuser{number}', password='testpassword') for number in range(1, 7)
+        ]
+        self.login_url = reverse('login')
+        self.friend_suggestions_url = reverse('friend_suggestions')
+
+
+    def test_incorrect_method(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.get(self.friend_suggestions_url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_get_friend_suggestions_ranking(self):
+        user1, user2, user3, user4, user5, user6 = self.users
+        Friendship.objects.bulk_create([
+            make_friendship(user1, user2, 'accepted'),
+            make_friendship(user1, user3, 'accepted'),
+            make_friendship(user2, user3, 'accepted'),
+            make_friendship(user2, user4, 'accepted'),
+            make_friendship(user3, user4, 'accepted'),
+            make_friendship(user3, user5, 'accepted'),
+            make_friendship(user2, user6, 'accepted'),
+            make_friendship(user1, user6, 'pending'),
+        ])
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.friend_suggestions_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'suggestions': [
+            {'id': user4.id, 'username': 'testuser4', 'mutual_friends': 2},
+            {'id': user5.id, 'username': 'testuser5', 'mutual_friends': 1},
+        ]})
+        response = self.client.post(self.friend_suggestions_url, {'limit': 1})
+        self.assertEqual([suggestion['id'] for suggestion in response.data['suggestions']], [user4.id])
+
+
+    @override_settings(FRIEND_SUGGESTIONS_SOURCE_FRIENDS=2)
+    def test_suggestions_from_most_recent_friends(self):
+        user1, user2, user3, user4, user5, user6 = self.users
+        Friendship.objects.bulk_create([
+            make_friendship(user1, user2, 'accepted'),
+            make_friendship(user4, user1, 'accepted'),
+            make_friendship(user1, user3, 'accepted'),
+            make_friendship(user2, user5, 'accepted'),
+            make_friendship(user3, user6, 'accepted'),
+            make_friendship(user4, user6, 'accepted'),
+        ])
+        self.assertEqual(suggestions._recent_friend_ids(user1.id, 2), [user4.id, user3.id])
+        self.assertEqual(suggestions.suggest_friends(user1.id, 10), [(user6.id, 'testuser6', 2)])
+
+
+    def test_get_friend_suggestions_without_friends(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.friend_suggestions_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'suggestions': []})
+
+
+    def test_get_friend_suggestions_invalid_limit(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.friend_suggestions_url, {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'Некорректный размер списка'})
+
+
 class RemoveFriendTestCase(TestCase):
 
 
@@ -358,6 +709,7 @@ class RemoveFriendTestCase(TestCase):
         response = self.client.post(self.remove_friend_url, {'friend_id':self.user2.id})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'success': 'Пользователь успешно удален из друзей'})
+        self.assertFalse(Friendship.objects.exists())
     
 
     def test_remove_friend_non_existent_user(self):
@@ -372,4 +724,1153 @@ class RemoveFriendTestCase(TestCase):
         self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
         response = self.client.post(self.remove_friend_url, {'friend_id':self.user2.id})
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
-        self.assertEqual(response.data, {'error':'У вас нет заявок с этим пользователем'})
\ No newline at end of file
+        self.assertEqual(response.data, {'error':'У вас нет заявок с этим пользователем'})
+
+
+class FriendCountsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        self.login_url = reverse('login')
+        self.send_friend_request_url = reverse('send_request')
+        self.accept_friend_request_url = reverse('accept_request')
+        self.reject_friend_request_url = reverse('reject_request')
+        self.remove_friend_url = reverse('remove_friend')
+        self.friend_counts_url = reverse('friend_counts')
+
+
+    def counts(self, user):
+        return list(User.objects.filter(id=user.id).values_list(
+            'friend_count', 'incoming_pending_count', 'outgoing_pending_count'
+        ).get())
+
+
+    def test_incorrect_method(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.get(self.friend_counts_url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_counts_follow_transitions(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user2.id}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user3.id}, format='json')
+        self.assertEqual(self.counts(self.user1), [0, 0, 2])
+        self.assertEqual(self.counts(self.user2), [0, 1, 0])
+        self.client.post(self.login_url, {'username': 'testuser2', 'password': 'testpassword'}, format='json')
+        self.client.post(self.accept_friend_request_url, {'friend_id': self.user1.id}, format='json')
+        self.client.post(self.login_url, {'username': 'testuser3', 'password': 'testpassword'}, format='json')
+        self.client.post(self.reject_friend_request_url, {'friend_id': self.user1.id}, format='json')
+        self.assertEqual(self.counts(self.user1), [1, 0, 0])
+        self.assertEqual(self.counts(self.user2), [1, 0, 0])
+        self.assertEqual(self.counts(self.user3), [0, 0, 0])
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user1.id}, format='json')
+        self.assertEqual(self.counts(self.user1), [1, 1, 0])
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.remove_friend_url, {'friend_id': self.user2.id}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.friend_counts_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'friend_count': 0, 'incoming_pending_count': 1, 'outgoing_pending_count': 0})
+        self.assertFalse(any('api_friendship' in query['sql'] for query in queries.captured_queries))
+
+
+    def test_recount_command_repairs_counters(self):
+        Friendship.objects.bulk_create([
+            make_friendship(self.user1, self.user2, 'accepted'),
+            make_friendship(self.user3, self.user1, 'pending'),
+        ])
+        User.objects.filter(id=self.user2.id).update(outgoing_pending_count=5)
+        out = StringIO()
+        call_command('recount_friend_counters', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'repaired: 3')
+        self.assertEqual(self.counts(self.user1), [1, 1, 0])
+        self.assertEqual(self.counts(self.user2), [1, 0, 0])
+        self.assertEqual(self.counts(self.user3), [0, 0, 1])
+
+
+    def test_migration_fills_counters(self):
+        migration = importlib.import_module('api.migrations.0006_user_friend_counters')
+        user4 = User.objects.create_user(username='testuser4', password='testpassword')
+        # user2 отправляет заявки и как младшая сторона пары (user3, user4), и как старшая (user1)
+        Friendship.objects.bulk_create([
+            make_friendship(self.user2, self.user1, 'pending'),
+            make_friendship(self.user2, self.user3, 'pending'),
+            make_friendship(self.user2, user4, 'accepted'),
+            make_friendship(self.user3, self.user1, 'pending'),
+        ])
+        User.objects.update(friend_count=0, incoming_pending_count=0, outgoing_pending_count=0)
+        schema_editor = mock.Mock(connection=connection, execute=lambda sql: connection.cursor().execute(sql))
+        migration.fill_counters(django_apps, schema_editor)
+        self.assertEqual(self.counts(self.user1), [0, 2, 0])
+        self.assertEqual(self.counts(self.user2), [1, 0, 2])
+        self.assertEqual(self.counts(self.user3), [0, 1, 1])
+        self.assertEqual(self.counts(user4), [1, 0, 0])
+
+
+class BatchFriendOperationsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        self.login_url = reverse('login')
+        self.batch_operations_url = reverse('batch_operations')
+
+
+    def test_incorrect_method(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.get(self.batch_operations_url, {'action': 'send', 'user_ids': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_batch_send_requests(self):
+        make_friendship(self.user3, self.user1, 'pending').save()
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.batch_operations_url, {
+                'action': 'send', 'user_ids': f'{self.user2.id},{self.user3.id},{self.user1.id},0'
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'results': [
+            {'id': self.user2.id, 'result': 'success'},
+            {'id': self.user3.id, 'result': 'success'},
+            {'id': self.user1.id, 'result': 'self_request'},
+            {'id': 0, 'result': 'user_not_found'},
+        ]})
+        self.assertEqual(sum('FROM "api_user"' in query['sql'] and ' IN (' in query['sql'] for query in queries.captured_queries), 1)
+        self.assertEqual(Friendship.objects.between(self.user1.id, self.user2.id).get().status, 'pending')
+        self.assertEqual(Friendship.objects.between(self.user1.id, self.user3.id).get().status, 'accepted')
+
+
+    def test_batch_accept_and_remove(self):
+        make_friendship(self.user2, self.user1, 'pending').save()
+        make_friendship(self.user3, self.user1, 'pending').save()
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.batch_operations_url, {'action': 'accept', 'user_ids': [self.user2.id, self.user3.id]})
+        self.assertEqual([item['result'] for item in response.data['results']], ['success', 'success'])
+        self.assertEqual(Friendship.objects.filter(status='accepted').count(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.batch_operations_url, {'action': 'remove', 'user_ids': f'{self.user2.id},{self.user3.id}'})
+        self.assertEqual([item['result'] for item in response.data['results']], ['success', 'success'])
+        self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries.captured_queries), 1)
+        self.assertFalse(Friendship.objects.exists())
+
+
+    def test_batch_unknown_action(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.batch_operations_url, {'action': 'block', 'user_ids': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'Неизвестное действие'})
+
+
+@override_settings(FRIEND_CACHE_ENABLED=True)
+class FriendCacheTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.login_url = reverse('login')
+        self.send_friend_request_url = reverse('send_request')
+        self.get_friends_url = reverse('get_friends')
+        self.get_friend_requests_url = reverse('get_friend_requests')
+        self.cache_stats_url = reverse('cache_stats')
+
+
+    def test_repeated_read_served_from_cache(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.get_friends_url)
+        hits = friend_cache.stats()['hits']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.get_friends_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('api_friendship' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(friend_cache.stats()['hits'], hits + 1)
+
+
+    def test_friend_request_invalidates_cache(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friend_requests_url)
+        self.assertEqual(response.data['incoming_requests'], [])
+        self.client.post(self.login_url, {'username': 'testuser2', 'password': 'testpassword'}, format='json')
+        self.client.post(self.send_friend_request_url, {'to_user_id': self.user1.id}, format='json')
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.get_friend_requests_url)
+        self.assertEqual(response.data['incoming_requests'], [{'id': self.user2.id, 'username': 'testuser2', 'status': 'pending'}])
+
+
+    def test_stale_fill_after_write_not_cached(self):
+        requests_of = Friendship.objects.requests_of
+
+        # Чтение загружает список до заявки, а кладет его в кэш уже после ее фиксации
+        def stale_requests_of(user_id):
+            rows = list(requests_of(user_id).order_by('id'))
+            self.client.post(self.login_url, {'username': 'testuser2', 'password': 'testpassword'}, format='json')
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.send_friend_request_url, {'to_user_id': self.user1.id}, format='json')
+            return mock.Mock(order_by=lambda *fields: rows)
+
+        with mock.patch.object(Friendship.objects, 'requests_of', stale_requests_of):
+            self.assertEqual(friend_cache.requests(self.user1.id), [])
+        self.assertEqual([row[1] for row in friend_cache.requests(self.user1.id)], [self.user2.id])
+
+
+    def test_cache_stats_requires_staff(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        response = self.client.post(self.cache_stats_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.filter(id=self.user1.id).update(is_staff=True)
+        response = self.client.post(self.cache_stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'hits', 'misses', 'hit_ratio'})
+
+
+    @override_settings(AUTH_TOKENS_ENABLED=True, SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_settings_needing_shared_cache(self):
+        self.assertEqual(friend_cache.process_local_settings(), ['FRIEND_CACHE_ENABLED', 'AUTH_TOKENS_ENABLED', 'SESSION_BACKEND'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(friend_cache.process_local_settings(), [])
+
+
+@override_settings(FRIEND_GRAPH_INDEX=True)
+class GraphIndexTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        Friendship.objects.bulk_create([
+            make_friendship(self.user1, self.user2, 'accepted'),
+            make_friendship(self.user3, self.user1, 'pending'),
+        ])
+        self.login_url = reverse('login')
+        self.accept_friend_request_url = reverse('accept_request')
+        self.remove_friend_url = reverse('remove_friend')
+        self.get_friends_url = reverse('get_friends')
+        self.view_friend_status_url = reverse('friendship_status')
+        graph_index.reset()
+
+
+    def test_reads_served_from_index(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.get_friends_url)
+        with CaptureQueriesContext(connection) as queries:
+            friends_response = self.client.post(self.get_friends_url)
+            status_response = self.client.post(self.view_friend_status_url, {'friend_id': self.user3.id})
+        self.assertEqual(friends_response.data['friends'], [{'id': self.user2.id, 'username': 'testuser2'}])
+        self.assertEqual(status_response.data, {'friend': self.user3.id, 'status': 'pending'})
+        self.assertFalse(any('api_friendship' in query['sql'] for query in queries.captured_queries))
+
+
+    def test_index_updated_after_changes(self):
+        self.client.post(self.login_url, {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.client.post(self.get_friends_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.accept_friend_request_url, {'friend_id': self.user3.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.remove_friend_url, {'friend_id': self.user2.id})
+        response = self.client.post(self.get_friends_url)
+        self.assertEqual(response.data['friends'], [{'id': self.user3.id, 'username': 'testuser3'}])
+        response = self.client.post(self.view_friend_status_url, {'friend_id': self.user2.id})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    def test_changes_during_rebuild_kept(self):
+        index = graph_index.get()
+        index.built_at -= 10 ** 6
+        build = graph_index.GraphIndex
+
+        # Пара меняется после того, как новый индекс прочитал базу, но до его замены
+        def build_and_change():
+            rebuilt = build()
+            Friendship.objects.create(low_user=self.user2, high_user=self.user3, initiator=self.user2, status='pending')
+            graph_index.refresh(self.user2.id, [self.user3.id])
+            return rebuilt
+
+        with mock.patch.object(graph_index, 'GraphIndex', build_and_change):
+            rebuilt = graph_index.get()
+        self.assertIsNot(rebuilt, index)
+        self.assertIs(graph_index.get(), rebuilt)
+        self.assertEqual(rebuilt.status(self.user3.id, self.user2.id), 'pending')
+
+
+    def test_expired_index_served_during_rebuild(self):
+        index = graph_index.get()
+        index.built_at -= 10 ** 6
+        with graph_index._build_lock:
+            self.assertIs(graph_index.get(), index)
+
+
+    def test_graph_index_command_reports_memory(self):
+        out = StringIO()
+        call_command('graph_index', stdout=out)
+        self.assertIn('edges: 2', out.getvalue())
+        self.assertIn('bytes_per_edge:', out.getvalue())
+
+
+class SqliteProfileTestCase(TestCase):
+
+
+    # Новое соединение с временным файлом: режим журнала нельзя сменить внутри транзакции теста
+    def pragmas(self, profile):
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=settings.SQLITE_PROFILES[profile]):
+            temporary = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory, 'profile.sqlite3')})
+            try:
+                with temporary.cursor() as cursor:
+                    return {
+                        name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                        for name in ('journal_mode', 'busy_timeout', 'synchronous')
+                    }
+            finally:
+                temporary.close()
+
+
+    def test_default_profile_keeps_journal_mode(self):
+        self.assertEqual(settings.SQLITE_PRAGMAS, settings.SQLITE_PROFILES['development'])
+        self.assertEqual(self.pragmas('development'), {'journal_mode': 'delete', 'busy_timeout': 5000, 'synchronous': 2})
+
+
+    def test_production_profile_pragmas(self):
+        self.assertEqual(self.pragmas('production'), {'journal_mode': 'wal', 'busy_timeout': 5000, 'synchronous': 1})
+
+
+@override_settings(DATABASE_ROUTERS=['api.routers.PrimaryReplicaRouter'], FRIEND_CACHE_ENABLED=False)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        self.client.post(reverse('login'), {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        cache.clear()
+
+
+    def friend_list_queries(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response.data['friends'], [{'id': self.user2.id, 'username': 'testuser2'}])
+        return [query['sql'] for query in queries.captured_queries]
+
+
+    def test_read_view_uses_replica(self):
+        self.assertTrue(any('api_friendship' in sql for sql in self.friend_list_queries()))
+
+
+    def test_reads_after_own_write_use_primary(self):
+        self.client.post(reverse('remove_friend'), {'friend_id': self.user2.id}, format='json')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        self.assertEqual(self.friend_list_queries(), [])
+
+
+    def test_writes_and_sessions_use_primary(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.client.post(reverse('send_request'), {'to_user_id': self.user2.id}, format='json')
+        self.assertEqual(queries.captured_queries, [])
+
+
+
+class AsyncFriendViewsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        make_friendship(self.user3, self.user1, 'pending').save()
+        User.objects.filter(id=self.user1.id).update(friend_count=1, incoming_pending_count=1)
+        self.async_client.force_login(self.user1)
+
+
+    async def test_incorrect_method(self):
+        response = await self.async_client.get(reverse('async_get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    async def test_login_required(self):
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.post(reverse('async_get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+
+    async def test_get_friends(self):
+        response = await self.async_client.post(reverse('async_get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'friends': [{'id': self.user2.id, 'username': 'testuser2'}], 'next_cursor': None})
+
+
+    async def test_get_friend_requests_pagination(self):
+        response = await self.async_client.post(reverse('async_get_friend_requests'), {'limit': 1})
+        self.assertEqual(response.json()['outgoing_requests'], [{'id': self.user2.id, 'username': 'testuser2', 'status': 'accepted'}])
+        response = await self.async_client.post(reverse('async_get_friend_requests'), {'limit': 1, 'cursor': response.json()['next_cursor']})
+        self.assertEqual(response.json(), {
+            'incoming_requests': [{'id': self.user3.id, 'username': 'testuser3', 'status': 'pending'}],
+            'outgoing_requests': [],
+            'next_cursor': None,
+        })
+
+
+    async def test_view_friend_status(self):
+        response = await self.async_client.post(reverse('async_friendship_status'), {'friend_id': self.user3.id})
+        self.assertEqual(response.json(), {'friend': self.user3.id, 'status': 'pending'})
+        response = await self.async_client.post(reverse('async_friendship_status'), {'friend_id': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'error': 'Такого пользователя не существует'})
+
+
+    async def test_get_friend_counts(self):
+        response = await self.async_client.post(reverse('async_friend_counts'))
+        self.assertEqual(response.json(), {'friend_count': 1, 'incoming_pending_count': 1, 'outgoing_pending_count': 0})
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class PasswordHashingTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.login_url = reverse('login')
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+
+
+    def login(self):
+        return self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'}, format='json')
+
+
+    def test_hashing_runs_in_pool(self):
+        self.assertTrue(hashers.run(lambda: threading.current_thread().name).startswith('password-hash'))
+
+
+    def test_rehash_on_login_after_cost_change(self):
+        self.assertIn('$1000$', self.user.password)
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertIn('$2000$', self.user.password)
+
+
+    def test_rehash_on_login_to_preferred_hasher(self):
+        with self.settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher', 'api.hashers.PBKDF2PooledPasswordHasher']):
+            self.user.set_password('testpassword')
+            self.user.save()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha1$'))
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+
+    @override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0, PASSWORD_HASH_TIMEOUT=0)
+    def test_overloaded_pool(self):
+        _, slots = hashers._get_pool()
+        slots.acquire()
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.data, {'error': 'Сервер перегружен, повторите попытку позже'})
+            response = self.client.post(reverse('register'), {'username': 'newuser', 'password': 'testpassword'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertFalse(User.objects.filter(username='newuser').exists())
+        finally:
+            slots.release()
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+
+@override_settings(AUTH_TOKENS_ENABLED=True, FRIEND_CACHE_ENABLED=False)
+class TokenAuthenticationTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'username': 'testuser1', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+
+    def get_friends(self, access_token):
+        return self.client.post(reverse('get_friends'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+
+
+    def test_login_returns_tokens_without_session(self):
+        data = self.login()
+        self.assertEqual(data['success'], 'Авторизация прошла успешно')
+        self.assertEqual(data['expires_in'], 300)
+        self.assertFalse('_auth_user_id' in self.client.session)
+        response = self.client.post(reverse('register'), {'username': 'newuser', 'password': 'testpassword'}, format='json')
+        self.assertIn('access_token', response.data)
+
+
+    def test_token_request_without_user_and_session_queries(self):
+        access_token = self.login()['access_token']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_friends(access_token)
+        self.assertEqual(response.data['friends'], [{'id': self.user2.id, 'username': 'testuser2'}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('django_session', queries[0]['sql'])
+
+        session_client = Client()
+        session_client.force_login(self.user1)
+        with CaptureQueriesContext(connection) as session_queries:
+            session_client.post(reverse('get_friends'))
+        self.assertEqual(len(session_queries), 3)
+
+
+    def test_invalid_token(self):
+        response = self.get_friends('forged')
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+
+    def test_refresh_rotates_tokens(self):
+        refresh_token = self.login()['refresh_token']
+        response = self.client.post(reverse('refresh_token'), {'refresh_token': refresh_token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_friends(response.data['access_token']).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('refresh_token'), {'refresh_token': refresh_token})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data, {'error': 'Недействительный токен'})
+
+
+    def test_refresh_for_inactive_user(self):
+        refresh_token = self.login()['refresh_token']
+        User.objects.filter(id=self.user1.id).update(is_active=False)
+        response = self.client.post(reverse('refresh_token'), {'refresh_token': refresh_token})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    def test_revoke_token(self):
+        data = self.login()
+        response = self.client.post(
+            reverse('revoke_token'), {'refresh_token': data['refresh_token']}, HTTP_AUTHORIZATION=f'Bearer {data["access_token"]}'
+        )
+        self.assertEqual(response.data, {'success': 'Токены отозваны'})
+        self.assertEqual(self.get_friends(data['access_token']).status_code, status.HTTP_302_FOUND)
+        response = self.client.post(reverse('refresh_token'), {'refresh_token': data['refresh_token']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    def test_logout_revokes_access_token(self):
+        access_token = self.login()['access_token']
+        self.client.post(reverse('logout'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(self.get_friends(access_token).status_code, status.HTTP_302_FOUND)
+
+
+    def test_logout_revokes_refresh_token(self):
+        data = self.login()
+        self.client.post(reverse('logout'), {'refresh_token': data['refresh_token']}, HTTP_AUTHORIZATION=f'Bearer {data["access_token"]}')
+        response = self.client.post(reverse('refresh_token'), {'refresh_token': data['refresh_token']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    async def test_async_view_with_revoked_token_ignores_session(self):
+        await sync_to_async(self.async_client.force_login)(self.user1)
+        access_token = tokens.issue_pair(self.user1)['access_token']
+        await sync_to_async(tokens.revoke)(access_token, tokens.ACCESS)
+        response = await self.async_client.post(reverse('async_get_friends'), headers={'Authorization': f'Bearer {access_token}'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        response = await self.async_client.post(reverse('async_get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+    def test_async_view_with_token(self):
+        access_token = self.login()['access_token']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('async_get_friends'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(response.json()['friends'], [{'id': self.user2.id, 'username': 'testuser2'}])
+        self.assertEqual(len(queries), 1)
+
+
+class SessionBackendTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+    def test_cleanup_sessions_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'expired{number}', session_data='', expire_date=now - timedelta(days=1)) for number in range(5)]
+            + [Session(session_key=f'active{number}', session_data='', expire_date=now + timedelta(days=1)) for number in range(2)]
+        )
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('cleanup_sessions', batch_size=2, pause=0, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'deleted: 5')
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries], ['DELETE'] * 3)
+        self.assertEqual(sorted(Session.objects.values_list('session_key', flat=True)), ['active0', 'active1'])
+
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        self.login()
+        self.assertFalse(Session.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('django_session' in query['sql'] for query in queries.captured_queries))
+        out = StringIO()
+        call_command('cleanup_sessions', stdout=out)
+        self.assertIn('nothing to clean up', out.getvalue())
+
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_db_sessions(self):
+        self.login()
+        self.assertEqual(Session.objects.count(), 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('django_session' in query['sql'] for query in queries.captured_queries))
+
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_DIR='', METRICS_SLOW_REQUEST_MS=0)
+class RequestMetricsTestCase(TestCase):
+
+
+    def setUp(self):
+        metrics.reset()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+
+
+    def get_metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content.decode()
+
+
+    def test_request_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        query_count = len(queries)
+        text = self.get_metrics()
+        labels = 'endpoint="get_friends",method="POST",status="200"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', text)
+        self.assertIn(f'http_request_db_queries_sum{{{labels}}} {query_count}', text)
+        self.assertIn(f'http_response_size_bytes_sum{{{labels}}} {len(response.content)}', text)
+
+
+    def test_async_view_queries_counted(self):
+        self.client.post(reverse('async_friend_counts'))
+        text = self.get_metrics()
+        self.assertIn('http_request_db_queries_count{endpoint="async_friend_counts",method="POST",status="200"} 1', text)
+        self.assertNotIn('http_request_db_queries_sum{endpoint="async_friend_counts",method="POST",status="200"} 0', text)
+
+
+    def test_slow_request_logged_with_sql(self):
+        with override_settings(METRICS_SLOW_REQUEST_MS=0.001):
+            with self.assertLogs('api.metrics', 'WARNING') as logs:
+                self.client.post(reverse('get_friends'))
+        self.assertIn('POST /get_friends/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+    def test_metrics_of_several_processes(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(METRICS_DIR=metrics_dir):
+            self.client.post(reverse('get_friends'))
+            metrics.flush()
+            os.rename(os.path.join(metrics_dir, f'{os.getpid()}.json'), os.path.join(metrics_dir, '0.json'))
+            metrics.reset()
+            self.client.post(reverse('get_friends'))
+            text = self.get_metrics()
+        self.assertIn('http_request_duration_seconds_count{endpoint="get_friends",method="POST",status="200"} 2', text)
+
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.client.post(reverse('get_friends'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(metrics.render().count('_count'), 0)
+
+
+class FriendEventsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        self.client.force_login(self.user1)
+
+
+    def events(self, since=0, **params):
+        response = self.client.post(reverse('friend_events'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+
+    def test_incorrect_method(self):
+        response = self.client.get(reverse('friend_events'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_events_of_state_changes(self):
+        friendships.send_requests(self.user2, [self.user1.id])
+        friendships.accept_requests(self.user1, [self.user2.id])
+        friendships.send_requests(self.user1, [self.user3.id])
+        friendships.reject_requests(self.user3, [self.user1.id])
+        friendships.remove_friends(self.user2, [self.user1.id])
+        events = [(event['type'], event['user_id'], event['by_user']) for event in self.events()['events']]
+        self.assertEqual(events, [
+            ('sent', self.user2.id, False),
+            ('accepted', self.user2.id, True),
+            ('sent', self.user3.id, True),
+            ('rejected', self.user3.id, False),
+            ('removed', self.user2.id, False),
+        ])
+        self.assertEqual(FriendshipEvent.objects.filter(user=self.user3).count(), 2)
+
+
+    def test_failed_operations_write_no_events(self):
+        friendships.send_requests(self.user1, [self.user2.id])
+        friendships.send_requests(self.user1, [self.user2.id, self.user1.id, 0])
+        friendships.accept_requests(self.user1, [self.user3.id])
+        self.assertEqual(FriendshipEvent.objects.count(), 2)
+
+
+    def test_since_and_limit(self):
+        start = self.events(since='')
+        self.assertEqual(start, {'events': [], 'last_event_id': 0, 'has_more': False})
+        self.client.post(reverse('batch_operations'), {'action': 'send', 'user_ids': f'{self.user2.id},{self.user3.id}'})
+        first = self.events(limit=1)
+        self.assertEqual([event['user_id'] for event in first['events']], [self.user2.id])
+        self.assertTrue(first['has_more'])
+        second = self.events(first['last_event_id'])
+        self.assertEqual([event['user_id'] for event in second['events']], [self.user3.id])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(self.events(second['last_event_id']), {
+            'events': [], 'last_event_id': second['last_event_id'], 'has_more': False
+        })
+        self.assertEqual(self.events(since='')['last_event_id'], second['last_event_id'])
+
+
+    def test_invalid_params(self):
+        for params in ({'since': 'abc'}, {'since': -1}, {'since': 0, 'limit': 0}):
+            response = self.client.post(reverse('friend_events'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncFriendEventsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.async_client.force_login(self.user1)
+
+
+    async def test_long_poll(self):
+        await sync_to_async(friendships.send_requests)(self.user2, [self.user1.id])
+        response = await self.async_client.post(reverse('async_friend_events'), {'since': 0, 'wait': 5})
+        self.assertEqual([event['type'] for event in response.json()['events']], ['sent'])
+
+
+    @override_settings(FRIEND_EVENTS_POLL_INTERVAL=0.01)
+    async def test_long_poll_timeout(self):
+        response = await self.async_client.post(reverse('async_friend_events'), {'since': 0, 'wait': 0.05})
+        self.assertEqual(response.json(), {'events': [], 'last_event_id': 0, 'has_more': False})
+
+
+    @override_settings(FRIEND_EVENTS_POLL_INTERVAL=0.01)
+    async def test_event_stream(self):
+        await sync_to_async(friendships.send_requests)(self.user2, [self.user1.id])
+        response = await self.async_client.get(reverse('async_friend_events_stream'), headers={'Last-Event-ID': '0'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await stream.__anext__(), b'retry: 10\n\n')
+        message = (await stream.__anext__()).decode()
+        await stream.aclose()
+        self.assertTrue(message.startswith('id: '))
+        self.assertIn('event: sent\n', message)
+        self.assertIn(f'"user_id": {self.user2.id}', message)
+
+
+    async def test_event_stream_incorrect_method(self):
+        response = await self.async_client.post(reverse('async_friend_events_stream'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_event_stream_not_served_under_wsgi(self):
+        client = Client()
+        client.force_login(self.user1)
+        response = client.get(reverse('async_friend_events_stream'))
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+
+class ConditionalFriendListsTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        self.client.force_login(self.user1)
+
+
+    def test_get_returns_etag_and_cache_headers(self):
+        response = self.client.get(reverse('get_friends'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['friends'], [{'id': self.user2.id, 'username': 'testuser2'}])
+        self.assertEqual(response['ETag'], f'"{self.user1.id}-0-0-100-json"')
+        self.assertEqual(response['Cache-Control'], 'no-cache, must-revalidate')
+        self.assertIn('Cookie, Authorization', response['Vary'])
+
+
+    def test_matching_etag_returns_not_modified_without_friendship_queries(self):
+        for name in ('get_friends', 'get_friend_requests'):
+            etag = self.client.get(reverse(name))['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertFalse([query for query in queries.captured_queries if 'api_friendship' in query['sql']])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+
+
+    def test_weak_and_any_etag_return_not_modified(self):
+        etag = self.client.get(reverse('get_friends'))['ETag']
+        for if_none_match in (f'W/{etag}', '*', f'"other", {etag}'):
+            response = self.client.get(reverse('get_friends'), HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+    def test_etag_differs_by_page_and_format(self):
+        make_friendship(self.user1, self.user3, 'accepted').save()
+        first_page = self.client.get(reverse('get_friends'), {'limit': 1})
+        response = self.client.get(reverse('get_friends'), {'limit': 1, 'cursor': first_page.data['next_cursor']},
+                                   HTTP_IF_NONE_MATCH=first_page['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['friends'], [{'id': self.user3.id, 'username': 'testuser3'}])
+        etag = self.client.get(reverse('get_friends'))['ETag']
+        response = self.client.get(reverse('get_friends'), HTTP_ACCEPT=renderers.COMPACT_JSON, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Accept', response['Vary'])
+
+
+    def test_etag_changes_after_friendship_change(self):
+        friends_etag = self.client.get(reverse('get_friends'))['ETag']
+        requests_etag = self.client.get(reverse('get_friend_requests'))['ETag']
+        self.client.post(reverse('send_request'), {'to_user_id': self.user3.id})
+        response = self.client.get(reverse('get_friend_requests'), HTTP_IF_NONE_MATCH=requests_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn({'id': self.user3.id, 'username': 'testuser3', 'status': 'pending'}, response.data['outgoing_requests'])
+        self.assertNotEqual(response['ETag'], requests_etag)
+        self.assertEqual(self.client.get(reverse('get_friends'), HTTP_IF_NONE_MATCH=friends_etag).status_code, status.HTTP_200_OK)
+        self.user3.refresh_from_db()
+        self.assertEqual(self.user3.graph_version, 1)
+
+
+    def test_removing_rejected_request_changes_etag(self):
+        make_friendship(self.user3, self.user1, 'rejected').save()
+        etag = self.client.get(reverse('get_friend_requests'))['ETag']
+        self.client.post(reverse('remove_friend'), {'friend_id': self.user3.id})
+        response = self.client.get(reverse('get_friend_requests'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['incoming_requests'], [])
+
+
+    def test_get_pagination_from_query_string(self):
+        make_friendship(self.user1, self.user3, 'accepted').save()
+        response = self.client.get(reverse('get_friends'), {'limit': 1})
+        self.assertEqual(len(response.data['friends']), 1)
+        response = self.client.get(reverse('get_friends'), {'limit': 1, 'cursor': response.data['next_cursor']})
+        self.assertEqual(response.data['friends'], [{'id': self.user3.id, 'username': 'testuser3'}])
+        self.assertEqual(self.client.get(reverse('get_friends'), {'limit': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    @override_settings(AUTH_TOKENS_ENABLED=True)
+    def test_token_user_not_modified_with_single_query(self):
+        client = Client()
+        response = client.post(reverse('login'), {'username': 'testuser1', 'password': 'testpassword'})
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {response.data["access_token"]}'}
+        etag = client.get(reverse('get_friends'), **headers)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('get_friends'), HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)
+
+
+class FriendListRenderersTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='пользователь2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        make_friendship(self.user3, self.user1, 'pending').save()
+        self.client.force_login(self.user1)
+
+
+    def test_default_json(self):
+        response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json(), {'friends': [{'id': self.user2.id, 'username': 'пользователь2'}], 'next_cursor': None})
+
+
+    def test_compact_json(self):
+        response = self.client.post(reverse('get_friend_requests'), HTTP_ACCEPT=renderers.COMPACT_JSON)
+        self.assertEqual(response['Content-Type'], renderers.COMPACT_JSON)
+        self.assertEqual(response.json(), {
+            'incoming_requests': {'fields': ['id', 'username', 'status'], 'rows': [[self.user3.id, 'testuser3', 'pending']]},
+            'outgoing_requests': {'fields': ['id', 'username', 'status'], 'rows': [[self.user2.id, 'пользователь2', 'accepted']]},
+            'next_cursor': None,
+        })
+
+
+    def test_json_without_orjson(self):
+        content = self.client.post(reverse('get_friends')).content
+        with mock.patch.object(renderers, 'orjson', None):
+            response = self.client.post(reverse('get_friends'))
+        self.assertEqual(response.json(), json.loads(content))
+
+
+    @skipUnless(renderers.msgpack, 'msgpack не установлен')
+    def test_msgpack(self):
+        response = self.client.post(reverse('get_friends'), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), {
+            'friends': [{'id': self.user2.id, 'username': 'пользователь2'}], 'next_cursor': None
+        })
+
+
+    def test_unsupported_accept(self):
+        response = self.client.post(reverse('get_friends'), HTTP_ACCEPT='application/xml')
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+
+class ExportGraphTestCase(TestCase):
+
+
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='testuser1', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.user3 = User.objects.create_user(username='testuser3', password='testpassword')
+        make_friendship(self.user1, self.user2, 'accepted').save()
+        make_friendship(self.user3, self.user1, 'pending').save()
+        make_friendship(self.user2, self.user3, 'accepted').save()
+        self.client.force_login(self.user1)
+
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_friendships'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+
+    def test_user_export_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([{key: value for key, value in row.items() if key != 'id'} for row in rows], [
+            {'user_id': self.user2.id, 'username': 'testuser2', 'status': 'accepted', 'initiator_id': self.user1.id},
+            {'user_id': self.user3.id, 'username': 'testuser3', 'status': 'pending', 'initiator_id': self.user3.id},
+        ])
+
+
+    def test_user_export_csv(self):
+        response, content = self.export(type='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,user_id,username,status,initiator_id')
+        self.assertEqual([line.split(',')[2:4] for line in lines[1:]], [['testuser2', 'accepted'], ['testuser3', 'pending']])
+
+
+    def test_table_export_requires_staff(self):
+        response = self.client.get(reverse('export_friendships'), {'scope': 'all'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json(), {'error': 'Недостаточно прав'})
+        User.objects.filter(id=self.user1.id).update(is_staff=True)
+        response, content = self.export(scope='all', type='csv')
+        self.assertEqual(len(content.splitlines()), 4)
+
+
+    def test_incorrect_parameters_and_method(self):
+        response = self.client.get(reverse('export_friendships'), {'type': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'error': 'Неизвестный формат выгрузки'})
+        response = self.client.post(reverse('export_friendships'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_export_graph_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.ndjson')
+            call_command('export_graph', '--output', path, stderr=StringIO())
+            with open(path) as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(set(rows[0]), {'id', 'low_user_id', 'high_user_id', 'initiator_id', 'status'})
+
+
+    def anonymous_rss(self):
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+
+
+    @skipUnless(os.path.exists('/proc/self/status'), 'нужен /proc/self/status (Linux)')
+    def test_million_edges_export_with_flat_memory(self):
+        User.objects.bulk_create([User(username=f'export{number}') for number in range(1415)])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO api_friendship (low_user_id, high_user_id, initiator_id, status) "
+                "SELECT low.id, high.id, low.id, 'accepted' FROM api_user low JOIN api_user high ON low.id < high.id "
+                "WHERE low.username LIKE 'export%%' AND high.username LIKE 'export%%'"
+            )
+        total = Friendship.objects.count()
+        self.assertGreaterEqual(total, 1000000)
+        User.objects.filter(id=self.user1.id).update(is_staff=True)
+        response = self.client.get(reverse('export_friendships'), {'scope': 'all'})
+        lines = 0
+        started_rss = peak_rss = self.anonymous_rss()
+        for chunk in response.streaming_content:
+            lines += chunk.count(b'\n')
+            peak_rss = max(peak_rss, self.anonymous_rss())
+        self.assertEqual(lines, total)
+        self.assertLess(peak_rss - started_rss, 32 * 1024 * 1024)
+
+
+class ImportGraphTestCase(TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.existing = User.objects.create_user(username='existing', password='testpassword')
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+
+    def import_graph(self, *args):
+        output = StringIO()
+        call_command('import_graph', *args, stdout=output, stderr=StringIO())
+        return dict(line.split(': ', 1) for line in output.getvalue().splitlines())
+
+
+    def test_import_users_and_edges(self):
+        password = make_password('imported-password')
+        users = self.write('users.csv', f'username,password\nalice,{password}\nbob,\ncarol,\nexisting,\n')
+        edges = self.write('edges.ndjson', '\n'.join(json.dumps(edge) for edge in [
+            {'from_user': 'alice', 'to_user': 'bob'},
+            {'from_user': 'bob', 'to_user': 'alice', 'status': 'accepted'},
+            {'from_user': 'alice', 'to_user': 'carol', 'status': 'pending'},
+            {'from_user': 'carol', 'to_user': 'alice', 'status': 'pending'},
+            {'from_user': 'bob', 'to_user': 'carol', 'status': 'pending'},
+            {'from_user': 'bob', 'to_user': 'bob'},
+            {'from_user': 'bob', 'to_user': 'unknown'},
+            {'from_user': 'carol', 'to_user': 'existing', 'status': 'unknown'},
+        ]) + '\n')
+        stats = self.import_graph('--users', users, '--edges', edges, '--batch-size', '2')
+        self.assertEqual((stats['users_read'], stats['users_created'], stats['users_skipped']), ('4', '3', '1'))
+        self.assertEqual((stats['edges_read'], stats['edges_invalid'], stats['edges_created'], stats['edges_merged']), ('8', '3', '3', '2'))
+        alice, bob, carol = (User.objects.get(username=username) for username in ('alice', 'bob', 'carol'))
+        self.assertTrue(alice.check_password('imported-password'))
+        self.assertFalse(bob.has_usable_password())
+        self.assertEqual(Friendship.objects.between(alice.id, carol.id).get().status, 'accepted')
+        self.assertEqual(Friendship.objects.between(bob.id, carol.id).get().initiator_id, bob.id)
+        self.assertEqual((alice.friend_count, bob.friend_count, carol.outgoing_pending_count), (2, 1, 0))
+        self.assertEqual(carol.incoming_pending_count, 1)
+        self.assertEqual(alice.graph_version, 1)
+        constraints = connection.introspection.get_constraints(connection.cursor(), Friendship._meta.db_table)
+        self.assertIn('friendship_low_status_idx', constraints)
+        self.assertIn('friendship_high_status_idx', constraints)
+
+
+    def test_import_with_ids(self):
+        users = self.write('users.ndjson', '{"id": 500, "username": "dave"}\n{"id": 501, "username": "erin"}\n')
+        edges = self.write('edges.csv', f'from_user,to_user,status\n501,500,pending\n{self.existing.id},500,\n')
+        stats = self.import_graph('--users', users, '--edges', edges, '--match', 'id')
+        self.assertEqual(stats['edges_created'], '2')
+        self.assertEqual(Friendship.objects.between(500, 501).get().initiator_id, 501)
+        self.assertEqual(User.objects.get(id=500).friend_count, 1)
+        self.assertGreater(User.objects.create_user(username='next', password='testpassword').id, 501)
+
+
+    def test_plain_password_rejected(self):
+        users = self.write('users.csv', 'username,password\nalice,plain-password\n')
+        with self.assertRaisesMessage(CommandError, 'Строка 1: пароль должен быть готовым хешем Django'):
+            self.import_graph('--users', users)
+        self.assertFalse(User.objects.filter(username='alice').exists())
+
+
+    def test_indexes_restored_after_interrupted_import(self):
+        edges = self.write('edges.csv', 'from_user,to_user\nexisting,unknown\n')
+        with mock.patch('api.management.commands.import_graph.Command.create_indexes', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.import_graph('--edges', edges)
+        constraints = connection.introspection.get_constraints(connection.cursor(), Friendship._meta.db_table)
+        self.assertNotIn('friendship_low_status_idx', constraints)
+        errors = StringIO()
+        call_command('import_graph', '--edges', edges, '--keep-indexes', stdout=StringIO(), stderr=errors)
+        self.assertIn('friendship_low_status_idx', errors.getvalue())
+        constraints = connection.introspection.get_constraints(connection.cursor(), Friendship._meta.db_table)
+        self.assertIn('friendship_low_status_idx', constraints)
+        self.assertIn('friendship_high_status_idx', constraints)
+
+
+    def test_invalid_user_rows_rejected(self):
+        for content, message in (
+            ('username,id\nalice,x\n', 'Строка 1: id пользователя должен быть целым числом'),
+            ('name\nalice\n', 'Строка 1: не задано имя пользователя'),
+        ):
+            with self.assertRaisesMessage(CommandError, message):
+                self.import_graph('--users', self.write('users.csv', content))
+        with self.assertRaisesMessage(CommandError, 'Строка 2: ожидается объект JSON'):
+            self.import_graph('--users', self.write('users.ndjson', '{"username": "alice"}\n[1]\n'))
+
+
+    @override_settings(FRIEND_CACHE_ENABLED=True, FRIEND_GRAPH_INDEX=True, FRIEND_GRAPH_INDEX_CHECK_INTERVAL=0)
+    def test_import_invalidates_cache_and_graph_index(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.assertEqual(friend_cache.friends(self.existing.id), [])
+        index = graph_index.get()
+        self.import_graph('--edges', self.write('edges.csv', 'from_user,to_user\nexisting,other\n'))
+        self.assertEqual([row[1:] for row in friend_cache.friends(self.existing.id)], [(other.id, 'other')])
+        # Другой процесс замечает новое поколение индекса в общем кэше
+        self.assertTrue(index.expired())
+        self.assertEqual(graph_index.get().status(self.existing.id, other.id), 'accepted')
@@ -0,0 +1,119 @@
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from rest_framework.authentication import BaseAuthentication
+
+from .models import User
+
+
+# Авторизация подписанными токенами (AUTH_TOKENS_ENABLED=1) без чтения сессии и пользователя из базы:
+# токен подписан SECRET_KEY и содержит id, имя и признак персонала пользователя, поэтому request.user
+# собирается из самого токена. Короткоживущий access-токен передается в заголовке Authorization: Bearer,
+# долгоживущий refresh-токен обменивается на новую пару (старый при этом отзывается).
+# Отозванные токены хранятся в кэше до истечения их срока действия; при нескольких процессах
+# кэш должен быть общим (FRIEND_CACHE_URL)
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+SALTS = {
+    ACCESS: 'api.tokens.access',
+    REFRESH: 'api.tokens.refresh',
+}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def enabled():
+    return settings.AUTH_TOKENS_ENABLED
+
+
+def _lifetime(kind):
+    return settings.AUTH_ACCESS_TOKEN_LIFETIME if kind == ACCESS else settings.AUTH_REFRESH_TOKEN_LIFETIME
+
+
+def _cache():
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+
+def _revoked_key(token_id):
+    return f'revoked_token:{token_id}'
+
+
+def _issue(user, kind):
+    return signing.dumps(
+        {'u': user.id, 'n': user.username, 's': user.is_staff, 'j': uuid.uuid4().hex},
+        salt=SALTS[kind], compress=True
+    )
+
+
+# Пара токенов для ответа login_user, register_user и refresh_token
+def issue_pair(user):
+    return {
+        'access_token': _issue(user, ACCESS),
+        'refresh_token': _issue(user, REFRESH),
+        'expires_in': settings.AUTH_ACCESS_TOKEN_LIFETIME,
+    }
+
+
+# Содержимое действующего токена; поддельный, просроченный или отозванный токен - InvalidToken
+def decode(token, kind):
+    try:
+        claims = signing.loads(token, salt=SALTS[kind], max_age=_lifetime(kind))
+    except signing.BadSignature:
+        raise InvalidToken
+    if _cache().get(_revoked_key(claims['j'])):
+        raise InvalidToken
+    return claims
+
+
+def user_from_claims(claims):
+    user = User(id=claims['u'], username=claims['n'], is_staff=claims['s'], is_active=True)
+    user._state.adding = False
+    return user
+
+
+# Отзыв до истечения срока: токен с неверной подписью или уже просроченный отзывать не нужно
+def revoke(token, kind):
+    try:
+        claims = signing.loads(token, salt=SALTS[kind], max_age=_lifetime(kind))
+    except signing.BadSignature:
+        return False
+    _cache().set(_revoked_key(claims['j']), True, _lifetime(kind))
+    return True
+
+
+# Обмен refresh-токена на новую пару: здесь пользователь читается из базы, чтобы не выдавать
+# токены удаленному или заблокированному пользователю. Токен отзывается через cache.add,
+# поэтому из двух одновременных обменов одного токена успешен только один
+def refresh(token):
+    claims = decode(token, REFRESH)
+    user = User.objects.filter(id=claims['u'], is_active=True).only('id', 'username', 'is_staff').first()
+    if user is None or not _cache().add(_revoked_key(claims['j']), True, _lifetime(REFRESH)):
+        raise InvalidToken
+    return issue_pair(user)
+
+
+def bearer_token(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    return None
+
+
+# Пользователь, которого api.middleware.TokenAuthenticationMiddleware собрал из токена, для представлений DRF:
+# без этого SessionAuthentication требовала бы CSRF-токен
+class SignedTokenAuthentication(BaseAuthentication):
+
+    def authenticate(self, request):
+        token = getattr(request._request, 'auth_token', None)
+        if token is None:
+            return None
+        return request._request.user, token
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -1,15 +1,33 @@
 from django.urls import path
 from . import views
+from . import async_views
+from . import export
 
 urlpatterns = [
     path('login_user/', views.MyView.login_user, name='login'),
     path('register_user/', views.MyView.register_user, name='register'),
     path('logout_user/', views.MyView.logout_user, name='logout'),
+    path('refresh_token/', views.MyView.refresh_token, name='refresh_token'),
+    path('revoke_token/', views.MyView.revoke_token, name='revoke_token'),
     path('send_friend_request/', views.MyView.send_friend_request, name='send_request'),
     path('accept_friend_request/', views.MyView.accept_friend_request, name='accept_request'),
     path('reject_friend_request/', views.MyView.reject_friend_request, name='reject_request'),
     path('get_friends/', views.MyView.get_friends, name='get_friends'),
     path('get_friend_requests/', views.MyView.get_friend_requests, name='get_friend_requests'),
     path('view_friend_status/', views.MyView.view_friend_status, name='friendship_status'),
+    path('view_friend_statuses/', views.MyView.view_friend_statuses, name='friendship_statuses'),
+    path('counts/', views.MyView.get_friend_counts, name='friend_counts'),
+    path('get_friend_events/', views.MyView.get_friend_events, name='friend_events'),
+    path('get_mutual_friends/', views.MyView.get_mutual_friends, name='mutual_friends'),
+    path('get_friend_suggestions/', views.MyView.get_friend_suggestions, name='friend_suggestions'),
     path('remove_friend/', views.MyView.remove_friend, name='remove_friend'),
+    path('batch_friend_operations/', views.MyView.batch_friend_operations, name='batch_operations'),
+    path('cache_stats/', views.MyView.get_cache_stats, name='cache_stats'),
+    path('export_friendships/', export.export_view, name='export_friendships'),
+    path('async/get_friends/', async_views.get_friends, name='async_get_friends'),
+    path('async/get_friend_requests/', async_views.get_friend_requests, name='async_get_friend_requests'),
+    path('async/view_friend_status/', async_views.view_friend_status, name='async_friendship_status'),
+    path('async/counts/', async_views.get_friend_counts, name='async_friend_counts'),
+    path('async/get_friend_events/', async_views.get_friend_events, name='async_friend_events'),
+    path('async/friend_events_stream/', async_views.friend_events_stream, name='async_friend_events_stream'),
 ]
\ No newline at end of file
@@ -1,17 +1,213 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout
-from django.db.models import Q
+from django.contrib.auth.signals import user_logged_in
 from django.shortcuts import get_object_or_404
 from django.db import IntegrityError, transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import viewsets
 from drf_yasg import openapi
 
 from .models import User, Friendship
+from . import cache as friend_cache
+from . import counters
+from . import events as friend_events
+from . import friendships
+from . import graph_index
+from . import hashers
+from . import renderers
+from . import routers
+from . import suggestions
+from . import tokens
+
+
+# Разбор параметров курсорной пагинации: cursor - id последней полученной записи Friendship.
+# В GET-запросах параметры передаются в строке запроса
+def _page_params(request):
+    params = request.GET if request.method == 'GET' else request.POST
+    try:
+        cursor = int(params.get('cursor') or 0)
+        limit = int(params.get('limit') or settings.FRIENDS_PAGE_SIZE)
+    except ValueError:
+        return None
+    if cursor < 0 or limit <= 0:
+        return None
+    return cursor, min(limit, settings.FRIENDS_MAX_PAGE_SIZE)
+
+
+# Разбор параметров ленты событий: since - id последнего полученного события (None - только узнать id последнего),
+# limit - наибольшее число событий в ответе
+def _events_params(request):
+    try:
+        since = request.POST.get('since')
+        since = None if since in (None, '') else int(since)
+        limit = int(request.POST.get('limit') or settings.FRIEND_EVENTS_PAGE_SIZE)
+    except ValueError:
+        return None
+    if (since is not None and since < 0) or limit <= 0:
+        return None
+    return since, min(limit, settings.FRIEND_EVENTS_MAX_PAGE_SIZE)
+
+
+# Ответ ленты событий по странице строк api.events.since, выбранной с запасом в одну строку
+def _events_response(rows, since, limit):
+    has_more = len(rows) > limit
+    events = friend_events.serialize(rows[:limit])
+    return {
+        'events': events,
+        'last_event_id': events[-1]['id'] if events else since,
+        'has_more': has_more,
+    }
+
+
+# ETag страницы списка: graph_version пользователя, курсор и размер страницы, формат ответа (renderer,
+# выбранный по Accept), чтобы ETag одной страницы или одного формата не подошел к другой. У пользователя
+# из access-токена в request.user только поля из токена, поэтому версия читается одним запросом к таблице пользователей
+def _graph_etag(request, page_params):
+    user = request.user
+    if getattr(request, 'auth_token', None):
+        version = User.objects.filter(id=user.id).values_list('graph_version', flat=True).first() or 0
+    else:
+        version = user.graph_version
+    cursor, limit = page_params
+    return f'"{user.id}-{version}-{cursor}-{limit}-{request.accepted_renderer.format}"'
+
+
+# Условный GET списка: If-None-Match сравнивается с текущим ETag по правилам HTTP (слабые W/"..." и *
+# тоже совпадают), и при совпадении ответ 304 отдается без обращения к таблице дружбы. Иначе список
+# строится функцией build с основной базы в обход кэша и индекса графа: они могут отставать от
+# graph_version в других процессах, а ответ с новым ETag и старым списком закрепился бы у клиента
+def _conditional_list(request, page_params, build):
+    etag = _graph_etag(request, page_params)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        with routers.primary():
+            response = build()
+    response['ETag'] = etag
+    response['Cache-Control'] = settings.FRIEND_LIST_CACHE_CONTROL
+    patch_vary_headers(response, ('Cookie', 'Authorization'))
+    return response
+
+
+FRIEND_FIELDS = ('id', 'username')
+
+REQUEST_FIELDS = ('id', 'username', 'status')
+
+
+# Списки ответа - api.renderers.Rows поверх строк без id записи Friendship: словари для каждой строки
+# создаются только при выводе в обычном JSON
+def _friends_data(rows, next_cursor):
+    return {
+        'friends': renderers.Rows(FRIEND_FIELDS, [row[1:] for row in rows]),
+        'next_cursor': next_cursor,
+    }
+
+
+# Входящие и исходящие заявки выбираются одним списком и делятся по направлению
+def _requests_data(user, rows, next_cursor):
+    incoming_list = []
+    outgoing_list = []
+    for row in rows:
+        requests_list = outgoing_list if row[4] == user.id else incoming_list
+        requests_list.append(row[1:4])
+    return {
+        'incoming_requests': renderers.Rows(REQUEST_FIELDS, incoming_list),
+        'outgoing_requests': renderers.Rows(REQUEST_FIELDS, outgoing_list),
+        'next_cursor': next_cursor
+    }
+
+
+# Пул хеширования паролей переполнен: вход и регистрация временно недоступны, остальные запросы обслуживаются
+HASHING_OVERLOADED_RESPONSE = ({'error': 'Сервер перегружен, повторите попытку позже'}, 503)
+
+USER_NOT_FOUND_RESPONSE = ({'error':'Такого пользователя не существует'}, 400)
+
+NO_REQUEST_RESPONSE = ({'error':'У вас нет активных заявок от этого пользователя'}, 401)
+
+# Ответы одиночных операций по кодам результата из api.friendships
+SEND_REQUEST_RESPONSES = {
+    friendships.SUCCESS: ({'success': 'Запрос дружбы успешно отправлен'}, 200),
+    friendships.USER_NOT_FOUND: USER_NOT_FOUND_RESPONSE,
+    friendships.ALREADY_EXISTS: ({'error':'У вас уже есть активная заявка с этим пользователем'}, 401),
+    friendships.SELF_REQUEST: ({'error':'Вы не можете отправить заявку самому себе'}, 402),
+}
+
+ACCEPT_REQUEST_RESPONSES = {
+    friendships.SUCCESS: ({'success':'Заявка успешно принята'}, 200),
+    friendships.USER_NOT_FOUND: USER_NOT_FOUND_RESPONSE,
+    friendships.NO_REQUEST: NO_REQUEST_RESPONSE,
+    friendships.SELF_REQUEST: NO_REQUEST_RESPONSE,
+}
+
+REJECT_REQUEST_RESPONSES = {
+    friendships.SUCCESS: ({'success':'Заявка успешно отклонена'}, 200),
+    friendships.USER_NOT_FOUND: USER_NOT_FOUND_RESPONSE,
+    friendships.NO_REQUEST: NO_REQUEST_RESPONSE,
+    friendships.SELF_REQUEST: NO_REQUEST_RESPONSE,
+}
+
+REMOVE_FRIEND_RESPONSES = {
+    friendships.SUCCESS: ({'success': 'Пользователь успешно удален из друзей'}, 200),
+    friendships.USER_NOT_FOUND: USER_NOT_FOUND_RESPONSE,
+    friendships.NO_REQUEST: ({'error': 'У вас нет заявок с этим пользователем'}, 401),
+    friendships.SELF_REQUEST: ({'error': 'У вас нет заявок с этим пользователем'}, 401),
+}
+
+
+# Вход после авторизации или регистрации: в режиме токенов сессия не создается, а в ответ добавляется пара токенов
+def _login(request, user):
+    if not tokens.enabled():
+        login(request, user)
+        return {}
+    user_logged_in.send(sender=user.__class__, request=request, user=user)
+    return tokens.issue_pair(user)
+
+
+# id пользователя из параметра запроса; некорректное значение превращается в несуществующий id 0
+def _user_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+# Разбор списка id пользователей: повторяющийся параметр или значения через запятую
+def _id_list(request, name):
+    values = []
+    for value in request.POST.getlist(name):
+        values.extend(part for part in value.split(',') if part.strip())
+    try:
+        return list(dict.fromkeys(int(value) for value in values))
+    except ValueError:
+        return None
+
+
+# Выборка страницы по ключу id без OFFSET: берем на одну запись больше, чтобы узнать о следующей странице
+def _keyset_page(queryset, cursor, limit):
+    return _split_page(list(queryset.filter(id__gt=cursor).order_by('id')[:limit + 1]), limit)
+
+
+# То же для закэшированного списка, отсортированного по id: начало страницы ищется бинарным поиском
+def _list_page(rows, cursor, limit):
+    low, high = 0, len(rows)
+    while low < high:
+        middle = (low + high) // 2
+        if rows[middle][0] <= cursor:
+            low = middle + 1
+        else:
+            high = middle
+    return _split_page(rows[low:low + limit + 1], limit)
+
+
+def _split_page(rows, limit):
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][0]
+    return rows, None
 
 
 class MyView(viewsets.ViewSet):
@@ -22,7 +218,7 @@ class MyView(viewsets.ViewSet):
         method='post',
         tags=['Функция входа'],
         operation_id = 'Функция для авторизации пользователя',
-        operation_description = 'Эта функция используется для авторизации пользователя и принимает на вход два значения: логин и пароль',
+        operation_description = 'Эта функция используется для авторизации пользователя и принимает на вход два значения: логин и пароль. В режиме авторизации токенами (AUTH_TOKENS_ENABLED) сессия не создается, а в ответ добавляются access_token, refresh_token и expires_in',
         request_body=openapi.Schema(
             type=openapi.TYPE_OBJECT,
             required=['username', 'password'],
@@ -56,6 +252,14 @@ class MyView(viewsets.ViewSet):
                     }
                 }
             ),
+            503: openapi.Response(
+                description='Пул хеширования паролей перегружен',
+                examples={
+                    'application/json': {
+                        'error': 'Сервер перегружен, повторите попытку позже'
+                    }
+                }
+            ),
         }
     )
     @api_view(['POST'])
@@ -63,10 +267,12 @@ class MyView(viewsets.ViewSet):
         if request.method == 'POST':
             username = request.POST.get('username')
             password = request.POST.get('password')
-            user = authenticate(username=username, password=password)
+            try:
+                user = authenticate(username=username, password=password)
+            except hashers.HashingOverloaded:
+                return Response(*HASHING_OVERLOADED_RESPONSE)
             if user is not None:
-                login(request, user)
-                return Response(data={'success': 'Авторизация прошла успешно'}, status=200)
+                return Response(data={'success': 'Авторизация прошла успешно', **_login(request, user)}, status=200)
             else:
                 return Response(data={'error': 'Неверный логин или пароль'}, status=400)
         else:
@@ -78,7 +284,7 @@ class MyView(viewsets.ViewSet):
         method='post',
         tags=['Функция регистрации'],
         operation_id = 'Функция для регистрации пользователя',
-        operation_description = 'Эта функция используется для регистрации пользователя и принимает на вход два значения: логин и пароль',
+        operation_description = 'Эта функция используется для регистрации пользователя и принимает на вход два значения: логин и пароль. В режиме авторизации токенами (AUTH_TOKENS_ENABLED) сессия не создается, а в ответ добавляются access_token, refresh_token и expires_in',
         request_body=openapi.Schema(
             type=openapi.TYPE_OBJECT,
             required=['username', 'password'],
@@ -112,6 +318,14 @@ class MyView(viewsets.ViewSet):
                     }
                 }
             ),
+            503: openapi.Response(
+                description='Пул хеширования паролей перегружен',
+                examples={
+                    'application/json': {
+                        'error': 'Сервер перегружен, повторите попытку позже'
+                    }
+                }
+            ),
         }
     )
     @api_view(['POST'])
@@ -124,9 +338,10 @@ class MyView(viewsets.ViewSet):
                 user = User.objects.create_user(username=username, password=password)
             except IntegrityError:
                 return Response(data={'error':'Такой пользователь уже существует'}, status = 400)
+            except hashers.HashingOverloaded:
+                return Response(*HASHING_OVERLOADED_RESPONSE)
             else:
-                login(request, user)
-                return Response(data={'success': 'Пользователь зарегестрирован успешно'}, status=200)
+                return Response(data={'success': 'Пользователь зарегестрирован успешно', **_login(request, user)}, status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
@@ -136,7 +351,13 @@ class MyView(viewsets.ViewSet):
         method='post',
         tags=['Функция выхода'],
         operation_id = 'Функция для выхода из системы',
-        operation_description = 'Эта функция используется для выхода из системы и не принимает входных параметров',
+        operation_description = 'Эта функция используется для выхода из системы. В режиме авторизации токенами отзывает access-токен запроса и переданный refresh_token',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'refresh_token': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
         responses={
             200: openapi.Response(
                 description='Успешный выход',
@@ -159,10 +380,135 @@ class MyView(viewsets.ViewSet):
     @api_view(['POST'])
     def logout_user(request):
         if request.method == 'POST':
+            # Отзывается и refresh-токен: иначе по нему после выхода можно было бы получить новую пару токенов
+            if tokens.enabled() and request.POST.get('refresh_token'):
+                tokens.revoke(request.POST['refresh_token'], tokens.REFRESH)
+            if getattr(request, 'auth_token', None):
+                tokens.revoke(request.auth_token, tokens.ACCESS)
             logout(request)
             return Response(data={'success': 'Выход выполнен успешно'}, status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Обмен refresh-токена на новую пару токенов
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция обновления токена'],
+        operation_id = 'Функция для обновления токенов авторизации',
+        operation_description = 'Эта функция обменивает refresh-токен на новые access- и refresh-токены, старый refresh-токен при этом отзывается. Работает в режиме авторизации токенами (AUTH_TOKENS_ENABLED)',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['refresh_token'],
+            properties={
+                'refresh_token': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Токены обновлены',
+                examples={
+                    'application/json': {
+                        'access_token': 'token',
+                        'refresh_token': 'token',
+                        'expires_in': 'seconds'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Авторизация токенами отключена',
+                examples={
+                    'application/json': {
+                        'error': 'Авторизация токенами отключена'
+                    }
+                }
+            ),
+            401: openapi.Response(
+                description='Недействительный токен',
+                examples={
+                    'application/json': {
+                        'error': 'Недействительный токен'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def refresh_token(request):
+        if request.method == 'POST':
+            if not tokens.enabled():
+                return Response(data={'error': 'Авторизация токенами отключена'}, status=400)
+            try:
+                token_pair = tokens.refresh(request.POST.get('refresh_token') or '')
+            except tokens.InvalidToken:
+                return Response(data={'error': 'Недействительный токен'}, status=401)
+            return Response(data=token_pair, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Отзыв токенов до истечения срока действия
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция отзыва токена'],
+        operation_id = 'Функция для отзыва токенов авторизации',
+        operation_description = 'Эта функция отзывает refresh-токен из параметра refresh_token и access-токен из заголовка Authorization, если они переданы. Работает в режиме авторизации токенами (AUTH_TOKENS_ENABLED)',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'refresh_token': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Токены отозваны',
+                examples={
+                    'application/json': {
+                        'success': 'Токены отозваны'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Нет действительных токенов',
+                examples={
+                    'application/json': {
+                        'error': 'Недействительный токен'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def revoke_token(request):
+        if request.method == 'POST':
+            if not tokens.enabled():
+                return Response(data={'error': 'Авторизация токенами отключена'}, status=400)
+            revoked = False
+            if request.POST.get('refresh_token'):
+                revoked = tokens.revoke(request.POST['refresh_token'], tokens.REFRESH)
+            if getattr(request, 'auth_token', None):
+                revoked = tokens.revoke(request.auth_token, tokens.ACCESS) or revoked
+            if not revoked:
+                return Response(data={'error': 'Недействительный токен'}, status=400)
+            return Response(data={'success': 'Токены отозваны'}, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
         
     # Отправка заявки в друзья
     @login_required
@@ -225,34 +571,9 @@ class MyView(viewsets.ViewSet):
     @api_view(['POST'])
     def send_friend_request(request):
         if request.method == 'POST':
-            to_user_id = request.POST.get('to_user_id')
-            user1 = request.user
-            try:
-                user2 = get_object_or_404(User, id=to_user_id)
-            except Exception:
-                return Response(data={'error':'Такого пользователя не существует'}, status=400)
-            else:
-                if user1.id != user2.id:
-                    try:
-                        friendship = Friendship(from_user=user1, to_user=user2, status='pending')
-                        friendship.save()
-                    except Exception:
-                        return Response(data={'error':'У вас уже есть активная заявка с этим пользователем'}, status=401)
-                    else:
-                        try:
-                            friendship2 = get_object_or_404(Friendship, from_user=user2, to_user=user1)
-                        except Exception:
-                            return Response(data={'success': 'Запрос дружбы успешно отправлен'}, status=200)
-                        else:
-                            friendship1 = get_object_or_404(Friendship, from_user=user1, to_user=user2)
-                            if friendship2.status == 'accepted' or friendship2.status == 'pending':
-                                friendship1.status = 'accepted'
-                                friendship2.status = 'accepted'
-                                friendship1.save()
-                                friendship2.save()
-                            return Response(data={'success': 'Запрос дружбы успешно отправлен'}, status=200)
-                else:
-                    return Response(data={'error':'Вы не можете отправить заявку самому себе'}, status=402)
+            to_user_id = _user_id(request.POST.get('to_user_id'))
+            result = friendships.send_requests(request.user, [to_user_id])[to_user_id]
+            return Response(*SEND_REQUEST_RESPONSES[result])
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
@@ -309,21 +630,9 @@ class MyView(viewsets.ViewSet):
     @api_view(['POST'])
     def accept_friend_request(request):
         if request.method == 'POST':
-            friend_id = request.POST.get('friend_id')
-            user1 = request.user
-            try:
-                user2 = get_object_or_404(User, id=friend_id)
-            except Exception:
-                return Response(data={'error':'Такого пользователя не существует'}, status=400)
-            else:
-                try:
-                    friendship = get_object_or_404(Friendship, to_user=user1, from_user=user2)
-                except Exception:
-                    return Response(data={'error':'У вас нет активных заявок от этого пользователя'}, status=401)
-                else:
-                    friendship.status = 'accepted'
-                    friendship.save()
-                    return Response(data={'success':'Заявка успешно принята'}, status=200)
+            friend_id = _user_id(request.POST.get('friend_id'))
+            result = friendships.accept_requests(request.user, [friend_id])[friend_id]
+            return Response(*ACCEPT_REQUEST_RESPONSES[result])
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
@@ -380,38 +689,133 @@ class MyView(viewsets.ViewSet):
     @api_view(['POST'])
     def reject_friend_request(request):
         if request.method == 'POST':
-            friend_id = request.POST.get('friend_id')
-            user1 = request.user
-            try:
-                user2 = get_object_or_404(User, id=friend_id)
-            except Exception:
-                return Response(data={'error':'Такого пользователя не существует'}, status=400)
-            else:
-                try:
-                    friendship = get_object_or_404(Friendship, to_user=user1, from_user=user2)
-                except Exception:
-                    return Response(data={'error':'У вас нет активных заявок от этого пользователя'}, status=401)
-                else:
-                    friendship.status = 'rejected'
-                    friendship.save()
-                    return Response(data={'success':'Заявка успешно отклонена'}, status=200)
+            friend_id = _user_id(request.POST.get('friend_id'))
+            result = friendships.reject_requests(request.user, [friend_id])[friend_id]
+            return Response(*REJECT_REQUEST_RESPONSES[result])
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Пакетная отправка, принятие, отклонение заявок и удаление друзей
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция пакетных операций'],
+        operation_id = 'Функция для пакетной обработки заявок в друзья',
+        operation_description = 'Эта функция применяет одно действие (action: send, accept, reject или remove) к списку пользователей (user_ids - id через запятую или повторяющийся параметр) в одной транзакции, требует авторизации. Для каждого пользователя возвращается код результата: success, user_not_found, self_request, already_exists или no_request',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['action', 'user_ids'],
+            properties={
+                'action': openapi.Schema(type=openapi.TYPE_STRING),
+                'user_ids': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Операции выполнены',
+                examples={
+                    'application/json': {
+                        'results': '[{"id": "id", "result": "result"}]'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректный список пользователей'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def batch_friend_operations(request):
+        if request.method == 'POST':
+            operation = friendships.OPERATIONS.get(request.POST.get('action'))
+            if operation is None:
+                return Response(data={'error': 'Неизвестное действие'}, status=400)
+            user_ids = _id_list(request, 'user_ids')
+            if not user_ids or len(user_ids) > settings.FRIEND_BATCH_LIMIT:
+                return Response(data={'error': 'Некорректный список пользователей'}, status=400)
+            results = operation(request.user, user_ids)
+            return Response(data={
+                'results': [{'id': user_id, 'result': results[user_id]} for user_id in user_ids]
+            }, status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
     # Получения списка друзей
     @login_required
     @csrf_exempt
+    @swagger_auto_schema(
+        method='get',
+        tags=['Функция просмотра списка друзей'],
+        operation_id = 'Функция для условного получения списка друзей пользователя',
+        operation_description = 'Эта функция возвращает список друзей пользователя для кэшируемых GET-запросов, требует авторизации. Ответ содержит ETag по версии связей пользователя: при совпадении с If-None-Match возвращается 304 без чтения списка. Параметры cursor и limit передаются в строке запроса',
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        ],
+        responses={
+            200: openapi.Response(
+                description='Список друзей получен',
+                examples={
+                    'application/json': {
+                        'friends': '[friend_list]',
+                        'next_cursor': 'cursor'
+                    }
+                }
+            ),
+            304: openapi.Response(
+                description='Список не изменился с версии из If-None-Match'
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры пагинации',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректные параметры пагинации'
+                    }
+                }
+            ),
+        }
+    )
     @swagger_auto_schema(
         method='post',
         tags=['Функция просмотра списка друзей'],
         operation_id = 'Функция для просмотра списка друзей пользователя',
-        operation_description = 'Эта функция используется для списка друзей пользователя, требует авторизации',
+        operation_description = 'Эта функция используется для списка друзей пользователя, требует авторизации. Список отдается постранично: limit - размер страницы, cursor - значение next_cursor из предыдущего ответа',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'cursor': openapi.Schema(type=openapi.TYPE_STRING),
+                'limit': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
         responses={
             200: openapi.Response(
                 description='Список друзей получен',
                 examples={
                     'application/json': {
-                        'friends': '[friend_list]'
+                        'friends': '[friend_list]',
+                        'next_cursor': 'cursor'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры пагинации',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректные параметры пагинации'
                     }
                 }
             ),
@@ -425,42 +829,93 @@ class MyView(viewsets.ViewSet):
             ),
         }
     )
-    @api_view(['POST'])
+    @api_view(['GET', 'POST'])
+    @renderer_classes(renderers.FRIEND_LIST_RENDERERS)
     def get_friends(request):
-        if request.method == 'POST':
+        if request.method in ('GET', 'POST'):
+            page_params = _page_params(request)
+            if page_params is None:
+                return Response(data={'error': 'Некорректные параметры пагинации'}, status=400)
             user = request.user
-            friends = Friendship.objects.filter(
-                (Q(from_user=user) | Q(to_user=user)) & Q(status='accepted')
-            )
-            friend_list = []
-            for friend in friends:
-                if friend.from_user == user:
-                    friend_id = friend.to_user.id
-                else:
-                    friend_id = friend.from_user.id
-                friend_list.append({
-                    'id': friend_id,
-                    'username': friend.to_user.username if friend.from_user == user else friend.from_user.username
-                })
-            return Response({'friends': friend_list}, status=200)
+            if request.method == 'GET':
+                return _conditional_list(request, page_params, lambda: Response(
+                    _friends_data(*_keyset_page(Friendship.objects.friends_of(user), *page_params)), status=200
+                ))
+            if graph_index.enabled():
+                rows, next_cursor = _list_page(graph_index.get().friends(user.id), *page_params)
+            elif friend_cache.enabled():
+                rows, next_cursor = _list_page(friend_cache.friends(user.id), *page_params)
+            else:
+                # Один запрос: id и имя собеседника вычисляются прямо в SQL, без загрузки моделей User
+                rows, next_cursor = _keyset_page(Friendship.objects.friends_of(user), *page_params)
+            return Response(_friends_data(rows, next_cursor), status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
     # Получение списка входящих и исходящих заявок
     @login_required
     @csrf_exempt
+    @swagger_auto_schema(
+        method='get',
+        tags=['Функция просмотра списка заявок'],
+        operation_id = 'Функция для условного получения списка заявок в друзья',
+        operation_description = 'Эта функция возвращает входящие и исходящие заявки пользователя для кэшируемых GET-запросов, требует авторизации. Ответ содержит ETag по версии связей пользователя: при совпадении с If-None-Match возвращается 304 без чтения списка. Параметры cursor и limit передаются в строке запроса',
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        ],
+        responses={
+            200: openapi.Response(
+                description='Список заявок получен',
+                examples={
+                    'application/json': {
+                        'incoming_requests': '[incoming_list]',
+                        'outgoing_requests': '[outgoing_list]',
+                        'next_cursor': 'cursor'
+                    }
+                }
+            ),
+            304: openapi.Response(
+                description='Список не изменился с версии из If-None-Match'
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры пагинации',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректные параметры пагинации'
+                    }
+                }
+            ),
+        }
+    )
     @swagger_auto_schema(
         method='post',
         tags=['Функция просмотра списка заявок'],
         operation_id = 'Функция для просмотра списка исходящих и входящих заявок в друзья',
-        operation_description = 'Эта функция используется для списка заявок в друзья пользователя, требует авторизации',
+        operation_description = 'Эта функция используется для списка заявок в друзья пользователя, требует авторизации. Список отдается постранично: limit - размер страницы, cursor - значение next_cursor из предыдущего ответа',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'cursor': openapi.Schema(type=openapi.TYPE_STRING),
+                'limit': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
         responses={
             200: openapi.Response(
                 description='Список заявок получен',
                 examples={
                     'application/json': {
                         'incoming_requests': '[incoming_list]',
-                        'outgoing_requests': '[outgoing_list]'
+                        'outgoing_requests': '[outgoing_list]',
+                        'next_cursor': 'cursor'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры пагинации',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректные параметры пагинации'
                     }
                 }
             ),
@@ -474,30 +929,125 @@ class MyView(viewsets.ViewSet):
             ),
         }
     )
-    @api_view(['POST'])
+    @api_view(['GET', 'POST'])
+    @renderer_classes(renderers.FRIEND_LIST_RENDERERS)
     def get_friend_requests(request):
-        if request.method == 'POST':
+        if request.method in ('GET', 'POST'):
+            page_params = _page_params(request)
+            if page_params is None:
+                return Response(data={'error': 'Некорректные параметры пагинации'}, status=400)
             user = request.user
-            incoming_requests = Friendship.objects.filter(to_user=user)
-            incoming_list = []
-            for request in incoming_requests:
-                incoming_list.append({
-                    'id': request.from_user.id,
-                    'username': request.from_user.username,
-                    'status' : request.status
-                })
-            outgoing_requests = Friendship.objects.filter(from_user=user)
-            outgoing_list = []
-            for request in outgoing_requests:
-                outgoing_list.append({
-                    'id': request.to_user.id,
-                    'username': request.to_user.username,
-                    'status' : request.status
-                })
-            return Response(data={
-                'incoming_requests': incoming_list,
-                'outgoing_requests': outgoing_list
-            }, status=200)
+            if request.method == 'GET':
+                return _conditional_list(request, page_params, lambda: Response(
+                    data=_requests_data(user, *_keyset_page(Friendship.objects.requests_of(user), *page_params)), status=200
+                ))
+            if graph_index.enabled():
+                rows, next_cursor = _list_page(graph_index.get().requests(user.id), *page_params)
+            elif friend_cache.enabled():
+                rows, next_cursor = _list_page(friend_cache.requests(user.id), *page_params)
+            else:
+                rows, next_cursor = _keyset_page(Friendship.objects.requests_of(user), *page_params)
+            return Response(data=_requests_data(user, rows, next_cursor), status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Получение числа друзей, входящих и исходящих заявок
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция просмотра счетчиков'],
+        operation_id = 'Функция для просмотра числа друзей и заявок пользователя',
+        operation_description = 'Эта функция возвращает число друзей, входящих и исходящих ожидающих заявок пользователя без загрузки списков, требует авторизации',
+        responses={
+            200: openapi.Response(
+                description='Счетчики получены',
+                examples={
+                    'application/json': {
+                        'friend_count': 'count',
+                        'incoming_pending_count': 'count',
+                        'outgoing_pending_count': 'count'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def get_friend_counts(request):
+        if request.method == 'POST':
+            # Одно чтение строки пользователя по первичному ключу, без подсчета связей
+            counts = User.objects.filter(id=request.user.id).values(*counters.FIELDS).get()
+            return Response(data=counts, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Получение изменений дружбы после события since вместо повторного чтения списков
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция просмотра ленты событий'],
+        operation_id = 'Функция для получения событий дружбы после заданного',
+        operation_description = 'Эта функция возвращает события дружбы пользователя (sent, accepted, rejected, removed) с id больше since, требует авторизации. Без since возвращается только last_event_id - с него стоит начинать синхронизацию перед загрузкой полных списков. by_user - событие вызвано самим пользователем',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'since': openapi.Schema(type=openapi.TYPE_STRING),
+                'limit': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='События получены',
+                examples={
+                    'application/json': {
+                        'events': '[events]',
+                        'last_event_id': 'event_id',
+                        'has_more': 'has_more'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректные параметры',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректные параметры ленты событий'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def get_friend_events(request):
+        if request.method == 'POST':
+            params = _events_params(request)
+            if params is None:
+                return Response(data={'error': 'Некорректные параметры ленты событий'}, status=400)
+            since, limit = params
+            if since is None:
+                return Response(data={
+                    'events': [],
+                    'last_event_id': friend_events.last_event_id(request.user.id),
+                    'has_more': False
+                }, status=200)
+            rows = list(friend_events.since(request.user.id, since)[:limit + 1])
+            return Response(data=_events_response(rows, since, limit), status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
@@ -556,17 +1106,225 @@ class MyView(viewsets.ViewSet):
     def view_friend_status(request):
         if request.method == 'POST':
             friend_id = request.POST.get('friend_id')
+            # Связь нашлась в индексе или кэше графа - значит, пользователь существует и проверять его в базе не нужно
+            graph = graph_index.get() if graph_index.enabled() else friend_cache
+            if (graph_index.enabled() or friend_cache.enabled()) and str(friend_id).isdigit():
+                friendship_status = graph.status(request.user.id, int(friend_id))
+                if friendship_status:
+                    return Response(data={'friend': int(friend_id), 'status': friendship_status}, status=200)
             try:
                 user1 = request.user
                 user2 = get_object_or_404(User, id=friend_id)
             except Exception:
                 return Response(data={'error':'Такого пользователя не существует'}, status=400)
             else:
-                friendship = Friendship.objects.filter((Q(from_user=user1) & Q(to_user=user2)) | (Q(from_user=user2) & Q(to_user=user1))).first()
-                if not friendship:
+                if graph_index.enabled():
+                    friendship_status = None
+                elif friend_cache.enabled():
+                    friendship_status = friend_cache.status(user1.id, user2.id)
+                else:
+                    # Поиск по уникальному ключу пары (low_user, high_user)
+                    friendship_status = Friendship.objects.between(user1.id, user2.id).values_list('status', flat=True).first()
+                if not friendship_status:
                     return Response(data={'error':'У вас нет заявок с этим пользователем'}, status=401)
                 else:
-                    return Response(data={'friend': user2.id, 'status': friendship.status}, status=200)
+                    return Response(data={'friend': user2.id, 'status': friendship_status}, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+
+    # Получение статусов дружбы сразу с несколькими юзерами
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция просмотра статусов дружбы'],
+        operation_id = 'Функция для просмотра статусов дружбы с несколькими пользователями',
+        operation_description = 'Эта функция используется для статусов дружбы сразу с несколькими пользователями (friend_ids - id через запятую или повторяющийся параметр), требует авторизации. Для пользователей без заявок статус равен null',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['friend_ids'],
+            properties={
+                'friend_ids': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Статусы дружбы',
+                examples={
+                    'application/json': {
+                        'statuses': '[{"friend": "id", "status": "status"}]'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректный список пользователей',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректный список пользователей'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def view_friend_statuses(request):
+        if request.method == 'POST':
+            friend_ids = _id_list(request, 'friend_ids')
+            if not friend_ids or len(friend_ids) > settings.FRIEND_STATUS_BATCH_LIMIT:
+                return Response(data={'error': 'Некорректный список пользователей'}, status=400)
+            user = request.user
+            if graph_index.enabled():
+                graph = graph_index.get()
+                statuses = {friend_id: graph.status(user.id, friend_id) for friend_id in friend_ids}
+            else:
+                cached_rows = friend_cache.cached_requests(user.id) if friend_cache.enabled() else None
+                if cached_rows is not None:
+                    statuses = {other_id: friendship_status for _, other_id, _, friendship_status, _ in cached_rows}
+                else:
+                    # Один запрос IN по связям в обе стороны
+                    statuses = {
+                        high_user_id if low_user_id == user.id else low_user_id: friendship_status
+                        for low_user_id, high_user_id, friendship_status in Friendship.objects.between_many(
+                            user.id, friend_ids
+                        ).values_list('low_user_id', 'high_user_id', 'status')
+                    }
+            return Response(data={
+                'statuses': [{'friend': friend_id, 'status': statuses.get(friend_id)} for friend_id in friend_ids]
+            }, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+
+    # Получение списка общих друзей с юзером
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция просмотра общих друзей'],
+        operation_id = 'Функция для просмотра общих друзей с пользователем',
+        operation_description = 'Эта функция используется для списка общих друзей с пользователем, требует авторизации. Возвращается общее число общих друзей и не более FRIENDS_MAX_PAGE_SIZE из них',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['friend_id'],
+            properties={
+                'friend_id': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Список общих друзей получен',
+                examples={
+                    'application/json': {
+                        'friend': 'id',
+                        'count': 'count',
+                        'mutual_friends': '[friend_list]'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Пользователь не существует',
+                examples={
+                    'application/json': {
+                        'error':'Такого пользователя не существует'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def get_mutual_friends(request):
+        if request.method == 'POST':
+            friend_id = _user_id(request.POST.get('friend_id'))
+            if not User.objects.filter(id=friend_id).exists():
+                return Response(data={'error':'Такого пользователя не существует'}, status=400)
+            mutual_list = suggestions.mutual_friends(request.user.id, friend_id)
+            return Response(data={
+                'friend': friend_id,
+                'count': len(mutual_list),
+                'mutual_friends': [
+                    {'id': mutual_id, 'username': username}
+                    for mutual_id, username in mutual_list[:settings.FRIENDS_MAX_PAGE_SIZE]
+                ]
+            }, status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
+
+    # Получение списка возможных друзей
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция рекомендаций друзей'],
+        operation_id = 'Функция для получения списка пользователей, которых вы можете знать',
+        operation_description = 'Эта функция возвращает пользователей, с которыми у вас больше всего общих друзей и нет заявок, требует авторизации. limit - число рекомендаций, не больше FRIEND_SUGGESTIONS_MAX_LIMIT',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'limit': openapi.Schema(type=openapi.TYPE_STRING),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description='Рекомендации получены',
+                examples={
+                    'application/json': {
+                        'suggestions': '[{"id": "id", "username": "username", "mutual_friends": "count"}]'
+                    }
+                }
+            ),
+            400: openapi.Response(
+                description='Некорректный размер списка',
+                examples={
+                    'application/json': {
+                        'error': 'Некорректный размер списка'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def get_friend_suggestions(request):
+        if request.method == 'POST':
+            try:
+                limit = int(request.POST.get('limit') or settings.FRIEND_SUGGESTIONS_LIMIT)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                return Response(data={'error': 'Некорректный размер списка'}, status=400)
+            suggestion_list = suggestions.suggest_friends(
+                request.user.id, min(limit, settings.FRIEND_SUGGESTIONS_MAX_LIMIT)
+            )
+            return Response(data={
+                'suggestions': [
+                    {'id': candidate_id, 'username': username, 'mutual_friends': common}
+                    for candidate_id, username, common in suggestion_list
+                ]
+            }, status=200)
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
@@ -624,29 +1382,54 @@ class MyView(viewsets.ViewSet):
     @api_view(['POST'])
     def remove_friend(request):
         if request.method == 'POST':
-            friend_id = request.POST.get('friend_id')
-            user1 = request.user
-            try:
-                user2 = get_object_or_404(User, id=friend_id)
-            except Exception:
-                return Response(data={'error':'Такого пользователя не существует'}, status=400)
-            else:
-                friendship1 = Friendship.objects.filter(Q(from_user=user1) & Q(to_user=user2))
-                friendship2 = Friendship.objects.filter(Q(from_user=user2) & Q(to_user=user1))
-
-            if friendship1 and friendship2:
-                friendship1.delete()
-                friendship2.delete()
-                return Response({'success': 'Пользователь успешно удален из друзей'}, status=200)
-            elif friendship1:
-                friendship1.delete()
-                return Response({'success': 'Пользователь успешно удален из друзей'}, status=200)
-            elif friendship2:
-                friendship2.delete()
-                return Response({'success': 'Пользователь успешно удален из друзей'}, status=200)
-            else:
-                return Response(data={'error': 'У вас нет заявок с этим пользователем'}, status=401)
+            friend_id = _user_id(request.POST.get('friend_id'))
+            result = friendships.remove_friends(request.user, [friend_id])[friend_id]
+            return Response(*REMOVE_FRIEND_RESPONSES[result])
         else:
             return Response(data={'error': 'Неверный метод запроса'}, status=405)
 
-
+    # Счетчики попаданий и промахов кэша графа дружбы для мониторинга
+    @login_required
+    @csrf_exempt
+    @swagger_auto_schema(
+        method='post',
+        tags=['Функция мониторинга кэша'],
+        operation_id = 'Функция для просмотра статистики кэша графа дружбы',
+        operation_description = 'Эта функция возвращает число попаданий и промахов кэша списков друзей и заявок в текущем процессе, доступна только персоналу',
+        responses={
+            200: openapi.Response(
+                description='Статистика кэша',
+                examples={
+                    'application/json': {
+                        'hits': 'hits',
+                        'misses': 'misses',
+                        'hit_ratio': 'hit_ratio'
+                    }
+                }
+            ),
+            403: openapi.Response(
+                description='Недостаточно прав',
+                examples={
+                    'application/json': {
+                        'error': 'Недостаточно прав'
+                    }
+                }
+            ),
+            405: openapi.Response(
+                description='Метод не разрешен',
+                examples={
+                    'application/json': {
+                        'error': 'Неверный метод запроса'
+                    }
+                }
+            ),
+        }
+    )
+    @api_view(['POST'])
+    def get_cache_stats(request):
+        if request.method == 'POST':
+            if not request.user.is_staff:
+                return Response(data={'error': 'Недостаточно прав'}, status=403)
+            return Response(data=friend_cache.stats(), status=200)
+        else:
+            return Response(data={'error': 'Неверный метод запроса'}, status=405)
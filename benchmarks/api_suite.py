@@ -0,0 +1,385 @@
+# Нагрузочный прогон всего API смесью запросов: граф со степенным распределением числа друзей
+# (--degree-exponent, хабы --hubs/--hub-share), clients вошедших пользователей и анонимные входы/регистрации.
+# Каждый запрос выбирается по весам из --mix (url name=вес), параметры берутся из состояния клиента:
+# принимаются и отклоняются настоящие входящие заявки, удаляются настоящие друзья.
+#
+# Режим client (по умолчанию) - тестовый клиент Django в одном процессе, число запросов к базе считается
+# на каждый запрос. Режим server - gunicorn с gunicorn.conf.py и keep-alive клиентами на asyncio,
+# число запросов к базе берется из /metrics сервера (api.metrics). Настройки сервиса (FRIEND_CACHE_ENABLED,
+# FRIEND_GRAPH_INDEX, SESSION_BACKEND и т.д.) задаются переменными окружения.
+# Результат - JSON с пропускной способностью, p50/p95/p99, кодами ответов и запросами к базе по каждому
+# представлению; --output сохраняет его в файл, --baseline добавляет сравнение с сохраненным прогоном.
+#
+#   python benchmarks/api_suite.py --users 20000 --edges 200000 --degree-exponent 1 --requests 5000 --output run.json
+#   python benchmarks/api_suite.py --mode server --concurrency 32 --duration 30 --baseline run.json
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import (
+    BASE_DIR, setup_django, create_database, destroy_database, seed_graph, summary,
+    create_sessions, free_port, wait_for_port, Connection,
+)
+
+DEFAULT_MIX = (
+    'get_friends=25,get_friend_requests=10,friendship_status=15,friendship_statuses=5,friend_counts=10,'
+    'mutual_friends=5,friend_suggestions=4,send_request=10,accept_request=5,reject_request=2,remove_friend=3,'
+    'login=1,register=1'
+)
+
+PASSWORD = 'benchmark-password'
+
+# Запросы без сессии: вход меняет ключ сессии, поэтому идет с отдельного анонимного клиента
+ANONYMOUS = {'login', 'register'}
+
+
+def _friend_or_random(workload, client):
+    if client['friends'] and workload.rng.random() < 0.5:
+        return workload.rng.choice(client['friends'])
+    return workload.random_user()
+
+
+def _incoming_request(workload, client):
+    return client['incoming'].pop() if client['incoming'] else workload.random_user()
+
+
+def _accept(workload, client):
+    friend_id = _incoming_request(workload, client)
+    client['friends'].append(friend_id)
+    return {'friend_id': friend_id}
+
+
+def _remove(workload, client):
+    if not client['friends']:
+        return {'friend_id': workload.random_user()}
+    friends = client['friends']
+    position = workload.rng.randrange(len(friends))
+    friends[position], friends[-1] = friends[-1], friends[position]
+    return {'friend_id': friends.pop()}
+
+
+def _register(workload, client):
+    workload.registered += 1
+    return {'username': f'bench{os.getpid()}_{workload.registered}', 'password': PASSWORD}
+
+
+# Параметры запроса для url name по состоянию клиента
+REQUESTS = {
+    'get_friends': lambda workload, client: {},
+    'get_friend_requests': lambda workload, client: {},
+    'friendship_status': lambda workload, client: {'friend_id': _friend_or_random(workload, client)},
+    'friendship_statuses': lambda workload, client: {
+        'friend_ids': [_friend_or_random(workload, client) for _ in range(20)],
+    },
+    'friend_counts': lambda workload, client: {},
+    'mutual_friends': lambda workload, client: {'friend_id': _friend_or_random(workload, client)},
+    'friend_suggestions': lambda workload, client: {},
+    'send_request': lambda workload, client: {'to_user_id': workload.random_user()},
+    'accept_request': _accept,
+    'reject_request': lambda workload, client: {'friend_id': _incoming_request(workload, client)},
+    'remove_friend': _remove,
+    'login': lambda workload, client: {'username': f'user{workload.rng.choice(workload.login_users)}', 'password': PASSWORD},
+    'register': _register,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in REQUESTS:
+            raise SystemExit(f'unknown endpoint {name!r}, expected one of: {", ".join(REQUESTS)}')
+        mix[name] = float(weight)
+    return mix
+
+
+class Workload:
+
+    def __init__(self, users, clients, login_users, mix, seed=0):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.clients = clients
+        self.login_users = login_users
+        self.names = list(mix)
+        self.cum_weights = []
+        total = 0
+        for weight in mix.values():
+            total += weight
+            self.cum_weights.append(total)
+        self.registered = 0
+
+    def random_user(self):
+        return self.rng.randint(1, self.users)
+
+    def next(self, client):
+        name = self.rng.choices(self.names, cum_weights=self.cum_weights)[0]
+        return name, REQUESTS[name](self, client)
+
+
+class Results:
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.queries = defaultdict(list)
+
+    def add(self, name, elapsed, status, queries=None):
+        self.statuses[name][str(status)] += 1
+        if elapsed is not None:
+            self.timings[name].append(elapsed)
+        if queries is not None:
+            self.queries[name].append(queries)
+
+    def report(self, elapsed, server_queries=None):
+        endpoints = {}
+        for name in sorted(self.statuses):
+            timings = self.timings[name]
+            queries = self.queries[name]
+            result = {
+                'requests_per_second': round(len(timings) / elapsed, 1),
+                'statuses': dict(sorted(self.statuses[name].items())),
+                **summary(timings or [0]),
+            }
+            if server_queries is not None:
+                result['queries_per_request'] = server_queries.get(name)
+            elif queries:
+                result['queries_per_request'] = round(sum(queries) / len(queries), 2)
+                result['max_queries'] = max(queries)
+            endpoints[name] = result
+        all_timings = [timing for timings in self.timings.values() for timing in timings]
+        return {
+            'requests_per_second': round(len(all_timings) / elapsed, 1),
+            'errors': sum(
+                count for statuses in self.statuses.values() for code, count in statuses.items()
+                if not code.isdigit() or code.startswith('5')
+            ),
+            **summary(all_timings or [0]),
+            'endpoints': endpoints,
+        }
+
+
+def load_clients(session_keys):
+    from django.contrib.sessions.models import Session
+    from django.db.models import Q
+    from api.models import Friendship
+
+    clients = []
+    for session in Session.objects.filter(session_key__in=session_keys):
+        user_id = int(session.get_decoded()['_auth_user_id'])
+        edges = Friendship.objects.filter(Q(low_user_id=user_id) | Q(high_user_id=user_id)).exclude(status='rejected')
+        friends, incoming = [], []
+        for low_user_id, high_user_id, initiator_id, friendship_status in edges.values_list(
+            'low_user_id', 'high_user_id', 'initiator_id', 'status'
+        ):
+            other_id = high_user_id if low_user_id == user_id else low_user_id
+            if friendship_status == 'accepted':
+                friends.append(other_id)
+            elif initiator_id != user_id:
+                incoming.append(other_id)
+        clients.append({'session_key': session.session_key, 'user_id': user_id, 'friends': friends, 'incoming': incoming})
+    return clients
+
+
+def create_login_users(count, excluded, users):
+    from api.models import User
+
+    rng = random.Random(1)
+    candidates = [user_id for user_id in rng.sample(range(1, users + 1), min(users, count + len(excluded))) if user_id not in excluded]
+    login_users = candidates[:count]
+    for user in User.objects.filter(id__in=login_users):
+        user.set_password(PASSWORD)
+        user.save(update_fields=['password'])
+    return login_users
+
+
+def run_client_mode(workload, paths, args):
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    for client in workload.clients:
+        client['client'] = Client()
+        client['client'].cookies[settings.SESSION_COOKIE_NAME] = client['session_key']
+    anonymous = Client()
+    results = Results()
+    started = time.perf_counter()
+    for number in range(args.requests):
+        client = workload.clients[number % len(workload.clients)]
+        name, data = workload.next(client)
+        http_client = anonymous if name in ANONYMOUS else client['client']
+        with CaptureQueriesContext(connection) as queries:
+            request_started = time.perf_counter()
+            response = http_client.post(paths[name], data)
+            request_time = time.perf_counter() - request_started
+        results.add(name, request_time, response.status_code, len(queries))
+    return results.report(time.perf_counter() - started)
+
+
+async def mixed_client(port, workload, client, paths, deadline, results):
+    connection = Connection(port, paths['get_friends'], client['session_key'])
+    anonymous = Connection(port, paths['login'], None)
+    while time.perf_counter() < deadline:
+        name, data = workload.next(client)
+        http_connection = anonymous if name in ANONYMOUS else connection
+        started = time.perf_counter()
+        try:
+            status = await http_connection.post(paths[name], urlencode(data, doseq=True).encode())
+        except (OSError, asyncio.IncompleteReadError):
+            http_connection.close()
+            results.add(name, None, 'connection error')
+            continue
+        results.add(name, time.perf_counter() - started, status)
+    connection.close()
+    anonymous.close()
+
+
+async def run_mixed_load(port, workload, paths, args):
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(
+        mixed_client(port, workload, workload.clients[number % len(workload.clients)], paths, deadline, results)
+        for number in range(args.concurrency)
+    ))
+    return results
+
+
+# Средние числа запросов к базе по представлениям из гистограммы http_request_db_queries сервера
+def server_queries(port):
+    text = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics').read().decode()
+    sums, counts = defaultdict(float), defaultdict(int)
+    for kind, endpoint, value in re.findall(r'^http_request_db_queries_(sum|count)\{endpoint="([^"]+)"[^}]*\} (\S+)$', text, re.M):
+        if kind == 'sum':
+            sums[endpoint] += float(value)
+        else:
+            counts[endpoint] += int(value)
+    return {endpoint: round(sums[endpoint] / count, 2) for endpoint, count in counts.items() if count}
+
+
+def run_server_mode(workload, paths, database_path, args):
+    port = free_port()
+    metrics_dir = tempfile.mkdtemp(prefix='friend_bench_metrics_')
+    env = dict(
+        os.environ, DB_NAME=database_path, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='',
+        GUNICORN_LOG_LEVEL='warning', DJANGO_DEBUG='0', DJANGO_ALLOWED_HOSTS='127.0.0.1',
+        METRICS_ENABLED='1', METRICS_DIR=metrics_dir,
+    )
+    if args.workers:
+        env['GUNICORN_WORKERS'] = str(args.workers)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=BASE_DIR, env=env)
+    try:
+        wait_for_port(port)
+        started = time.perf_counter()
+        results = asyncio.run(run_mixed_load(port, workload, paths, args))
+        elapsed = time.perf_counter() - started
+        # метрики процессов сохраняются раз в METRICS_FLUSH_INTERVAL секунд
+        time.sleep(1.5)
+        queries = server_queries(port)
+    finally:
+        server.terminate()
+        server.wait()
+    return results.report(elapsed, queries)
+
+
+def compare(report, baseline):
+    changes = {}
+    for name, result in report['endpoints'].items():
+        old = baseline['results']['endpoints'].get(name)
+        if not old:
+            continue
+        changes[name] = {
+            'requests_per_second': round(result['requests_per_second'] / (old['requests_per_second'] or 1), 2),
+            'p50_ms': round(result['p50_ms'] / (old['p50_ms'] or 1), 2),
+            'p99_ms': round(result['p99_ms'] / (old['p99_ms'] or 1), 2),
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['client', 'server'], default='client')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--degree-exponent', type=float, default=1.0, help='0 - равномерное распределение степеней')
+    parser.add_argument('--hubs', type=int, default=0)
+    parser.add_argument('--hub-share', type=float, default=0.0)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--login-users', type=int, default=20)
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--requests', type=int, default=5000, help='число запросов в режиме client')
+    parser.add_argument('--concurrency', type=int, default=32, help='число соединений в режиме server')
+    parser.add_argument('--duration', type=float, default=30, help='длительность в секундах в режиме server')
+    parser.add_argument('--workers', type=int, default=0, help='процессы gunicorn, 0 - из gunicorn.conf.py')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    setup_django()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+
+    setup_test_environment()
+    # ответы 4xx (заявка уже существует, нет входящей заявки) - обычная часть смеси
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    old_name = create_database()
+    try:
+        seed_started = time.perf_counter()
+        seed_graph(
+            args.users, args.edges, hubs=args.hubs, hub_share=args.hub_share,
+            degree_exponent=args.degree_exponent, seed=args.seed
+        )
+        session_keys = create_sessions(min(args.clients, args.users), args.users)
+        clients = load_clients(session_keys)
+        login_users = create_login_users(args.login_users, {client['user_id'] for client in clients}, args.users)
+        seed_time = time.perf_counter() - seed_started
+        degrees = sorted((len(client['friends']) for client in clients), reverse=True)
+        workload = Workload(args.users, clients, login_users, mix, seed=args.seed)
+        paths = {name: reverse(name) for name in REQUESTS}
+        if args.mode == 'client':
+            report = run_client_mode(workload, paths, args)
+        else:
+            database_path = str(connection.settings_dict['NAME'])
+            connection.close()
+            report = run_server_mode(workload, paths, database_path, args)
+    finally:
+        destroy_database(old_name)
+
+    output = {
+        'mode': args.mode,
+        'users': args.users,
+        'edges': args.edges,
+        'degree_exponent': args.degree_exponent,
+        'client_friends': {'max': degrees[0] if degrees else 0, 'median': degrees[len(degrees) // 2] if degrees else 0},
+        'seed_seconds': round(seed_time, 1),
+        'mix': mix,
+        'results': report,
+    }
+    if args.baseline:
+        with open(args.baseline) as file:
+            output['change_vs_baseline'] = compare(report, json.load(file))
+    text = json.dumps(output, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Списки друзей под нагрузкой: синхронное представление под WSGI (gunicorn, gthread) против
+# асинхронного из api.async_views под ASGI (uvicorn). Кроме активных клиентов, которые шлют запросы
+# подряд по keep-alive соединениям, открывается idle соединений, которые после первого запроса только висят:
+# под WSGI каждое такое соединение держит поток, под ASGI - только сокет.
+# Кэш графа отключается, чтобы оба варианта читали из базы.
+# Нужны пакеты gunicorn и uvicorn.
+#
+#   python benchmarks/asgi_wsgi.py --users 20000 --edges 200000 --concurrency 200 --idle 500 --duration 15
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import (
+    BASE_DIR, setup_django, create_database, destroy_database, seed_graph, summary,
+    create_sessions, free_port, wait_for_port, run_load,
+)
+
+SERVERS = {
+    'wsgi': ('/get_friends/', lambda args, port: [
+        sys.executable, '-m', 'gunicorn', 'friend_service.wsgi:application', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers), '--worker-class', 'gthread', '--threads', str(args.threads),
+        '--keep-alive', '60', '--log-level', 'warning',
+    ]),
+    'asgi': ('/async/get_friends/', lambda args, port: [
+        sys.executable, '-m', 'uvicorn', 'friend_service.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(args.workers), '--timeout-keep-alive', '60', '--log-level', 'warning', '--no-access-log',
+    ]),
+}
+
+
+def run_server(name, database_path, session_keys, args):
+    path, command = SERVERS[name]
+    port = free_port()
+    env = dict(os.environ, DB_NAME=database_path, FRIEND_CACHE_ENABLED='0', FRIEND_GRAPH_INDEX='0')
+    server = subprocess.Popen(command(args, port), cwd=BASE_DIR, env=env)
+    try:
+        wait_for_port(port)
+        started = time.perf_counter()
+        timings, errors = asyncio.run(run_load(port, path, session_keys, args))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'server': name,
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'errors': len(errors),
+        **summary(timings or [0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--idle', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--servers', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    old_name = create_database()
+    try:
+        seed_graph(args.users, args.edges)
+        session_keys = create_sessions(min(args.sessions, args.users), args.users)
+        database_path = str(connection.settings_dict['NAME'])
+        connection.close()
+        results = [run_server(name, database_path, session_keys, args) for name in args.servers.split(',')]
+    finally:
+        destroy_database(old_name)
+    print(json.dumps({
+        'users': args.users, 'edges': args.edges, 'concurrency': args.concurrency, 'idle': args.idle,
+        'workers': args.workers, 'threads': args.threads, 'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+import itertools
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+# Инициализация Django для запуска бенчмарков как отдельных скриптов
+def setup_django():
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'friend_service.settings')
+    import django
+    django.setup()
+
+
+# Отдельная файловая база для замеров, рабочий db.sqlite3 не затрагивается
+def create_database(path=None):
+    from django.db import connection
+
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='friend_bench_'), 'bench.sqlite3')
+    connection.settings_dict['TEST']['NAME'] = path
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    return old_name
+
+
+def destroy_database(old_name):
+    from django.db import connection
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+# Синтетический граф: users пользователей и edges связей без дублей пар.
+# hub_share - доля связей, у которых один из концов выбирается среди hubs самых популярных пользователей.
+# При degree_exponent > 0 один из концов остальных связей выбирается по закону Ципфа: пользователь с id k
+# выбирается с весом 1 / k ** degree_exponent, так что степени вершин распределены по степенному закону.
+# Счетчики друзей и заявок пользователей пересчитываются после вставки
+def seed_graph(users, edges, hubs=0, hub_share=0.0, statuses=(('accepted', 0.8), ('pending', 0.15), ('rejected', 0.05)), seed=0, batch_size=50000, degree_exponent=0.0):
+    from django.db import connection, transaction
+    from api.counters import recount
+    from api.models import User, Friendship
+
+    rng = random.Random(seed)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    user_table = connection.ops.quote_name(User._meta.db_table)
+    friendship_table = connection.ops.quote_name(Friendship._meta.db_table)
+    status_values = [status for status, _ in statuses]
+    status_weights = [weight for _, weight in statuses]
+    user_ids = range(1, users + 1)
+    degree_weights = None
+    if degree_exponent:
+        degree_weights = list(itertools.accumulate(1 / user_id ** degree_exponent for user_id in user_ids))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {user_table} (id, password, is_superuser, username, date_joined, is_active, is_staff, '
+                f'friend_count, incoming_pending_count, outgoing_pending_count, graph_version) '
+                f'VALUES (%s, %s, %s, %s, %s, %s, %s, 0, 0, 0, 0)',
+                [(user_id, '!', False, f'user{user_id}', now, True, False) for user_id in range(1, users + 1)]
+            )
+
+            seen = set()
+            batch = []
+            while len(seen) < edges:
+                if hubs and rng.random() < hub_share:
+                    from_user = rng.randint(1, hubs)
+                elif degree_weights is not None:
+                    from_user = rng.choices(user_ids, cum_weights=degree_weights)[0]
+                else:
+                    from_user = rng.randint(1, users)
+                to_user = rng.randint(1, users)
+                pair = Friendship.pair(from_user, to_user)
+                if from_user == to_user or pair in seen:
+                    continue
+                seen.add(pair)
+                initiator = pair[0] if rng.random() < 0.5 else pair[1]
+                batch.append((*pair, initiator, rng.choices(status_values, status_weights)[0]))
+                if len(batch) >= batch_size:
+                    _insert_friendships(cursor, friendship_table, batch)
+                    batch = []
+            if batch:
+                _insert_friendships(cursor, friendship_table, batch)
+        recount(User, Friendship)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def _insert_friendships(cursor, table, rows):
+    cursor.executemany(
+        f'INSERT INTO {table} (low_user_id, high_user_id, initiator_id, status) VALUES (%s, %s, %s, %s)',
+        rows
+    )
+
+
+def explain(queryset):
+    from django.db import connection
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def measure(func, iterations):
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summary(timings):
+    return {
+        'count': len(timings),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+    }
+
+
+# DRF проверяет CSRF для сессионной авторизации: cookie и заголовок с одинаковым токеном
+CSRF_TOKEN = 'b' * 32
+
+# Сессии вошедших пользователей создаются напрямую в базе, чтобы не замерять вход
+def create_sessions(count, users):
+    from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+    from django.contrib.sessions.backends.db import SessionStore
+    from api.models import User
+
+    rng = random.Random(0)
+    session_keys = []
+    for user in User.objects.filter(id__in=rng.sample(range(1, users + 1), count)):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        session_keys.append(session.session_key)
+    return session_keys
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+# Минимальный клиент HTTP/1.1 поверх asyncio: POST по открытому keep-alive соединению.
+# Без session_key запросы идут от анонимного пользователя
+class Connection:
+
+    def __init__(self, port, path, session_key):
+        self.port = port
+        self.path = path
+        cookie = f'sessionid={session_key}; ' if session_key else ''
+        self.headers = (
+            f'Host: 127.0.0.1\r\nCookie: {cookie}csrftoken={CSRF_TOKEN}\r\nX-CSRFToken: {CSRF_TOKEN}\r\n'
+            f'Connection: keep-alive\r\n'
+        )
+        self.request = self._request(path, b'')
+        self.reader = self.writer = None
+
+    def _request(self, path, body):
+        return (
+            f'POST {path} HTTP/1.1\r\n{self.headers}Content-Type: application/x-www-form-urlencoded\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'
+        ).encode() + body
+
+    # path и body (форма в urlencoded) - для запросов не к пути соединения
+    async def post(self, path=None, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.writer.write(self.request if path is None and not body else self._request(path or self.path, body))
+        await self.writer.drain()
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+        await self.reader.readexactly(int(headers.get('Content-Length') or headers.get('content-length') or 0))
+        if (headers.get('Connection') or headers.get('connection') or '').lower() == 'close':
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def active_client(connection, deadline, timings, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await connection.post()
+        except (OSError, asyncio.IncompleteReadError):
+            connection.close()
+            errors.append(1)
+            continue
+        if status == 200:
+            timings.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+    connection.close()
+
+
+async def idle_client(connection, deadline):
+    try:
+        await connection.post()
+        await asyncio.sleep(max(0, deadline - time.perf_counter()))
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    connection.close()
+
+
+async def run_load(port, path, session_keys, args):
+    deadline = time.perf_counter() + args.duration
+    timings, errors = [], []
+    clients = [
+        idle_client(Connection(port, path, session_keys[number % len(session_keys)]), deadline)
+        for number in range(args.idle)
+    ]
+    clients.extend(
+        active_client(Connection(port, path, session_keys[number % len(session_keys)]), deadline, timings, errors)
+        for number in range(args.concurrency)
+    )
+    await asyncio.gather(*clients)
+    return timings, errors
@@ -0,0 +1,94 @@
+# Замер планов запросов и задержек выборок Friendship с индексами только по внешним ключам
+# и с составными индексами (user, status) из Friendship.Meta.indexes.
+#
+#   python benchmarks/friendship_indexes.py --users 100000 --edges 1000000
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, seed_graph, explain, measure, summary
+
+
+def build_queries(page_size):
+    from django.db.models import Q
+    from api.models import Friendship
+
+    return {
+        'get_friends': lambda user_id: Friendship.objects.friends_of(user_id).order_by('id')[:page_size + 1],
+        'get_friend_requests': lambda user_id: Friendship.objects.requests_of(user_id).order_by('id')[:page_size + 1],
+        'pending_requests': lambda user_id: Friendship.objects.filter(
+            (Q(low_user=user_id) | Q(high_user=user_id)) & Q(status='pending')
+        ).values_list('id', 'initiator_id'),
+        'view_friend_status': lambda user_id: Friendship.objects.between(user_id, user_id + 1).values_list('status')[:1],
+    }
+
+
+# Базовая схема: вместо составных индексов - обычные индексы по внешним ключам low_user и high_user
+def use_foreign_key_indexes(enabled):
+    from django.db import connection, models
+    from api.models import Friendship
+
+    foreign_key_indexes = [
+        models.Index(fields=['low_user'], name='bench_low_user_idx'),
+        models.Index(fields=['high_user'], name='bench_high_user_idx'),
+    ]
+    with connection.schema_editor() as schema_editor:
+        for index in Friendship._meta.indexes:
+            (schema_editor.remove_index if enabled else schema_editor.add_index)(Friendship, index)
+        for index in foreign_key_indexes:
+            (schema_editor.add_index if enabled else schema_editor.remove_index)(Friendship, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def run_phase(queries, users, iterations, seed):
+    results = {}
+    for name, build in queries.items():
+        rng = random.Random(seed)
+        user_ids = [rng.randint(1, users - 1) for _ in range(iterations)]
+        timings = measure(lambda i: list(build(user_ids[i])), iterations)
+        results[name] = {'plan': explain(build(user_ids[0])), **summary(timings)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк индексов таблицы Friendship')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--db', default=None, help='путь к файлу базы для замера (по умолчанию временный)')
+    parser.add_argument('--json', action='store_true', help='вывести результат в формате JSON')
+    args = parser.parse_args()
+
+    setup_django()
+
+    old_name = create_database(args.db)
+    try:
+        seed_graph(args.users, args.edges)
+        queries = build_queries(args.page_size)
+        use_foreign_key_indexes(True)
+        report = {'before': run_phase(queries, args.users, args.iterations, seed=1)}
+        use_foreign_key_indexes(False)
+        report['after'] = run_phase(queries, args.users, args.iterations, seed=1)
+    finally:
+        destroy_database(old_name)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for name in report['before']:
+        print(f'== {name}')
+        for phase in ('before', 'after'):
+            result = report[phase][name]
+            print(f'  {phase:6} p50={result["p50_ms"]}ms p95={result["p95_ms"]}ms p99={result["p99_ms"]}ms')
+            for line in result['plan']:
+                print(f'         {line}')
+
+
+if __name__ == '__main__':
+    main()
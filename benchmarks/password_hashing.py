@@ -0,0 +1,96 @@
+# Входов в секунду на ядро для разных хешеров паролей и их стоимости: authenticate() вызывается
+# из параллельных потоков, хеширование выполняется в пуле api.hashers размером PASSWORD_HASH_WORKERS.
+# Конфигурации без установленной библиотеки (argon2-cffi, bcrypt) пропускаются.
+#
+#   python benchmarks/password_hashing.py --threads 16 --duration 10
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, summary
+
+CONFIGURATIONS = [
+    ('pbkdf2 (600000)', 'pbkdf2', {'PASSWORD_PBKDF2_ITERATIONS': 0}),
+    ('pbkdf2 (200000)', 'pbkdf2', {'PASSWORD_PBKDF2_ITERATIONS': 200000}),
+    ('argon2 (t=2, m=100 MiB)', 'argon2', {'PASSWORD_ARGON2_TIME_COST': 2, 'PASSWORD_ARGON2_MEMORY_COST': 102400}),
+    ('argon2 (t=2, m=19 MiB)', 'argon2', {'PASSWORD_ARGON2_TIME_COST': 2, 'PASSWORD_ARGON2_MEMORY_COST': 19456}),
+    ('bcrypt (12)', 'bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 12}),
+    ('bcrypt (10)', 'bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 10}),
+]
+
+
+def worker(username, deadline, timings, failures):
+    from django.contrib.auth import authenticate
+    from django.db import connection
+
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if authenticate(username=username, password='benchmark-password') is None:
+                failures.append(1)
+            else:
+                timings.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+
+
+def run_configuration(number, hasher, overrides, args):
+    from django.conf import settings
+    from django.test import override_settings
+    from api.models import User
+
+    hasher_path = settings.PASSWORD_HASHER_CLASSES[hasher]
+    hashers = [hasher_path] + [path for path in settings.PASSWORD_HASHERS if path != hasher_path]
+    with override_settings(PASSWORD_HASHERS=hashers, PASSWORD_HASH_WORKERS=args.pool, **overrides):
+        try:
+            username = f'bench{number}'
+            User.objects.create_user(username=username, password='benchmark-password')
+        except ValueError:
+            # Django сообщает об отсутствии библиотеки хешера через ValueError
+            return None
+        deadline = time.perf_counter() + args.duration
+        timings, failures = [], []
+        threads = [threading.Thread(target=worker, args=(username, deadline, timings, failures)) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    logins_per_second = len(timings) / elapsed
+    return {
+        'logins_per_second': round(logins_per_second, 1),
+        'logins_per_second_per_core': round(logins_per_second / min(args.pool, os.cpu_count() or 1), 1),
+        'failures': len(failures),
+        **summary(timings or [0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--pool', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    old_name = create_database()
+    try:
+        results = {}
+        for number, (name, hasher, overrides) in enumerate(CONFIGURATIONS):
+            results[name] = run_configuration(number, hasher, overrides, args) or 'skipped: library is not installed'
+    finally:
+        destroy_database(old_name)
+    print(json.dumps({
+        'cpu_count': os.cpu_count(), 'threads': args.threads, 'pool': args.pool, 'results': results,
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Масштабирование get_friends по числу процессов gunicorn с настройками из gunicorn.conf.py:
+# для каждого числа процессов сервер запускается заново и нагружается одинаковым числом keep-alive клиентов.
+# Нагрузка создается из нескольких процессов, чтобы генератор не упирался в одно ядро раньше сервера.
+# Нужен пакет gunicorn; для --cache с несколькими процессами - Redis (--cache-url).
+#
+#   python benchmarks/scaling.py --users 20000 --edges 200000 --workers 1,2,4,8 --concurrency 64 --duration 15
+#   python benchmarks/scaling.py --workers 1,2,4 --cache --cache-url redis://localhost:6379/0
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import (
+    BASE_DIR, setup_django, create_database, destroy_database, seed_graph, summary,
+    create_sessions, free_port, wait_for_port, run_load,
+)
+
+
+def load_process(task):
+    port, session_keys, concurrency, duration = task
+    return asyncio.run(run_load(port, '/get_friends/', session_keys, Namespace(
+        concurrency=concurrency, idle=0, duration=duration
+    )))
+
+
+def run_server(workers, database_path, session_keys, args):
+    port = free_port()
+    env = dict(
+        os.environ, DB_NAME=database_path, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(args.threads),
+        GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='', GUNICORN_LOG_LEVEL='warning',
+        FRIEND_CACHE_ENABLED='1' if args.cache else '0', DJANGO_DEBUG='0', DJANGO_ALLOWED_HOSTS='127.0.0.1',
+    )
+    if args.cache_url:
+        env['FRIEND_CACHE_URL'] = args.cache_url
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=BASE_DIR, env=env)
+    try:
+        wait_for_port(port)
+        share = args.concurrency // args.load_processes
+        tasks = [
+            (port, session_keys[number::args.load_processes], share, args.duration)
+            for number in range(args.load_processes)
+        ]
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.load_processes) as pool:
+            results = pool.map(load_process, tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    timings = [timing for process_timings, _ in results for timing in process_timings]
+    errors = sum(len(process_errors) for _, process_errors in results)
+    return {
+        'workers': workers,
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'errors': errors,
+        **summary(timings or [0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--workers', default=','.join(
+        str(2 ** power) for power in range((os.cpu_count() or 1).bit_length()) if 2 ** power <= (os.cpu_count() or 1)
+    ))
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--load-processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--cache', action='store_true', help='читать списки через кэш графа')
+    parser.add_argument('--cache-url', default=os.environ.get('FRIEND_CACHE_URL'),
+                        help='общий кэш для --cache, например redis://localhost:6379/0 (FRIEND_CACHE_URL)')
+    args = parser.parse_args()
+    # gunicorn не запускает несколько процессов с кэшем графа в памяти каждого процесса
+    if args.cache and not args.cache_url and any(int(workers) > 1 for workers in args.workers.split(',')):
+        parser.error('--cache с несколькими процессами требует --cache-url')
+
+    setup_django()
+    from django.db import connection
+
+    old_name = create_database()
+    try:
+        seed_graph(args.users, args.edges)
+        session_keys = create_sessions(min(args.sessions, args.users), args.users)
+        database_path = str(connection.settings_dict['NAME'])
+        connection.close()
+        results = [run_server(int(workers), database_path, session_keys, args) for workers in args.workers.split(',')]
+    finally:
+        destroy_database(old_name)
+    base = results[0]['requests_per_second'] / results[0]['workers'] or 1
+    for result in results:
+        result['speedup'] = round(result['requests_per_second'] / (base * results[0]['workers']), 2)
+        result['efficiency'] = round(result['requests_per_second'] / (base * result['workers']), 2)
+    print(json.dumps({
+        'users': args.users, 'edges': args.edges, 'cpu_count': os.cpu_count(), 'concurrency': args.concurrency,
+        'threads': args.threads, 'cache': args.cache, 'cache_url': args.cache_url, 'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Время подготовки и кодирования ответа get_friends в зависимости от длины списка: прежний путь (список словарей
+# и JSONRenderer из DRF со стандартным json) против api.renderers.Rows с orjson, компактным видом и MessagePack.
+# База не нужна: строки списка генерируются в том же виде, в каком их отдает Friendship.objects.friends_of.
+#
+#   python benchmarks/serialization.py --sizes 100,1000,10000,50000 --iterations 50
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, measure, summary
+
+
+def encoders():
+    from rest_framework.renderers import JSONRenderer
+    from api import renderers
+    from api.views import _friends_data
+
+    def drf_json(rows):
+        friend_list = [{'id': friend_id, 'username': username} for _, friend_id, username in rows]
+        return JSONRenderer().render({'friends': friend_list, 'next_cursor': None})
+
+    formats = {
+        'drf_json': drf_json,
+        'fast_json': lambda rows: renderers.FastJSONRenderer().render(_friends_data(rows, None)),
+        'compact_json': lambda rows: renderers.CompactJSONRenderer().render(_friends_data(rows, None)),
+    }
+    if renderers.msgpack is not None:
+        formats['msgpack'] = lambda rows: renderers.MessagePackRenderer().render(_friends_data(rows, None))
+        formats['compact_msgpack'] = lambda rows: renderers.CompactMessagePackRenderer().render(_friends_data(rows, None))
+    return formats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,10000,50000')
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from api import renderers
+
+    formats = encoders()
+    results = {}
+    for size in map(int, args.sizes.split(',')):
+        rows = [(row_id, 100000 + row_id, f'user{100000 + row_id}') for row_id in range(1, size + 1)]
+        results[size] = {}
+        for name, encode in formats.items():
+            body = encode(rows)
+            timings = measure(lambda _: encode(rows), args.iterations)
+            results[size][name] = {'bytes': len(body), **summary(timings)}
+    print(json.dumps({
+        'orjson': renderers.orjson is not None,
+        'msgpack': renderers.msgpack is not None,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
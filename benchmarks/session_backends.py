@@ -0,0 +1,77 @@
+# Пропускная способность входа и объем записи в базу для хранилищ сессий из settings.SESSION_ENGINES:
+# на каждый вход приходится requests-per-login авторизованных чтений списка друзей, считаются все
+# INSERT/UPDATE/DELETE и обращения к django_session. Хеширование пароля удешевлено, чтобы не заслонять сессии.
+#
+#   python benchmarks/session_backends.py --users 20000 --edges 200000 --logins 500 --requests-per-login 5
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, seed_graph
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def run_backend(backend, args):
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+    from api.models import User
+
+    login_url, friends_url = reverse('login'), reverse('get_friends')
+    with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[backend], PASSWORD_PBKDF2_ITERATIONS=1000):
+        cache.clear()
+        for user in User.objects.filter(id__lte=args.logins):
+            user.set_password('benchmark-password')
+            user.save(update_fields=['password'])
+        login_time = 0
+        with CaptureQueriesContext(connection) as queries:
+            for user_id in range(1, args.logins + 1):
+                client = Client()
+                started = time.perf_counter()
+                client.post(login_url, {'username': f'user{user_id}', 'password': 'benchmark-password'})
+                login_time += time.perf_counter() - started
+                for _ in range(args.requests_per_login):
+                    client.post(friends_url)
+    sqls = [query['sql'] for query in queries.captured_queries]
+    return {
+        'logins_per_second': round(args.logins / login_time, 1),
+        'db_writes_per_login': round(sum(sql.startswith(WRITES) for sql in sqls) / args.logins, 2),
+        'session_writes_per_login': round(sum(sql.startswith(WRITES) and 'django_session' in sql for sql in sqls) / args.logins, 2),
+        'session_reads_per_request': round(
+            sum(sql.startswith('SELECT') and 'django_session' in sql for sql in sqls) / (args.logins * args.requests_per_login), 2
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--requests-per-login', type=int, default=5)
+    parser.add_argument('--backends', default='db,cached_db,cache,signed_cookies')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = create_database()
+    try:
+        seed_graph(args.users, args.edges)
+        results = {backend: run_backend(backend, args) for backend in args.backends.split(',')}
+    finally:
+        destroy_database(old_name)
+    print(json.dumps({'users': args.users, 'logins': args.logins, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
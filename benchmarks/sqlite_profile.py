@@ -0,0 +1,120 @@
+# Пропускная способность читателей списка друзей при одновременной отправке заявок:
+# SQLite по умолчанию (журнал DELETE, новое соединение на каждый запрос) против профиля production
+# из settings.SQLITE_PROFILES (WAL, synchronous=NORMAL, busy_timeout, mmap, постоянные соединения).
+#
+#   python benchmarks/sqlite_profile.py --users 20000 --edges 200000 --readers 8 --writers 2 --duration 10
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, seed_graph, summary
+
+# Базовый профиль явно возвращает журнал DELETE: режим WAL сохраняется в файле базы
+BASELINE_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def worker(operation, reuse_connection, deadline, timings, errors, seed):
+    from django.db import connection, OperationalError
+
+    rng = random.Random(seed)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                operation(rng)
+            except OperationalError:
+                errors.append(1)
+            else:
+                timings.append(time.perf_counter() - started)
+            if not reuse_connection:
+                connection.close()
+    finally:
+        connection.close()
+
+
+def run_phase(pragmas, reuse_connection, args):
+    from django.conf import settings
+    from django.db import connection
+    from api.models import User, Friendship
+    from api import friendships
+
+    connection.close()
+    settings.SQLITE_PRAGMAS = pragmas
+    connection.ensure_connection()
+    connection.close()
+
+    def read(rng):
+        list(Friendship.objects.friends_of(rng.randint(1, args.users)).order_by('id')[:100])
+
+    def write(rng):
+        user_id, target_id = rng.randint(1, args.users), rng.randint(1, args.users)
+        friendships.send_requests(User(id=user_id), [target_id])
+
+    deadline = time.perf_counter() + args.duration
+    read_timings, write_timings, read_errors, write_errors = [], [], [], []
+    threads = [
+        threading.Thread(target=worker, args=(read, reuse_connection, deadline, read_timings, read_errors, number))
+        for number in range(args.readers)
+    ] + [
+        threading.Thread(target=worker, args=(write, reuse_connection, deadline, write_timings, write_errors, 1000 + number))
+        for number in range(args.writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'reads_per_second': round(len(read_timings) / args.duration, 1),
+        'writes_per_second': round(len(write_timings) / args.duration, 1),
+        'read_errors': len(read_errors),
+        'write_errors': len(write_errors),
+        'read': summary(read_timings) if read_timings else None,
+        'write': summary(write_timings) if write_timings else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк профиля SQLite под смешанной нагрузкой')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--db', default=None, help='путь к файлу базы для замера (по умолчанию временный)')
+    parser.add_argument('--json', action='store_true', help='вывести результат в формате JSON')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+
+    production_pragmas = settings.SQLITE_PROFILES['production']
+    old_name = create_database(args.db)
+    try:
+        seed_graph(args.users, args.edges)
+        report = {
+            'default': run_phase(BASELINE_PRAGMAS, False, args),
+            'production': run_phase(production_pragmas, True, args),
+        }
+    finally:
+        destroy_database(old_name)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for name, result in report.items():
+        print(f'== {name}')
+        print(f'  reads/s={result["reads_per_second"]} writes/s={result["writes_per_second"]} '
+              f'read_errors={result["read_errors"]} write_errors={result["write_errors"]}')
+        for kind in ('read', 'write'):
+            if result[kind]:
+                print(f'  {kind:5} p50={result[kind]["p50_ms"]}ms p95={result[kind]["p95_ms"]}ms p99={result[kind]["p99_ms"]}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Замер задержек общих друзей и рекомендаций "возможно, вы знакомы" на синтетическом графе
+# с популярными пользователями-хабами: обычные пользователи, друзья хабов и сами хабы,
+# без кэша графа, с включенным пустым и с прогретым кэшем.
+#
+#   python benchmarks/suggestions.py --users 100000 --edges 1000000 --hubs 20 --hub-share 0.2
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, seed_graph, measure, summary
+
+
+def pick_users(args, rng):
+    from django.db.models import Q
+    from api.models import Friendship
+
+    regular = [rng.randint(args.hubs + 1, args.users) for _ in range(args.iterations)]
+    hubs = [rng.randint(1, args.hubs) for _ in range(args.iterations)] if args.hubs else []
+    hub_friends = list(Friendship.objects.filter(
+        Q(low_user__lte=args.hubs) & Q(high_user__gt=args.hubs) & Q(status='accepted')
+    ).values_list('high_user_id', flat=True)[:args.iterations])
+    groups = {'regular': regular, 'hub_friend': hub_friends, 'hub': hubs}
+    return {name: user_ids for name, user_ids in groups.items() if user_ids}
+
+
+def run(groups, args):
+    from django.core.cache import caches
+    from django.conf import settings
+    from django.test import override_settings
+    from api import suggestions
+
+    report = {}
+    for name, user_ids in groups.items():
+        others = [user_id % args.users + 1 for user_id in user_ids]
+        # uncached - без кэша графа (по умолчанию без FRIEND_CACHE_URL), cold - кэш включен и пуст, warm - прогрет
+        for cache_state in ('uncached', 'cold', 'warm'):
+            with override_settings(FRIEND_CACHE_ENABLED=cache_state != 'uncached'):
+                caches[settings.FRIEND_CACHE_ALIAS].clear()
+                if cache_state == 'warm':
+                    from api import cache as friend_cache
+                    for user_id in set(user_ids + others):
+                        friend_cache.friends(user_id)
+                report[f'{name}/mutual_friends/{cache_state}'] = summary(measure(
+                    lambda i: suggestions.mutual_friends(user_ids[i], others[i]), len(user_ids)
+                ))
+                report[f'{name}/suggest_friends/{cache_state}'] = summary(measure(
+                    lambda i: suggestions.suggest_friends(user_ids[i], args.limit), len(user_ids)
+                ))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк общих друзей и рекомендаций')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=1000000)
+    parser.add_argument('--hubs', type=int, default=20)
+    parser.add_argument('--hub-share', type=float, default=0.2)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--db', default=None, help='путь к файлу базы для замера (по умолчанию временный)')
+    parser.add_argument('--json', action='store_true', help='вывести результат в формате JSON')
+    args = parser.parse_args()
+
+    setup_django()
+
+    old_name = create_database(args.db)
+    try:
+        seed_graph(args.users, args.edges, hubs=args.hubs, hub_share=args.hub_share)
+        report = run(pick_users(args, random.Random(1)), args)
+    finally:
+        destroy_database(old_name)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for name, result in report.items():
+        print(f'{name:40} p50={result["p50_ms"]}ms p95={result["p95_ms"]}ms p99={result["p99_ms"]}ms')
+
+
+if __name__ == '__main__':
+    main()
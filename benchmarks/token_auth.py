@@ -0,0 +1,78 @@
+# Запросы к базе и задержка на один запрос для авторизованных представлений: сессия
+# (django_session + загрузка пользователя) против подписанного access-токена из api.tokens.
+# Кэш графа отключается, чтобы в счет попадали только запросы авторизации и самих данных.
+#
+#   python benchmarks/token_auth.py --users 20000 --edges 200000 --requests 500
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import setup_django, create_database, destroy_database, seed_graph, measure, summary
+
+VIEWS = ['get_friends', 'get_friend_requests', 'friendship_status', 'friend_counts']
+
+
+def run_mode(mode, args):
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+    from api import tokens
+    from api.models import User
+
+    rng = random.Random(0)
+    users = list(User.objects.filter(id__in=rng.sample(range(1, args.users + 1), args.clients)))
+    results = {}
+    with override_settings(AUTH_TOKENS_ENABLED=mode == 'token', FRIEND_CACHE_ENABLED=False):
+        clients = []
+        for user in users:
+            client = Client()
+            headers = {}
+            if mode == 'token':
+                headers['HTTP_AUTHORIZATION'] = f'Bearer {tokens.issue_pair(user)["access_token"]}'
+            else:
+                client.force_login(user)
+            clients.append((client, headers))
+
+        for view in VIEWS:
+            url = reverse(view)
+            query_counts = []
+
+            def request(number):
+                client, headers = clients[number % len(clients)]
+                with CaptureQueriesContext(connection) as queries:
+                    client.post(url, {'friend_id': rng.randint(1, args.users)}, **headers)
+                query_counts.append(len(queries))
+
+            timings = measure(request, args.requests)
+            results[view] = {'queries_per_request': round(sum(query_counts) / len(query_counts), 2), **summary(timings)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--edges', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = create_database()
+    try:
+        seed_graph(args.users, args.edges)
+        results = {mode: run_mode(mode, args) for mode in ('session', 'token')}
+    finally:
+        destroy_database(old_name)
+    print(json.dumps({'users': args.users, 'edges': args.edges, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+#!/bin/sh
+# Миграции выполняются при старте контейнера, а не при сборке образа: база подключается уже в рабочем окружении.
+# DJANGO_MIGRATE=0 отключает их, например для всех экземпляров сервиса, кроме одного
+set -e
+
+if [ "${DJANGO_MIGRATE:-1}" = "1" ]; then
+    python manage.py migrate --noinput
+fi
+
+# Без аргументов запускается gunicorn с настройками из gunicorn.conf.py, иначе - переданная команда
+if [ "$#" -eq 0 ]; then
+    set -- gunicorn -c gunicorn.conf.py
+fi
+
+exec "$@"
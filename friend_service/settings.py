@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,9 +25,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-t(1(xuyx7r-cb9ggya37-smx=go%hy#05dab#uok5*m=-n4@8l'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -42,11 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.TokenAuthenticationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,8 +92,214 @@ SWAGGER_SETTINGS = {
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        # Persistent connections: seconds to keep a connection open between requests, 0 closes it after each request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # File-backed test database so that tests running queries from several threads share it
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# SQLite pragmas applied by api.db to every new connection.
+# SQLITE_PROFILE=development (the default) only sets per-connection pragmas: busy_timeout makes writers wait
+# for the lock instead of failing with "database is locked", and the database file is left in its journal mode.
+# SQLITE_PROFILE=production (set in the Dockerfile) adds WAL, which lets readers work while a writer holds
+# the lock, and synchronous=NORMAL, durable with WAL except for the last transactions on power loss.
+# WAL is stored in the database file itself and creates the -wal and -shm files next to it.
+# SQLITE_PROFILE=default keeps the SQLite defaults
+
+SQLITE_PROFILES = {
+    'default': {},
+    'development': {
+        'busy_timeout': 5000,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+}
+
+SQLITE_PRAGMAS = SQLITE_PROFILES[os.environ.get('SQLITE_PROFILE', 'development')]
+
+# DB_ENGINE=postgresql switches the primary database to PostgreSQL configured by DB_* variables.
+# Connections are kept open for DB_CONN_MAX_AGE seconds; with PgBouncer in transaction pooling mode
+# set DB_PGBOUNCER=1, since server-side cursors do not survive across pooled transactions
+
+if os.environ.get('DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'friend_service'),
+        'USER': os.environ.get('DB_USER', 'friend_service'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER') == '1',
+    }
+
+# Read replica: DB_REPLICA_HOST (PostgreSQL) or DB_REPLICA_NAME (another database name or SQLite file)
+# turns on api.routers.PrimaryReplicaRouter. Without them the replica alias points to the primary and is unused
+
+DATABASE_REPLICA = os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME')
+
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+    'NAME': os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+    'TEST': {
+        'MIRROR': 'default',
+    },
+}
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter'] if DATABASE_REPLICA else []
+
+# Read-only views served from the replica, by url name
+DATABASE_REPLICA_VIEWS = {
+    'get_friends',
+    'get_friend_requests',
+    'friendship_status',
+    'friendship_statuses',
+    'mutual_friends',
+    'friend_suggestions',
+    'friend_counts',
+    'friend_events',
+    'async_get_friends',
+    'async_get_friend_requests',
+    'async_friendship_status',
+    'async_friend_counts',
+    'async_friend_events',
+    'async_friend_events_stream',
+}
+
+# After a user's own write their reads go to the primary for this many seconds
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default; FRIEND_CACHE_URL=redis://host:port/db switches to a shared Redis cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('FRIEND_CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['FRIEND_CACHE_URL'],
     }
+
+# Per-user friend lists and request lists cached by api.cache.
+# On by default only with a shared cache: every gunicorn worker has its own locmem cache, and invalidation
+# after a write would clear only the worker that made it. gunicorn.conf.py refuses to start several workers
+# when this or another setting that needs a shared cache is on without FRIEND_CACHE_URL
+
+FRIEND_CACHE_ENABLED = os.environ.get('FRIEND_CACHE_ENABLED', '1' if os.environ.get('FRIEND_CACHE_URL') else '0') == '1'
+
+FRIEND_CACHE_ALIAS = 'default'
+
+FRIEND_CACHE_TIMEOUT = int(os.environ.get('FRIEND_CACHE_TIMEOUT', 300))
+
+# Invalidation leaves a marker for this many seconds instead of deleting the lists: a read that loaded
+# the lists before the write committed cannot store them back while the marker is there
+
+FRIEND_CACHE_INVALIDATION_TIMEOUT = int(os.environ.get('FRIEND_CACHE_INVALIDATION_TIMEOUT', 10))
+
+# In-process compact adjacency index built by api.graph_index.
+# Each process only sees its own writes, so the index is rebuilt after
+# FRIEND_GRAPH_INDEX_MAX_AGE seconds or FRIEND_GRAPH_INDEX_MAX_OVERLAY changed edge ends
+
+FRIEND_GRAPH_INDEX = os.environ.get('FRIEND_GRAPH_INDEX', '0') == '1'
+
+FRIEND_GRAPH_INDEX_MAX_AGE = int(os.environ.get('FRIEND_GRAPH_INDEX_MAX_AGE', 600))
+
+FRIEND_GRAPH_INDEX_MAX_OVERLAY = 100000
+
+# Seconds between checks of the index generation in the friend cache, bumped by import_graph
+# to make every process rebuild its index (needs a shared cache, FRIEND_CACHE_URL)
+
+FRIEND_GRAPH_INDEX_CHECK_INTERVAL = float(os.environ.get('FRIEND_GRAPH_INDEX_CHECK_INTERVAL', 5))
+
+
+# Signed token authentication by api.tokens: login_user and register_user return access and refresh
+# tokens instead of creating a session, requests authenticate with "Authorization: Bearer <access token>".
+# Revoked tokens are kept in AUTH_TOKEN_CACHE_ALIAS, which must be shared between processes (FRIEND_CACHE_URL)
+
+AUTH_TOKENS_ENABLED = os.environ.get('AUTH_TOKENS_ENABLED', '0') == '1'
+
+AUTH_ACCESS_TOKEN_LIFETIME = int(os.environ.get('AUTH_ACCESS_TOKEN_LIFETIME', 300))
+
+AUTH_REFRESH_TOKEN_LIFETIME = int(os.environ.get('AUTH_REFRESH_TOKEN_LIFETIME', 14 * 24 * 3600))
+
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.tokens.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+
+# Session storage: db (default), cached_db (reads from the cache, writes through to the database),
+# cache (no database traffic, needs a shared cache such as FRIEND_CACHE_URL with several processes)
+# or signed_cookies (session data lives in the cookie). Expired database sessions are removed by
+# 'python manage.py cleanup_sessions'
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('SESSION_BACKEND', 'db')]
+
+SESSION_COOKIE_AGE = int(os.environ.get('SESSION_COOKIE_AGE', 14 * 24 * 3600))
+
+
+# Request metrics on /metrics in the Prometheus text format, collected by api.middleware.RequestMetricsMiddleware.
+# With several gunicorn workers set METRICS_DIR to a directory shared by the workers: each worker writes its
+# metrics there every METRICS_FLUSH_INTERVAL seconds and /metrics sums them. Requests slower than
+# METRICS_SLOW_REQUEST_MS are logged to api.metrics with up to METRICS_SLOW_REQUEST_MAX_QUERIES of their SQL (0 disables)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 0))
+
+METRICS_SLOW_REQUEST_MAX_QUERIES = 50
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
 }
 
 
@@ -111,6 +322,37 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing by api.hashers. PASSWORD_HASHER picks the hasher for new hashes (pbkdf2, argon2 or bcrypt);
+# the others stay in the list so existing hashes still verify and are upgraded on the next login.
+# argon2 needs argon2-cffi, bcrypt needs the bcrypt package
+
+PASSWORD_HASHER_CLASSES = {
+    'pbkdf2': 'api.hashers.PBKDF2PooledPasswordHasher',
+    'argon2': 'api.hashers.Argon2PooledPasswordHasher',
+    'bcrypt': 'api.hashers.BCryptSHA256PooledPasswordHasher',
+}
+
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Hash cost; 0 iterations means Django's default for PBKDF2
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 0))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 102400))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+
+# Hashing pool: worker threads, extra queued hashes and seconds to wait for a slot before answering 503
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 4 * (os.cpu_count() or 1)))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -128,9 +370,73 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic gathers the admin and swagger UI files here; with DEBUG off they are served
+# by WhiteNoise when it is installed (the Docker image installs it and runs collectstatic)
+
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+if find_spec('whitenoise') is not None:
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CSRF_COOKIE_HTTPONLY = False
\ No newline at end of file
+CSRF_COOKIE_HTTPONLY = False
+
+# Pagination of friend lists
+# Default and maximum page size for get_friends and get_friend_requests
+
+FRIENDS_PAGE_SIZE = 100
+
+FRIENDS_MAX_PAGE_SIZE = 1000
+
+# Cache-Control of GET get_friends and get_friend_requests. Responses carry an ETag built from the user's
+# graph_version and Vary: Cookie, Authorization. The default lets a local reverse proxy store them (must-revalidate
+# also allows it for requests with Authorization) but makes it revalidate every time, so the backend still checks
+# the credentials and answers an unchanged list with 304
+
+FRIEND_LIST_CACHE_CONTROL = os.environ.get('FRIEND_LIST_CACHE_CONTROL', 'no-cache, must-revalidate')
+
+# Maximum number of user ids accepted by view_friend_statuses
+
+FRIEND_STATUS_BATCH_LIMIT = 100
+
+# Maximum number of user ids accepted by batch_friend_operations
+
+FRIEND_BATCH_LIMIT = 1000
+
+# Friendship event feed (api.events)
+# Default and maximum number of events per response of get_friend_events
+FRIEND_EVENTS_PAGE_SIZE = 100
+
+FRIEND_EVENTS_MAX_PAGE_SIZE = 1000
+
+# Async long-poll and server-sent events: how often the feed is checked for new events, the longest
+# long-poll wait, how long a stream stays open before the client reconnects with Last-Event-ID,
+# and how often an idle stream sends a comment line to keep proxies from closing it (all in seconds)
+FRIEND_EVENTS_POLL_INTERVAL = float(os.environ.get('FRIEND_EVENTS_POLL_INTERVAL', 1))
+
+FRIEND_EVENTS_MAX_WAIT = 30
+
+FRIEND_EVENTS_STREAM_TIMEOUT = int(os.environ.get('FRIEND_EVENTS_STREAM_TIMEOUT', 300))
+
+FRIEND_EVENTS_HEARTBEAT = 15
+
+# Streaming export of friendships (export_friendships view and export_graph command):
+# rows fetched from the database per round trip and bytes per chunk written to the client
+
+FRIEND_EXPORT_CHUNK_SIZE = 2000
+
+FRIEND_EXPORT_BUFFER_SIZE = 64 * 1024
+
+# Friend suggestions
+# Default and maximum number of suggestions returned by get_friend_suggestions,
+# and how many of the user's most recent friends are used as suggestion sources
+
+FRIEND_SUGGESTIONS_LIMIT = 20
+
+FRIEND_SUGGESTIONS_MAX_LIMIT = 100
+
+FRIEND_SUGGESTIONS_SOURCE_FRIENDS = 200
@@ -0,0 +1,72 @@
+# Настройки gunicorn для запуска сервиса в контейнере: 'gunicorn -c gunicorn.conf.py'.
+# Все значения можно переопределить переменными окружения GUNICORN_*
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# По умолчанию два процесса на ядро плюс один: пока один процесс ждет базу, другой занимает ядро
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# gthread - синхронные представления в потоках; uvicorn.workers.UvicornWorker - ASGI для api.async_views
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+wsgi_app = 'friend_service.asgi:application' if 'uvicorn' in worker_class.lower() else 'friend_service.wsgi:application'
+
+# Приложение загружается в главном процессе до fork: процессы стартуют быстрее и делят память импортированного кода
+preload_app = True
+
+# Перезапуск процесса после max_requests запросов ограничивает рост памяти; jitter разносит перезапуски во времени
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Индекс графа (FRIEND_GRAPH_INDEX=1) строится в главном процессе до fork, и его массивы
+# достаются процессам без копирования, пока те не начнут их менять
+def when_ready(server):
+    from django.db import connections
+    from api import graph_index
+
+    if graph_index.enabled():
+        stats = graph_index.get().stats()
+        server.log.info('graph index warmed: %s users, %s edges', stats['users'], stats['edges'])
+    # Соединения с базой не должны переходить в дочерние процессы
+    connections.close_all()
+
+
+# Файлы метрик процессов прошлого запуска (METRICS_DIR) удаляются, иначе /metrics продолжал бы их складывать.
+# Несколько процессов не запускаются с настройками, которым нужен общий кэш, пока кэш хранится в памяти процесса
+def on_starting(server):
+    if workers > 1:
+        check_shared_cache(server)
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def check_shared_cache(server):
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'friend_service.settings')
+    django.setup()
+    from api import cache
+
+    names = cache.process_local_settings()
+    if names:
+        server.log.error(
+            'settings %s need a cache shared by the %s workers: set FRIEND_CACHE_URL=redis://host:port/db, '
+            'turn these settings off or set GUNICORN_WORKERS=1', ', '.join(names), workers
+        )
+        sys.exit(1)